@@ -0,0 +1,70 @@
+"""
+    Report the GPU buffer sizes of a model uploaded as expanded vertex
+    streams (glDrawArrays) and as deduplicated vertices plus a uint32
+    index buffer (glDrawElements).
+
+    Usage: python -m benchmarks.bench_mesh_indexing [--faces N] [--obj path]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.obj_loader import load_multi_material_mesh
+from benchmarks.synthetic_obj import write_synthetic_obj
+
+
+def mib(size: int) -> str:
+
+    return f"{size / 2**20:9.2f} MiB"
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--faces", type=int, default=1_000_000,
+        help="number of faces of the synthetic model")
+    parser.add_argument("--obj", help="measure an existing obj file instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.obj
+        if path is None:
+            path = os.path.join(directory, "synthetic.obj")
+            print(f"Writing synthetic model with {args.faces} faces...")
+            write_synthetic_obj(path, args.faces)
+
+        start = time.perf_counter()
+        expanded = load_multi_material_mesh(path)
+        expanded_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        indexed = load_multi_material_mesh(path, indexed=True)
+        indexed_time = time.perf_counter() - start
+
+    print(f"{'material':<24}{'corners':>12}{'unique':>12}{'arrays':>14}{'elements':>14}")
+    before = after = 0
+    identical = True
+    for name, group in expanded.items():
+        vertices = indexed[name]["vertices"]
+        indices = indexed[name]["indices"]
+        corner_count = len(group["vertices"]) // 8
+
+        before += group["vertices"].nbytes
+        after += vertices.nbytes + indices.nbytes
+        identical &= np.array_equal(
+            vertices.reshape(-1, 8)[indices].ravel(), group["vertices"])
+
+        print(f"{name:<24}{corner_count:>12}{len(vertices) // 8:>12}"
+              f"{mib(group['vertices'].nbytes):>14}{mib(vertices.nbytes + indices.nbytes):>14}")
+
+    print(f"total buffer size: {mib(before)} -> {mib(after)} "
+          f"({100 * (1 - after / max(before, 1)):.1f}% smaller)")
+    print(f"load time:         {expanded_time:.2f} s -> {indexed_time:.2f} s")
+    print("indexed geometry matches expanded streams:", identical)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+    Compare the chunked numpy obj parser with the original line by line
+    loader on a synthetic model.
+
+    Usage: python -m benchmarks.bench_obj_loader [--faces N] [--obj path] [--workers N] [--messy]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.obj_loader import (
+    load_multi_material_mesh, parse_mtl_for_material_textures,
+    read_vertex_data, read_texcoord_data, read_normal_data, get_corner)
+from benchmarks.synthetic_obj import write_synthetic_obj
+
+
+def reference_load_multi_material_mesh(obj_file_path: str) -> dict[str, dict]:
+    """
+        The original per-line loader, kept as the baseline.
+    """
+
+    v, vt, vn = [], [], []
+    material_groups = {}
+    current_material = None
+    mtl_file = None
+
+    with open(obj_file_path, "r") as file:
+        for line in file:
+            words = line.split("#", 1)[0].split()
+            if not words:
+                continue
+
+            match words[0]:
+                case "mtllib":
+                    mtl_file = words[1]
+                case "usemtl":
+                    try:
+                        current_material = words[1]
+                    except IndexError:
+                        current_material = "Material.002"
+                    if current_material not in material_groups:
+                        material_groups[current_material] = {"vertices": []}
+                case "v":
+                    v.append(read_vertex_data(words))
+                case "vt":
+                    vt.append(read_texcoord_data(words))
+                case "vn":
+                    vn.append(read_normal_data(words))
+                case "f":
+                    if current_material is None:
+                        continue
+                    face_vertices = []
+                    triangleCount = len(words) - 3
+                    for i in range(triangleCount):
+                        face_vertices += get_corner(words[1], v, vt, vn)
+                        face_vertices += get_corner(words[2 + i], v, vt, vn)
+                        face_vertices += get_corner(words[3 + i], v, vt, vn)
+                    material_groups[current_material]["vertices"].extend(face_vertices)
+
+    if mtl_file:
+        mtl_path = os.path.join(os.path.dirname(obj_file_path), mtl_file)
+        parse_mtl_for_material_textures(mtl_path, material_groups)
+
+    return material_groups
+
+
+def time_call(function, *args):
+    """
+        Returns the result of the call and its duration in seconds.
+    """
+
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--faces", type=int, default=1_000_000,
+        help="number of faces of the synthetic model")
+    parser.add_argument("--obj", help="benchmark an existing obj file instead")
+    parser.add_argument("--workers", type=int, default=1,
+        help="number of processes building the material groups")
+    parser.add_argument("--messy", action="store_true",
+        help="indent records and add trailing comments to the synthetic model")
+    parser.add_argument("--skip-reference", action="store_true",
+        help="only time the numpy parser")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.obj
+        if path is None:
+            path = os.path.join(directory, "synthetic.obj")
+            print(f"Writing synthetic model with {args.faces} faces...")
+            write_synthetic_obj(path, args.faces, messy=args.messy)
+        print(f"{path}: {os.path.getsize(path) / 2**20:.1f} MiB")
+
+        groups, fast = time_call(load_multi_material_mesh, path, False, args.workers)
+        print(f"numpy parser:     {fast:8.2f} s  ({args.workers} worker(s))")
+        if args.skip_reference:
+            return
+
+        reference, slow = time_call(reference_load_multi_material_mesh, path)
+        print(f"per-line loader:  {slow:8.2f} s  ({slow / fast:.1f}x slower)")
+
+    identical = list(groups) == list(reference)
+    for name, group in groups.items():
+        expected = reference[name]
+        identical &= group["vertices"].tobytes() \
+            == np.array(expected["vertices"], dtype=np.float32).tobytes()
+        identical &= group.get("texture") == expected.get("texture")
+        identical &= group.get("color") == expected.get("color")
+    print("vertex streams identical:", identical)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+
+
+def write_synthetic_obj(path: str, face_count: int, material_count: int = 8, 
+    run_length: int = 5000, messy: bool = False) -> None:
+    """
+        Write a tessellated grid as an obj file, with a matching .mtl file.
+
+        Parameters:
+
+            path: where to write the .obj file
+
+            face_count: approximate number of faces to write, alternating
+                        quads and pairs of triangles
+
+            material_count: number of materials the faces cycle through
+
+            run_length: number of faces between two usemtl statements
+
+            messy: indent every other record and end every third one
+                   with a comment, as some exporters do
+    """
+
+    side = max(2, int(np.ceil(np.sqrt(face_count / 1.5))))
+    grid = np.arange((side + 1) ** 2).reshape(side + 1, side + 1) + 1
+
+    x, y = np.meshgrid(np.linspace(-50, 50, side + 1), np.linspace(-50, 50, side + 1))
+    z = np.sin(x * 0.3) * np.cos(y * 0.2)
+    positions = np.stack((x.ravel(), y.ravel(), z.ravel()), axis=1)
+    texcoords = np.stack(((x.ravel() + 50) / 100, (y.ravel() + 50) / 100), axis=1)
+    normals = np.array([[0, 0, 1], [0, 1, 0], [1, 0, 0]], dtype=np.float64)
+
+    a = grid[:-1, :-1].ravel()
+    b = grid[:-1, 1:].ravel()
+    c = grid[1:, 1:].ravel()
+    d = grid[1:, :-1].ravel()
+
+    mtl_name = os.path.splitext(os.path.basename(path))[0] + ".mtl"
+    with open(os.path.join(os.path.dirname(path), mtl_name), "w") as f:
+        for i in range(material_count):
+            f.write(f"newmtl Material.{i:03d}\n")
+            f.write(f"Kd {i / material_count:.6f} 0.500000 0.250000\n")
+            if i % 2 == 0:
+                f.write(f"map_Kd texture_{i}.png\n")
+            f.write("\n")
+
+    faces = []
+    written = 0
+    next_switch = 0
+    for cell in range(len(a)):
+        if written >= face_count:
+            break
+        if written >= next_switch:
+            faces.append(f"usemtl Material.{(written // run_length) % material_count:03d}\n")
+            next_switch += run_length
+        corners = [f"{i}/{i}/{i % 3 + 1}" for i in (a[cell], b[cell], c[cell], d[cell])]
+        if cell % 2:
+            faces.append(f"f {corners[0]} {corners[1]} {corners[2]} {corners[3]}\n")
+            written += 1
+        else:
+            faces.append(f"f {corners[0]} {corners[1]} {corners[2]}\n")
+            faces.append(f"f {corners[0]} {corners[2]} {corners[3]}\n")
+            written += 2
+
+    with open(path, "w") as f:
+        f.write(f"# synthetic grid, {written} faces\n")
+        f.write(f"mtllib {mtl_name}\n")
+        f.write("o Grid\n")
+        np.savetxt(f, positions, fmt="v %.6f %.6f %.6f")
+        np.savetxt(f, texcoords, fmt="vt %.6f %.6f")
+        np.savetxt(f, normals, fmt="vn %.4f %.4f %.4f")
+        f.write("s off\n")
+        f.writelines(faces)
+
+    if messy:
+        _mess_up(path)
+
+
+def _mess_up(path: str) -> None:
+    """
+        Rewrite an obj file with indented records and trailing comments.
+    """
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    with open(path, "w") as f:
+        for i, line in enumerate(lines):
+            if line.startswith("#"):
+                f.write(line + "\n")
+                continue
+            indent = ("  ", "\t")[i % 4 // 2] if i % 2 else ""
+            comment = f" # record {i}" if i % 3 == 0 else ""
+            f.write(f"{indent}{line}{comment}\n")
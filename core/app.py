@@ -1,3 +1,4 @@
+import time
 import glfw
 import glfw.GLFW as GLFW_CONSTANTS
 from OpenGL.GL import *
@@ -10,6 +11,8 @@ import numpy as np
 from core.constants import SCREEN_WIDTH, SCREEN_HEIGHT, GLOBAL_X, GLOBAL_Y, GLOBAL_Z
 from core.scene import Scene
 from graphics.engine import GraphicsEngine
+from graphics.texture import texture_manager
+from graphics.gl_counter import gl_counter
 
 
 
@@ -20,7 +23,8 @@ class App:
     __slots__ = (
         "window", "renderer", "scene", "last_time", 
         "current_time", "frames_rendered", "frametime",
-        "_keys", "mouse_locked")
+        "_keys", "mouse_locked", "startup_time", "first_frame_time",
+        "loaded_time")
 
 
     def __init__(self):
@@ -28,6 +32,10 @@ class App:
             Initialize the program.
         """
 
+        self.startup_time = time.perf_counter()
+        self.first_frame_time = None
+        self.loaded_time = None
+
         self.mouse_locked = True
 
         self._set_up_glfw()
@@ -106,6 +114,20 @@ class App:
                     self.renderer.toggle_shadows()
                 if key == GLFW_CONSTANTS.GLFW_KEY_R:
                     self.renderer.reload_shaders()
+                if key == GLFW_CONSTANTS.GLFW_KEY_G:
+                    gl_counter.toggle()
+                if key == GLFW_CONSTANTS.GLFW_KEY_C:
+                    self.renderer.toggle_culling()
+                if key == GLFW_CONSTANTS.GLFW_KEY_O:
+                    self.renderer.toggle_occlusion()
+                if key == GLFW_CONSTANTS.GLFW_KEY_P:
+                    self.renderer.toggle_portals()
+                if key == GLFW_CONSTANTS.GLFW_KEY_M:
+                    self.renderer.toggle_deferred()
+                if key == GLFW_CONSTANTS.GLFW_KEY_K:
+                    self.renderer.toggle_adaptive_quality()
+                if key == GLFW_CONSTANTS.GLFW_KEY_N:
+                    self.renderer.toggle_dynamic_resolution()
 
                 if key == GLFW_CONSTANTS.GLFW_KEY_F:
                     # Toggle any active doors
@@ -167,8 +189,10 @@ class App:
                 self.scene.player, 
                 self.scene.get_all_renderables(), 
                 self.scene.lights)
+            gl_counter.end_frame()
 
             #timing
+            self._report_loading()
             self._calculate_framerate()
 
     def _handle_keys(self) -> None:
@@ -219,6 +243,25 @@ class App:
         self.scene.spin_player(d_eulers)
         glfw.set_cursor_pos(self.window, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
 
+    def _report_loading(self) -> None:
+        """
+            Report the time taken to show the first frame,
+            and to stream in the whole scene.
+        """
+
+        if self.loaded_time is not None:
+            return
+
+        elapsed = time.perf_counter() - self.startup_time
+        if self.first_frame_time is None:
+            self.first_frame_time = elapsed
+            print(f"Time to first frame: {elapsed:.3f} s")
+
+        if not self.renderer.is_loading():
+            self.loaded_time = elapsed
+            print(f"Scene fully loaded after {elapsed:.3f} s")
+            print(f"Textures use {texture_manager.vram_usage() / 2**20:.1f} MiB of video memory")
+
     def _calculate_framerate(self) -> None:
         """
             Calculate the framerate and frametime,
@@ -229,10 +272,20 @@ class App:
         delta = self.current_time - self.last_time
         if (delta >= 1):
             framerate = max(1,int(self.frames_rendered/delta))
-            glfw.set_window_title(self.window, f"Running at {framerate} fps.")
+            draw_calls, state_changes, culled, tested = self.renderer.frame_stats()
+            glfw.set_window_title(
+                self.window,
+                f"Running at {framerate} fps, {draw_calls} draw calls, "
+                f"{state_changes} state changes, {culled}/{tested} culled, "
+                f"{self.renderer.resolution.scale:.0%} resolution.")
+            if gl_counter.enabled:
+                print(gl_counter.report())
+            if self.renderer.occlusion.enabled:
+                print(self.renderer.occlusion.report())
             self.last_time = self.current_time
             self.frames_rendered = -1
             self.frametime = float(1000.0 / max(1,framerate))
+            self.renderer.adapt_quality(self.frametime)
         self.frames_rendered += 1
 
     def quit(self):
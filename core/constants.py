@@ -10,8 +10,37 @@ GLOBAL_Y = np.array([0,1,0], dtype=np.float32)
 GLOBAL_Z = np.array([0,0,1], dtype=np.float32)
 WHITE = np.array([1,1,1], dtype=np.float32)
 
-# Maximum number of lights to send to shader
-MAX_LIGHTS = 3
+# Maximum number of lights to send to shader, the closest to the camera
+MAX_LIGHTS = 512
+
+# Draw the opaque geometry into a G-buffer and light it in one fullscreen
+# pass instead of lighting every fragment drawn (toggled with M)
+DEFERRED_SHADING = False
+
+# Froxels of the clustered lighting along x, y and depth
+CLUSTER_GRID = (16, 9, 24)
+# Lights shading a froxel at most, the closest to the camera
+MAX_CLUSTER_LIGHTS = 32
+# A light reaches as far as its strength, times its brightest color
+# component, over the squared distance stays above this
+LIGHT_CUTOFF = 0.02
+
+# Bytes of streamed model data uploaded to the GPU per frame
+STREAM_UPLOAD_BUDGET = 16 * 1024 * 1024
+
+# Seconds spent uploading decoded textures per frame
+TEXTURE_UPLOAD_BUDGET = 0.004
+
+# Pack the textures of each model into texture arrays, one per size bucket
+TEXTURE_ARRAYS = True
+TEXTURE_ARRAY_MIN_SIZE = 64
+TEXTURE_ARRAY_MAX_SIZE = 4096
+
+# Projected radius, as a fraction of half the screen height, under which
+# a chunk of a model switches to each coarser level of detail
+LOD_SCREEN_SIZES = (0.5, 0.2, 0.07)
+# A chunk only changes level once its size is this much past the threshold
+LOD_HYSTERESIS = 0.15
 
 ENTITY_TYPE = {
     "CUBE": 0,
@@ -21,20 +50,108 @@ ENTITY_TYPE = {
     "PROMPT": 4,
 }
 
+# Render the static shadow casters once into a cached map, redrawn only
+# when the shadow light or a static caster changes; these entity types
+# move, or turn to face the camera, and are drawn over the cached map
+# whenever they do
+SHADOW_CACHING = True
+SHADOW_DYNAMIC_TYPES = (
+    ENTITY_TYPE["DOOR"], ENTITY_TYPE["BILLBOARD"], ENTITY_TYPE["POINTLIGHT"])
+
+# Lights given cube shadow maps, the resolution of their faces, and how
+# many faces are rendered per frame, the most relevant and stalest first.
+# A light keeps its shadows until another is this much more relevant.
+OMNI_SHADOW_LIGHTS = 8
+OMNI_SHADOW_TILE = 512
+OMNI_SHADOW_FACES_PER_FRAME = 6
+OMNI_SHADOW_HYSTERESIS = 0.5
+
+# Cascades of the main shadow map: all but the last split the view up to
+# SHADOW_DISTANCE, from even (0) to logarithmic (1) splits in depth, and
+# follow the camera; the last covers the rest, fitted to the static shadow
+# casters so that it stays put, and cached, as the camera moves
+CASCADE_COUNT = 4
+SHADOW_DISTANCE = 40.0
+CASCADE_SPLIT_BLEND = 0.75
+
+# Rendering quality levels, lowest first: shadow map resolution (whatever
+# the window size), PCF kernel radius in texels, and number of lights
+# shaded, the closest to the camera (the scene has 17, the top level shades
+# them all). QUALITY_LEVEL is used unless ADAPTIVE_QUALITY (toggled with K)
+# moves it to hold TARGET_FPS; it goes down as soon as a second misses the
+# target and up after QUALITY_RAISE_SAMPLES seconds in a row with
+# QUALITY_HEADROOM of the frame time to spare.
+QUALITY_LEVELS = (
+    (512, 0, 4),
+    (1024, 0, 8),
+    (1024, 1, 12),
+    (2048, 1, 16),
+    (2048, 2, MAX_LIGHTS),
+)
+QUALITY_LEVEL = 3
+ADAPTIVE_QUALITY = True
+TARGET_FPS = 60
+QUALITY_HEADROOM = 0.3
+QUALITY_RAISE_SAMPLES = 3
+
+# Render the scene offscreen at a fraction of the window's resolution,
+# between RESOLUTION_SCALE_MIN and 1, chosen to keep frames within
+# FRAME_BUDGET milliseconds, then stretch it over the window (toggled
+# with N). Frame times are smoothed by RESOLUTION_SMOOTHING; the scale
+# moves by RESOLUTION_SCALE_STEP, then holds for RESOLUTION_SETTLE_FRAMES
+# frames, and only rises with RESOLUTION_HEADROOM of the budget to spare.
+DYNAMIC_RESOLUTION = True
+FRAME_BUDGET = 1000.0 / TARGET_FPS
+RESOLUTION_SCALE_MIN = 0.5
+RESOLUTION_SCALE_STEP = 0.05
+RESOLUTION_SMOOTHING = 0.1
+RESOLUTION_SETTLE_FRAMES = 10
+RESOLUTION_HEADROOM = 0.2
+
 UNIFORM_TYPE = {
     "MODEL": 0,
     "VIEW": 1,
     "PROJECTION": 2,
     "CAMERA_POS": 3,
-    "LIGHT_COLOR": 4,
-    "LIGHT_POS": 5,
-    "LIGHT_STRENGTH": 6,
     "TINT": 7,
     "LIGHT_MATRIX": 8,
+    "USE_TEXTURE": 9,
+    "USE_TEXTURE_ARRAY": 10,
+    "TEXTURE_LAYER": 11,
+    "SHADOWS_ENABLED": 12,
+    "PROXY_TRANSFORM": 13,
+    "SHADOW_LIGHT_POS": 14,
+    "CLUSTER_DIMS": 15,
+    "CLUSTER_DEPTH": 16,
+    "SCREEN_SIZE": 17,
+    "OMNI_SHADOW_SLOTS": 18,
+    "OMNI_SHADOW_NEAR": 19,
+    "CASCADE_MATRICES": 20,
+    "CASCADE_SPLITS": 21,
+    "CASCADE_DEPTH_RANGES": 22,
+    "CASCADE_COUNT": 23,
+    "PCF_RADIUS": 24,
+}
+
+# Uniforms set by the materials, cached in every shader drawing them
+MATERIAL_UNIFORMS = {
+    UNIFORM_TYPE["USE_TEXTURE"]: "useTexture",
+    UNIFORM_TYPE["USE_TEXTURE_ARRAY"]: "useTextureArray",
+    UNIFORM_TYPE["TEXTURE_LAYER"]: "textureLayer",
+    UNIFORM_TYPE["TINT"]: "tint",
 }
 
 PIPELINE_TYPE = {
     "STANDARD": 0,
     "EMISSIVE": 1,
     "SHADOW": 2,
+    "GEOMETRY": 3,
+    "DEFERRED_LIGHTING": 4,
+}
+
+# Render queue layers, drawn in this order (the skybox goes after the opaque layer)
+RENDER_LAYER = {
+    "OPAQUE": 0,
+    "BLENDED": 1,
+    "OVERLAY": 2,
 }
\ No newline at end of file
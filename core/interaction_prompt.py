@@ -52,7 +52,7 @@ class InteractionPrompt:
             print("Setting prompt position")
             # Use camera's forward vector to position prompt
             camera = scene.player  # Get camera from scene
-            self.billboard.position = camera_pos + camera.forwards * 0.8 + np.array([0, 0, -0.2], dtype=np.float32)  # Closer to camera and slightly less down
+            self.billboard.position[:] = camera_pos + camera.forwards * 0.8 + np.array([0, 0, -0.2], dtype=np.float32)  # Closer to camera and slightly less down
             self.billboard.update(dt, camera_pos)
         else:
             print("No active interactive objects found") 
\ No newline at end of file
@@ -23,8 +23,8 @@ class UIManager:
             offset = camera_forward * 2.0  # 2 units in front
             offset += camera_up  * 0.3  # 0.3 units up
             
-            # Update prompt position
-            self.interaction_prompt.position = camera_pos + offset
+            # Update prompt position, in place as the renderer keeps a view of it
+            self.interaction_prompt.position[:] = camera_pos + offset
             
             # Update prompt orientation to face camera
             self.interaction_prompt.update(dt, camera_pos)
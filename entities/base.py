@@ -1,6 +1,7 @@
 import numpy as np
 import pyrr
 from core.constants import *
+from entities.transforms import axis_rotations
 
 class Entity:
     """
@@ -78,4 +79,34 @@ class Entity:
             m2=pyrr.matrix44.create_from_translation(
                 vec=np.array(self.position),dtype=np.float32
             )
-        )
\ No newline at end of file
+        )
+
+    @staticmethod
+    def batch_model_transforms(positions: np.ndarray, eulers: np.ndarray,
+        entities: list["Entity"]) -> np.ndarray:
+        """
+            Returns the model transforms of many entities at once,
+            matching get_model_transform.
+
+            Parameters:
+
+                positions: (n,3) positions of the entities.
+
+                eulers: (n,3) rotations of the entities, in degrees.
+
+                entities: the entities themselves.
+
+            Returns:
+
+                (n,4,4) model to world transformation matrices.
+        """
+
+        rotations = axis_rotations(eulers[:, 0], 0) \
+            @ axis_rotations(eulers[:, 1], 1) \
+            @ axis_rotations(eulers[:, 2], 2)
+
+        transforms = np.zeros((len(positions), 4, 4), dtype=np.float32)
+        transforms[:, :3, :3] = rotations
+        transforms[:, 3, :3] = positions
+        transforms[:, 3, 3] = 1
+        return transforms
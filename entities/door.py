@@ -2,6 +2,7 @@ from entities.base import Entity
 import numpy as np
 import pyrr
 from core.constants import GLOBAL_X, GLOBAL_Y, GLOBAL_Z
+from entities.transforms import axis_rotations
 
 class Door(Entity):
     __slots__ = ("is_open", "speed", "angle_limit", "pivot_offset", "is_active", "base_angle", "direction")
@@ -66,5 +67,21 @@ class Door(Entity):
         # This means: first do the pivot rotation, then move to world position
         return T_world @ (T_pivot @ R @ T_unpivot)
 
+    @staticmethod
+    def batch_model_transforms(positions: np.ndarray, eulers: np.ndarray,
+        entities: list["Door"]) -> np.ndarray:
+        """
+        Vectorized get_model_transform: rotate about each door's hinge,
+        then move it to its world position.
+        """
+        R = axis_rotations(eulers[:, 2], 2) \
+            @ axis_rotations(eulers[:, 1], 1) \
+            @ axis_rotations(eulers[:, 0], 0)
+        pivots = np.array([door.pivot_offset for door in entities], dtype=np.float32)
 
-
+        # (v + world + pivot) R - pivot
+        transforms = np.zeros((len(positions), 4, 4), dtype=np.float32)
+        transforms[:, :3, :3] = R
+        transforms[:, 3, :3] = np.einsum("ni,nij->nj", positions + pivots, R) - pivots
+        transforms[:, 3, 3] = 1
+        return transforms
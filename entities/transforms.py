@@ -0,0 +1,121 @@
+import numpy as np
+
+############################## batched transforms #############################
+
+
+def axis_rotations(angles: np.ndarray, axis: int) -> np.ndarray:
+    """
+        Returns the rotations about a global axis by the given angles,
+        laid out as pyrr.matrix33.create_from_axis_rotation does.
+
+        Parameters:
+
+            angles: (n,) angles in degrees.
+
+            axis: 0, 1 or 2 for x, y or z.
+
+        Returns:
+
+            (n, 3, 3) float32 rotation matrices.
+    """
+
+    theta = np.radians(angles)
+    c = np.cos(theta).astype(np.float32)
+    s = np.sin(theta).astype(np.float32)
+
+    rotations = np.zeros((len(angles), 3, 3), dtype=np.float32)
+    rotations[:, axis, axis] = 1
+    a, b = [(1, 2), (0, 2), (0, 1)][axis]
+    sign = -1 if axis == 1 else 1
+    rotations[:, a, a] = c
+    rotations[:, b, b] = c
+    rotations[:, a, b] = sign * s
+    rotations[:, b, a] = -sign * s
+    return rotations
+
+
+class TransformStore:
+    """
+        Structure-of-arrays storage of the positions and rotations of a
+        list of entities, computing all of their model transforms at once.
+
+        The entities' position and eulers become views into the store's
+        arrays, so moving an entity in place updates the store. Model
+        transforms are only recomputed for the entities which moved
+        since the last update.
+    """
+    __slots__ = ("entities", "positions", "eulers", "matrices",
+        "last_positions", "last_eulers", "classes")
+
+
+    def __init__(self, entities: list):
+        """
+            Gather the entities' positions and rotations.
+
+            Parameters:
+
+                entities: the entities, of one or several classes.
+        """
+
+        self.entities = list(entities)
+        count = len(self.entities)
+
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.eulers = np.zeros((count, 3), dtype=np.float32)
+        for i, entity in enumerate(self.entities):
+            self.positions[i] = entity.position
+            self.eulers[i] = entity.eulers
+            entity.position = self.positions[i]
+            entity.eulers = self.eulers[i]
+
+        # class -> indices of its entities, each class batches its own transforms
+        self.classes: dict[type, np.ndarray] = {}
+        for cls in {type(entity) for entity in self.entities}:
+            self.classes[cls] = np.array(
+                [i for i, entity in enumerate(self.entities) if type(entity) is cls],
+                dtype=np.int64)
+
+        self.matrices = np.zeros((count, 4, 4), dtype=np.float32)
+        # NaN never compares equal, so the first update computes everything
+        self.last_positions = np.full_like(self.positions, np.nan)
+        self.last_eulers = np.full_like(self.eulers, np.nan)
+
+    def holds(self, entities: list) -> bool:
+        """
+            Whether the store still describes the given entities, which
+            must not have been given a new position or eulers array.
+        """
+
+        if len(entities) != len(self.entities):
+            return False
+        for i, (entity, stored) in enumerate(zip(entities, self.entities)):
+            if entity is not stored \
+                or entity.position.base is not self.positions \
+                or entity.eulers.base is not self.eulers:
+                return False
+        return True
+
+    def update(self) -> np.ndarray:
+        """
+            Recompute the model transforms of the entities which moved.
+
+            Returns:
+
+                (n, 4, 4) model transforms, in the order of the entities.
+        """
+
+        dirty = (self.positions != self.last_positions).any(axis=1) \
+            | (self.eulers != self.last_eulers).any(axis=1)
+        if not dirty.any():
+            return self.matrices
+
+        for cls, indices in self.classes.items():
+            indices = indices[dirty[indices]]
+            if len(indices):
+                self.matrices[indices] = cls.batch_model_transforms(
+                    self.positions[indices], self.eulers[indices],
+                    [self.entities[i] for i in indices])
+
+        self.last_positions[dirty] = self.positions[dirty]
+        self.last_eulers[dirty] = self.eulers[dirty]
+        return self.matrices
@@ -0,0 +1,113 @@
+import numpy as np
+import pyrr
+
+from core.constants import *
+
+# Casters this far beyond a cascade, towards the light, still shadow it
+CASCADE_PULLBACK = 50.0
+
+
+def fit_cascades(light_position: np.ndarray, view: np.ndarray, projection: np.ndarray,
+    bounds: np.ndarray, resolution: int, count: int = CASCADE_COUNT,
+    distance: float = SHADOW_DISTANCE,
+    blend: float = CASCADE_SPLIT_BLEND) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Split the camera frustum into depth ranges and fit an orthographic
+        shadow projection around each, looking from a light towards the
+        scene's center (the light is treated as directional).
+
+        The first count - 1 cascades cover slices of the view up to
+        distance. Each bounds the sphere around its slice of the frustum,
+        so its size does not change as the camera turns, and is moved in
+        whole texels, so its shadows do not shimmer as the camera moves.
+        The last cascade covers the rest of the view with the sphere
+        around the given bounds: it does not depend on the camera, so it
+        keeps its transform, and its cached casters, as the camera moves.
+
+        Parameters:
+
+            light_position: position of the light casting the shadows
+
+            view, projection: the camera's transforms, as made by pyrr
+
+            bounds: (2, 3) world space box around the static shadow
+                casters, minimum then maximum corner
+
+            resolution: texels along the side of each cascade
+
+            count: number of cascades, at least 2
+
+            distance: the view cascades end this far from the camera
+
+            blend: 0 for evenly spaced splits, 1 for logarithmic ones
+
+        Returns:
+
+            The (count, 4, 4) world to light clip transforms, the (count,)
+            view depth at which each cascade ends, and the (count,) depth
+            range of each in world units.
+    """
+
+    near = projection[3, 2] / (projection[2, 2] - 1)
+    far = projection[3, 2] / (projection[2, 2] + 1)
+    distance = min(distance, far)
+    steps = np.arange(1, count) / (count - 1)
+    splits = blend * near * (distance / near) ** steps + (1 - blend) * (near + (distance - near) * steps)
+    starts = np.concatenate(([near], splits[:-1]))
+
+    direction = -np.asarray(light_position, dtype=np.float32)
+    length = np.linalg.norm(direction)
+    direction = direction / length if length > 1e-6 else np.array([0, -1, 0], dtype=np.float32)
+    up = np.array([0, 1, 0], dtype=np.float32)
+    if abs(direction[1]) > 0.99:
+        up = np.array([0, 0, 1], dtype=np.float32)
+    rotation = pyrr.matrix44.create_look_at(
+        np.zeros(3), direction, up, dtype=np.float32)
+
+    camera_to_world = np.linalg.inv(view)
+    tan_x, tan_y = 1 / projection[0, 0], 1 / projection[1, 1]
+
+    matrices = np.empty((count, 4, 4), dtype=np.float32)
+    ranges = np.empty(count, dtype=np.float32)
+    for i, (start, end) in enumerate(zip(starts, splits)):
+        # Corners of the frustum slice, view space looks down -z
+        depths = np.array((start, start, start, start, end, end, end, end))
+        signs = np.array(((-1, -1), (1, -1), (1, 1), (-1, 1)) * 2)
+        corners = np.stack((signs[:, 0] * tan_x * depths, signs[:, 1] * tan_y * depths,
+            -depths, np.ones(8)), axis=1) @ camera_to_world
+        center = corners[:, :3].mean(axis=0)
+        radius = np.linalg.norm(corners[:, :3] - center, axis=1).max()
+        matrices[i], ranges[i] = _fit_sphere(rotation, center, radius, resolution)
+
+    bounds = np.asarray(bounds, dtype=np.float64)
+    center = bounds.mean(axis=0)
+    radius = np.linalg.norm(bounds[1] - bounds[0]) / 2
+    matrices[-1], ranges[-1] = _fit_sphere(rotation, center, radius, resolution)
+
+    splits = np.append(splits, far)
+    return matrices, splits.astype(np.float32), ranges
+
+
+def _fit_sphere(rotation: np.ndarray, center: np.ndarray, radius: float,
+    resolution: int) -> tuple[np.ndarray, float]:
+    """
+        Returns the world to light clip transform of an orthographic
+        projection around a sphere, seen along a light rotation, and
+        its depth range.
+    """
+
+    # Round up so the cascade keeps its size, and its texels, from frame to frame
+    radius = max(np.ceil(radius * 16) / 16, 1 / 16)
+
+    # Move the center in whole texels in the light's space, so the
+    # transform of a cascade only changes when it moves by a texel
+    texel = 2 * radius / resolution
+    light_center = (np.append(center, 1) @ rotation)[:3]
+    light_center = np.floor(light_center / texel) * texel
+    eye = light_center + np.array((0, 0, radius + CASCADE_PULLBACK))
+
+    light_view = rotation @ pyrr.matrix44.create_from_translation(-eye, dtype=np.float32)
+    depth_range = 2 * radius + CASCADE_PULLBACK
+    light_projection = pyrr.matrix44.create_orthogonal_projection(
+        -radius, radius, -radius, radius, 0, depth_range, dtype=np.float32)
+    return light_view @ light_projection, depth_range
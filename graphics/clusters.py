@@ -0,0 +1,208 @@
+from OpenGL.GL import *
+import numpy as np
+
+from core.constants import *
+
+# Texture units of the buffer textures read by the standard shader
+LIGHT_DATA_UNIT = 3
+CLUSTER_GRID_UNIT = 4
+LIGHT_INDEX_UNIT = 5
+
+
+class LightClusters:
+    """
+        Clustered forward lighting: the view frustum is cut into a grid
+        of froxels, screen tiles by depth slices (exponential in depth),
+        and every frame each light is assigned to the froxels its sphere
+        of influence reaches. The fragment shader finds its froxel from
+        its screen position and depth, then only shades with its lights.
+
+        The lights live in a buffer texture (three RGBA32F texels each:
+        position and radius, color and strength, cube shadow slot),
+        re-uploaded only when they change. The froxels' (offset, count)
+        and the light index list they point into are two more buffer
+        textures, rebuilt each frame.
+    """
+    __slots__ = ("grid", "buffers", "textures", "lights", "bounds",
+        "depth_scale", "depth_bias", "assigned", "max_assigned")
+
+
+    def __init__(self, grid: tuple[int, int, int] = CLUSTER_GRID):
+        """
+            Create the buffer textures, empty until the first update.
+
+            Parameters:
+
+                grid: froxels along x, y and depth.
+        """
+
+        self.grid = grid
+        self.buffers = [int(buffer) for buffer in glGenBuffers(3)]
+        self.textures = [int(texture) for texture in glGenTextures(3)]
+        formats = (GL_RGBA32F, GL_RG32UI, GL_R32UI)
+        for buffer, texture, internal_format in zip(self.buffers, self.textures, formats):
+            glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+            glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_DYNAMIC_DRAW)
+            glBindTexture(GL_TEXTURE_BUFFER, texture)
+            glTexBuffer(GL_TEXTURE_BUFFER, internal_format, buffer)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+        # (lights, 12) data last uploaded
+        self.lights = np.zeros((0, 12), dtype=np.float32)
+        # View space extents of the froxels: (slices, columns, 2) along x,
+        # (slices, rows, 2) along y and (slices, 2) along z
+        self.bounds: list[np.ndarray] = []
+        # slice = log(depth) * depth_scale - depth_bias
+        self.depth_scale = 0.0
+        self.depth_bias = 0.0
+        self.assigned = 0
+        self.max_assigned = 0
+
+    def resize(self, projection: np.ndarray) -> None:
+        """
+            Compute the view space boxes of the froxels for a projection.
+
+            Parameters:
+
+                projection: the camera's perspective projection, as made
+                    by pyrr (row vectors).
+        """
+
+        columns, rows, slices = self.grid
+        near = projection[3, 2] / (projection[2, 2] - 1)
+        far = projection[3, 2] / (projection[2, 2] + 1)
+        log_ratio = np.log(far / near)
+        self.depth_scale = slices / log_ratio
+        self.depth_bias = slices * np.log(near) / log_ratio
+
+        depths = near * (far / near) ** (np.arange(slices + 1) / slices)
+        xs = np.linspace(-1, 1, columns + 1) / projection[0, 0]
+        ys = np.linspace(-1, 1, rows + 1) / projection[1, 1]
+
+        # Froxel boxes are separable: their x extent only depends on their
+        # slice and column, their y extent on their slice and row
+        near_depths, far_depths = depths[:-1, None], depths[1:, None]
+        self.bounds = [
+            _edge_bounds(xs, near_depths, far_depths),
+            _edge_bounds(ys, near_depths, far_depths),
+            np.stack((-depths[1:], -depths[:-1]), axis=1)]
+
+    def update(self, lights: list, view: np.ndarray,
+        shadow_slots: np.ndarray | None = None) -> None:
+        """
+            Upload the lights if they changed and assign them to the froxels.
+
+            Parameters:
+
+                lights: the lights to shade with, the first ones win
+                    in froxels holding more than MAX_CLUSTER_LIGHTS.
+
+                view: the camera's world to view transform.
+
+                shadow_slots: (lights,) cube shadow slot of each light,
+                    -1 for none.
+        """
+
+        data = np.zeros((len(lights), 12), dtype=np.float32)
+        for i, light in enumerate(lights):
+            data[i, :3] = light.position
+            data[i, 4:7] = light.color
+            data[i, 7] = light.strength
+        data[:, 8] = -1 if shadow_slots is None else shadow_slots
+        # Distance at which the light falls under LIGHT_CUTOFF
+        data[:, 3] = np.sqrt(
+            np.maximum(data[:, 7] * data[:, 4:7].max(axis=1, initial=0), 0) / LIGHT_CUTOFF)
+
+        if data.shape != self.lights.shape or not np.array_equal(data, self.lights):
+            self.lights = data
+            self._upload(0, data)
+
+        counts, indices = self._assign(data, view)
+        offsets = np.cumsum(counts) - counts
+        self._upload(1, np.stack((offsets, counts), axis=1).astype(np.uint32))
+        self._upload(2, indices.astype(np.uint32))
+        self.assigned = len(indices)
+        self.max_assigned = int(counts.max(initial=0))
+
+    def _assign(self, data: np.ndarray, view: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Test the light spheres against the froxel boxes, in view space.
+
+            Returns:
+
+                The number of lights of each froxel, then the light indices
+                of all the froxels one after the other.
+        """
+
+        columns, rows, slices = self.grid
+        froxels = columns * rows * slices
+        if not len(data) or not self.bounds:
+            return np.zeros(froxels, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        centers = np.concatenate((data[:, :3], np.ones((len(data), 1), dtype=np.float32)),
+            axis=1) @ view
+        radii = data[:, 3]
+
+        # Squared distance from each light to each froxel box, one axis at a time
+        x, y, z = (_axis_distances(bounds, centers[:, axis])
+            for axis, bounds in enumerate(self.bounds))
+        # Slices and rows out of reach need no test along x
+        near = ((z[:, None] + y) <= radii ** 2).any(axis=2)
+        touched = np.zeros((slices, rows, columns, len(data)), dtype=bool)
+        touched[near] = (z[:, None] + y)[near][:, None] + x[np.nonzero(near)[0]] <= radii ** 2
+        touched = touched.reshape(froxels, -1)
+
+        # Keep the per-pixel cost bounded in crowded froxels
+        if touched.sum(axis=1).max() > MAX_CLUSTER_LIGHTS:
+            touched &= np.cumsum(touched, axis=1) <= MAX_CLUSTER_LIGHTS
+        froxel, light = np.nonzero(touched)
+        return np.bincount(froxel, minlength=froxels), light
+
+    def _upload(self, which: int, data: np.ndarray) -> None:
+
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffers[which])
+        if data.nbytes:
+            glBufferData(GL_TEXTURE_BUFFER, data.nbytes, np.ascontiguousarray(data), GL_DYNAMIC_DRAW)
+        else:
+            glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def bind(self) -> None:
+        """
+            Bind the buffer textures to their units.
+        """
+
+        for unit, texture in zip(
+            (LIGHT_DATA_UNIT, CLUSTER_GRID_UNIT, LIGHT_INDEX_UNIT), self.textures):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_BUFFER, texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def destroy(self) -> None:
+
+        glDeleteTextures(len(self.textures), self.textures)
+        glDeleteBuffers(len(self.buffers), self.buffers)
+
+
+def _edge_bounds(edges: np.ndarray, near_depths: np.ndarray,
+    far_depths: np.ndarray) -> np.ndarray:
+    """
+        Returns the (slices, cells, 2) view space extent, along x or y,
+        of the cells between the given edges (at unit depth) in every slice.
+    """
+
+    values = np.stack((
+        edges[:-1] * near_depths, edges[:-1] * far_depths,
+        edges[1:] * near_depths, edges[1:] * far_depths))
+    return np.stack((values.min(axis=0), values.max(axis=0)), axis=-1)
+
+
+def _axis_distances(bounds: np.ndarray, coordinates: np.ndarray) -> np.ndarray:
+    """
+        Returns the squared distances along one axis from light
+        coordinates to extents, shaped (*extents, lights).
+    """
+
+    low, high = bounds[..., 0, None], bounds[..., 1, None]
+    return (np.maximum(low - coordinates, 0) + np.maximum(coordinates - high, 0)) ** 2
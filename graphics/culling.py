@@ -0,0 +1,147 @@
+import numpy as np
+
+
+class FrustumCuller:
+    """
+        Tests bounding volumes against the camera frustum, all of
+        them at once, and counts what it culled during the frame.
+
+        Volumes are given in model space with the transforms of their
+        instances; a volume is visible if any part of its bounding box
+        and of its bounding sphere may be inside the frustum, and its
+        box is not entirely inside one of the hidden regions.
+    """
+    __slots__ = ("planes", "hidden", "enabled", "culled", "tested",
+        "camera_position", "projection_scale")
+
+
+    def __init__(self):
+        """
+            Initialize the culler, which culls nothing until
+            given a frustum.
+        """
+
+        # (6, 4) inward facing planes (a, b, c, d), ax + by + cz + d >= 0 inside
+        self.planes: np.ndarray | None = None
+        # (k, 2, 3) world space boxes whose contents are not visible
+        self.hidden = np.zeros((0, 2, 3), dtype=np.float32)
+        self.enabled = True
+        self.culled = 0
+        self.tested = 0
+        self.camera_position = np.zeros(3, dtype=np.float32)
+        # 1 / tan(fovy / 2)
+        self.projection_scale = 1.0
+
+    def toggle(self) -> None:
+
+        self.enabled = not self.enabled
+        print("Frustum culling enabled:", self.enabled)
+
+    def begin_frame(self, view: np.ndarray, projection: np.ndarray,
+        hidden: np.ndarray | None = None) -> None:
+        """
+            Extract the frustum of the frame and reset the counters.
+
+            Parameters:
+
+                view: the camera's world to view transform.
+
+                projection: the camera's projection transform.
+
+                hidden: (k, 2, 3) world space boxes, such as the rooms
+                    which can't be seen from the camera's room.
+        """
+
+        self.culled = 0
+        self.tested = 0
+        if hidden is not None:
+            self.hidden = hidden
+        else:
+            self.hidden = np.zeros((0, 2, 3), dtype=np.float32)
+
+        self.camera_position = np.linalg.inv(view)[3, :3]
+        self.projection_scale = float(projection[1, 1])
+
+        # Row vectors: clip = world @ view @ projection, so the planes
+        # are sums and differences of the matrix columns.
+        columns = (view @ projection).T
+        planes = np.array((
+            columns[3] + columns[0], columns[3] - columns[0],
+            columns[3] + columns[1], columns[3] - columns[1],
+            columns[3] + columns[2], columns[3] - columns[2],
+        ), dtype=np.float32)
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+    def cull(self, boxes: np.ndarray, spheres: np.ndarray,
+        transforms: np.ndarray) -> np.ndarray:
+        """
+            Test the volumes of every instance against the frustum.
+
+            Parameters:
+
+                boxes: (m, 2, 3) model space boxes, minimum then maximum corner.
+
+                spheres: (m, 4) model space spheres, center then radius.
+
+                transforms: (n, 4, 4) model transforms of the instances.
+
+            Returns:
+
+                (n, m) boolean visibility of each volume of each instance.
+        """
+
+        count = len(transforms) * len(boxes)
+        self.tested += count
+        if not self.enabled or self.planes is None or count == 0:
+            return np.ones((len(transforms), len(boxes)), dtype=bool)
+
+        rotations = transforms[:, :3, :3]
+        translations = transforms[:, 3, :3]
+        normals, offsets = self.planes[:, :3], self.planes[:, 3]
+
+        # Spheres: the transforms are rigid but may carry a scale
+        centers = np.einsum("mi,nij->nmj", spheres[:, :3], rotations) + translations[:, None]
+        scales = np.linalg.norm(rotations, axis=2).max(axis=1)
+        radii = spheres[None, :, 3] * scales[:, None]
+        distances = np.einsum("nmj,pj->nmp", centers, normals) + offsets
+        visible = (distances >= -radii[:, :, None]).all(axis=2)
+
+        # Boxes: project the world space extent of each box on the plane normals
+        box_centers = np.einsum(
+            "mi,nij->nmj", (boxes[:, 0] + boxes[:, 1]) / 2, rotations) + translations[:, None]
+        box_extents = np.einsum(
+            "mi,nij->nmj", (boxes[:, 1] - boxes[:, 0]) / 2, np.abs(rotations))
+        distances = np.einsum("nmj,pj->nmp", box_centers, normals) + offsets
+        reach = np.einsum("nmj,pj->nmp", box_extents, np.abs(normals))
+        visible &= (distances >= -reach).all(axis=2)
+
+        if len(self.hidden):
+            low, high = box_centers - box_extents, box_centers + box_extents
+            inside = ((low[:, :, None] >= self.hidden[:, 0])
+                & (high[:, :, None] <= self.hidden[:, 1])).all(axis=3)
+            visible &= ~inside.any(axis=2)
+
+        self.culled += count - int(visible.sum())
+        return visible
+
+    def screen_sizes(self, spheres: np.ndarray, transforms: np.ndarray) -> np.ndarray:
+        """
+            Returns the projected radius of bounding spheres, as a
+            fraction of half the screen height.
+
+            Parameters:
+
+                spheres: (m, 4) model space spheres, center then radius.
+
+                transforms: (n, 4, 4) model transforms of the instances.
+
+            Returns:
+
+                (n, m) sizes, large for the spheres around the camera.
+        """
+
+        rotations = transforms[:, :3, :3]
+        centers = np.einsum("mi,nij->nmj", spheres[:, :3], rotations) + transforms[:, None, 3, :3]
+        radii = spheres[None, :, 3] * np.linalg.norm(rotations, axis=2).max(axis=1)[:, None]
+        distances = np.linalg.norm(centers - self.camera_position, axis=2)
+        return radii * self.projection_scale / np.maximum(distances, 1e-3)
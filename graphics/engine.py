@@ -1,3 +1,5 @@
+import time
+
 from OpenGL.GL import *
 import numpy as np
 import pyrr
@@ -7,16 +9,30 @@ from graphics.shader import Shader
 from graphics.mesh import *
 from graphics.material import Material
 from graphics.skybox import Skybox
+from graphics.render_queue import RenderQueue
+from graphics.culling import FrustumCuller
+from graphics.cascades import fit_cascades
+from graphics.quality import QualityController, ResolutionGovernor
+from graphics.occlusion import OcclusionCuller
+from graphics.clusters import (
+    CLUSTER_GRID_UNIT, LIGHT_DATA_UNIT, LIGHT_INDEX_UNIT, LightClusters)
+from graphics.portals import ROOMS_CONFIG, RoomGraph
+from graphics.gbuffer import ALBEDO_UNIT, NORMAL_UNIT, POSITION_UNIT, GBuffer
+from graphics.render_target import RenderTarget
+from graphics.omni_shadows import (
+    OMNI_ATLAS_UNIT, OMNI_FACES_UNIT, OMNI_SHADOW_NEAR, OmniShadowAtlas)
+from graphics.texture import texture_manager
 from core.scene import Camera
 from entities.pointlight import PointLight
 from entities.base import Entity
+from entities.transforms import TransformStore
 from utils.colors import *
 
 class GraphicsEngine:
     """
         Draws entities and stuff.
     """
-    __slots__ = ("meshes", "materials", "shaders", "skybox_mesh", "skybox_shader", "skybox", "shadow_fbo", "shadow_depth_texture", "shadow_width", "shadow_height", "shadows_enabled", "window_width", "window_height")
+    __slots__ = ("meshes", "materials", "shaders", "skybox_mesh", "skybox_shader", "skybox", "shadow_fbos", "shadow_depth_texture", "shadow_static_fbo", "shadow_static_texture", "shadow_static_key", "shadow_dynamic_key", "shadow_keys", "shadow_moved_types", "shadow_culler", "cascades", "shadow_width", "shadow_height", "shadows_enabled", "window_width", "window_height", "render_queue", "transforms", "projection", "culler", "occlusion", "rooms", "clusters", "gbuffer", "deferred", "omni_shadows", "quality", "pcf_radius", "max_lights", "target", "resolution", "render_width", "render_height")
 
     def __init__(self):
         """
@@ -34,13 +50,34 @@ class GraphicsEngine:
 
         self._get_uniform_locations()
 
+        self.quality = QualityController()
         self._create_shadow_map()
+        self._apply_quality()
 
         self.shadows_enabled = True
 
+        self.render_queue = RenderQueue()
+        self.culler = FrustumCuller()
+        self.occlusion = OcclusionCuller()
+        self.rooms = RoomGraph.load()
+        self.clusters = LightClusters()
+        self.gbuffer = GBuffer(self.window_width, self.window_height)
+        self.deferred = DEFERRED_SHADING
+        self.omni_shadows = OmniShadowAtlas()
+        self.target = RenderTarget(self.window_width, self.window_height)
+        self.resolution = ResolutionGovernor()
+        self.render_width = self.window_width
+        self.render_height = self.window_height
+
+        # entity type -> transforms of its entities, lights under POINTLIGHT
+        self.transforms: dict[int, TransformStore] = {}
+
         ## set up skybox
         self.skybox_mesh = SkyboxMesh()
         self.skybox_shader = Shader("shaders/skybox_vertex.txt", "shaders/skybox_fragment.txt")
+        self.skybox_shader.cache_single_location(UNIFORM_TYPE["VIEW"], "view")
+        self.skybox_shader.cache_single_location(UNIFORM_TYPE["PROJECTION"], "projection")
+        self._update_projection_matrices()
         self.skybox = Skybox([
             "gfx/sky.jpg",
             "gfx/sky.jpg",
@@ -76,8 +113,10 @@ class GraphicsEngine:
             # ENTITY_TYPE["CUBE"]: monkey_model,
             ENTITY_TYPE["PROMPT"]: RectMesh(w = 0.6, h = 0.5),
             ENTITY_TYPE["POINTLIGHT"]: RectMesh(w = 0.2, h = 0.1),
-            ENTITY_TYPE["CUBE"] : MultiMaterialMesh("models/assembler.obj"),
-            ENTITY_TYPE["DOOR"]: MultiMaterialMesh("models/door.obj"),
+            ENTITY_TYPE["CUBE"] : MultiMaterialMesh(
+                "models/assembler.obj", streaming = True, texture_arrays = TEXTURE_ARRAYS),
+            ENTITY_TYPE["DOOR"]: MultiMaterialMesh(
+                "models/door.obj", streaming = True, texture_arrays = TEXTURE_ARRAYS),
             ENTITY_TYPE["BILLBOARD"]: RectMesh(w = 1.0, h = 1.0)
         }
 
@@ -88,14 +127,25 @@ class GraphicsEngine:
             ENTITY_TYPE["POINTLIGHT"]: Material("gfx/Light-bulb.png"),
             ENTITY_TYPE["PROMPT"]: Material("gfx/prompt.png")  
         }
-        
+
+        self._create_shaders()
+
+    def _create_shaders(self) -> None:
+        """
+            Compile the shader programs of every pipeline.
+        """
+
         self.shaders: dict[int, Shader] = {
             PIPELINE_TYPE["STANDARD"]: Shader(
                 "shaders/vertex.txt", "shaders/fragment.txt"),
             PIPELINE_TYPE["EMISSIVE"]: Shader(
                 "shaders/vertex_light.txt", "shaders/fragment_light.txt"),
             PIPELINE_TYPE["SHADOW"]: Shader(
-                "shaders/shadow_vertex.txt", "shaders/shadow_fragment.txt")
+                "shaders/shadow_vertex.txt", "shaders/shadow_fragment.txt"),
+            PIPELINE_TYPE["GEOMETRY"]: Shader(
+                "shaders/vertex.txt", "shaders/gbuffer_fragment.txt"),
+            PIPELINE_TYPE["DEFERRED_LIGHTING"]: Shader(
+                "shaders/deferred_vertex.txt", "shaders/deferred_fragment.txt")
         }
     
     def _set_onetime_uniforms(self) -> None:
@@ -111,6 +161,16 @@ class GraphicsEngine:
         for shader in self.shaders.values():
             shader.use()
             glUniform1i(glGetUniformLocation(shader.program, "imageTexture"), 0)
+            glUniform1i(glGetUniformLocation(shader.program, "imageTextureArray"), 2)
+            glUniform1i(glGetUniformLocation(shader.program, "shadowMap"), 1)
+            glUniform1i(glGetUniformLocation(shader.program, "lightData"), LIGHT_DATA_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "clusterGrid"), CLUSTER_GRID_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "lightIndices"), LIGHT_INDEX_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "gAlbedo"), ALBEDO_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "gNormal"), NORMAL_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "gPosition"), POSITION_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "omniShadowAtlas"), OMNI_ATLAS_UNIT)
+            glUniform1i(glGetUniformLocation(shader.program, "omniShadowFaces"), OMNI_FACES_UNIT)
 
             glUniformMatrix4fv(
                 glGetUniformLocation(shader.program,"projection"),
@@ -122,157 +182,207 @@ class GraphicsEngine:
             Query and store the locations of shader uniforms
         """
 
-        shader = self.shaders[PIPELINE_TYPE["STANDARD"]]
-        shader.use()
+        # The lit shaders: forward, and the deferred lighting pass
+        for pipeline in (PIPELINE_TYPE["STANDARD"], PIPELINE_TYPE["DEFERRED_LIGHTING"]):
+            shader = self.shaders[pipeline]
+            shader.use()
 
-        shader.cache_single_location(
-            UNIFORM_TYPE["CAMERA_POS"], "cameraPosition")
-        shader.cache_single_location(UNIFORM_TYPE["MODEL"], "model")
-        shader.cache_single_location(UNIFORM_TYPE["VIEW"], "view")
-
-        for i in range(MAX_LIGHTS):
-            shader.cache_multi_location(
-                UNIFORM_TYPE["LIGHT_COLOR"], f"Lights[{i}].color")
-            shader.cache_multi_location(
-                UNIFORM_TYPE["LIGHT_POS"], f"Lights[{i}].position")
-            shader.cache_multi_location(
-                UNIFORM_TYPE["LIGHT_STRENGTH"], f"Lights[{i}].strength")
-        
-        shader = self.shaders[PIPELINE_TYPE["EMISSIVE"]]
-        shader.use()
+            shader.cache_single_location(
+                UNIFORM_TYPE["CAMERA_POS"], "cameraPosition")
+            shader.cache_single_location(UNIFORM_TYPE["VIEW"], "view")
+            shader.cache_single_location(UNIFORM_TYPE["CASCADE_MATRICES"], "cascadeMatrices")
+            shader.cache_single_location(UNIFORM_TYPE["CASCADE_SPLITS"], "cascadeSplits")
+            shader.cache_single_location(
+                UNIFORM_TYPE["CASCADE_DEPTH_RANGES"], "cascadeDepthRanges")
+            shader.cache_single_location(UNIFORM_TYPE["CASCADE_COUNT"], "cascadeCount")
+            shader.cache_single_location(UNIFORM_TYPE["PCF_RADIUS"], "pcfRadius")
+            shader.cache_single_location(UNIFORM_TYPE["SHADOWS_ENABLED"], "shadowsEnabled")
+            shader.cache_single_locations(MATERIAL_UNIFORMS)
+            shader.cache_single_location(
+                UNIFORM_TYPE["SHADOW_LIGHT_POS"], "shadowLightPosition")
+            shader.cache_single_location(UNIFORM_TYPE["CLUSTER_DIMS"], "clusterDims")
+            shader.cache_single_location(UNIFORM_TYPE["CLUSTER_DEPTH"], "clusterDepth")
+            shader.cache_single_location(UNIFORM_TYPE["SCREEN_SIZE"], "screenSize")
+            shader.cache_single_location(UNIFORM_TYPE["OMNI_SHADOW_SLOTS"], "omniShadowSlots")
+            shader.cache_single_location(UNIFORM_TYPE["OMNI_SHADOW_NEAR"], "omniShadowNear")
+
+        for pipeline in (PIPELINE_TYPE["EMISSIVE"], PIPELINE_TYPE["GEOMETRY"]):
+            shader = self.shaders[pipeline]
+            shader.use()
 
-        shader.cache_single_location(UNIFORM_TYPE["MODEL"], "model")
-        shader.cache_single_location(UNIFORM_TYPE["VIEW"], "view")
-        shader.cache_single_location(UNIFORM_TYPE["TINT"], "tint")
+            shader.cache_single_location(UNIFORM_TYPE["VIEW"], "view")
+            shader.cache_single_locations(MATERIAL_UNIFORMS)
 
         shader = self.shaders[PIPELINE_TYPE["SHADOW"]]
         shader.use()
 
-        shader.cache_single_location(UNIFORM_TYPE["MODEL"], "model")
         shader.cache_single_location(UNIFORM_TYPE["LIGHT_MATRIX"], "lightSpaceMatrix")
 
+        for shader in self.shaders.values():
+            shader.cache_single_location(UNIFORM_TYPE["PROJECTION"], "projection")
 
     
     def _create_shadow_map(self) -> None:
         """
-            Create a framebuffer and texture to render shadows into.
+            Create the depth texture array to render the shadow cascades
+            into, with a framebuffer per cascade, and a single layer
+            holding the static casters of the last cascade, at the quality
+            level's resolution.
         """
 
-        self.shadow_width = 1024
-        self.shadow_height = 1024
+        self.shadow_width = self.shadow_height = self.quality.settings()[0]
+        self._create_shadow_targets()
 
-        self.shadow_fbo = glGenFramebuffers(1)
-        glBindFramebuffer(GL_FRAMEBUFFER, self.shadow_fbo)
+        self.shadow_culler = FrustumCuller()
+        # Transforms, end depths and depth ranges of the cascades
+        self.cascades = (
+            np.tile(np.identity(4, dtype=np.float32), (CASCADE_COUNT, 1, 1)),
+            np.zeros(CASCADE_COUNT, dtype=np.float32),
+            np.ones(CASCADE_COUNT, dtype=np.float32))
 
-        self.shadow_depth_texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.shadow_depth_texture)
-        glTexImage2D(
-            GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT,
-            self.shadow_width, self.shadow_height,
-            0, GL_DEPTH_COMPONENT, GL_FLOAT, None
-        )
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
-        glTexParameterfv(GL_TEXTURE_2D, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
-
-        glFramebufferTexture2D(
-            GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
-            GL_TEXTURE_2D, self.shadow_depth_texture, 0
-        )
-        glDrawBuffer(GL_NONE)
-        glReadBuffer(GL_NONE)
-
-        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
-            print("Error: Framebuffer is not complete!")
-
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
-
-    def _get_light_space_matrix(self, light_pos: np.ndarray) -> np.ndarray:
+    def _create_depth_array(self, width: int, height: int,
+        layers: int) -> tuple[int, list[int]]:
         """
-            Calculate the light-space transformation matrix.
-
-            Parameters:
-                light_pos: position of the light source
+            Create a depth texture array, with a framebuffer for each layer.
 
             Returns:
-                light space matrix
+
+                The texture and the framebuffers.
         """
 
-        # Use a larger projection range to ensure it covers the entire scene
-        light_projection = pyrr.matrix44.create_orthogonal_projection(
-            left=-30, right=30,
-            bottom=-30, top=30,
-            near=-30, far=50,
-            dtype=np.float32
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+        glTexImage3D(
+            GL_TEXTURE_2D_ARRAY, 0, GL_DEPTH_COMPONENT,
+            width, height, layers,
+            0, GL_DEPTH_COMPONENT, GL_FLOAT, None
         )
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+        glTexParameterfv(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
+
+        fbos = []
+        for layer in range(layers):
+            fbo = glGenFramebuffers(1)
+            glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+            glFramebufferTextureLayer(
+                GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, texture, 0, layer)
+            glDrawBuffer(GL_NONE)
+            glReadBuffer(GL_NONE)
+
+            if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+                print("Error: Framebuffer is not complete!")
+            fbos.append(fbo)
 
-        # Look from light position towards scene center
-        light_view = pyrr.matrix44.create_look_at(
-            eye=light_pos,
-            target=np.array([0, 0, 0], dtype=np.float32),  # Look at scene center
-            up=np.array([0, 1, 0], dtype=np.float32),      # World up vector
-            dtype=np.float32
-        )
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return texture, fbos
 
-        return pyrr.matrix44.multiply(light_projection, light_view)
-    
     def _update_projection_matrices(self) -> None:
         aspect = self.window_width / self.window_height
         projection = pyrr.matrix44.create_perspective_projection(
             fovy=45, aspect=aspect, near=0.1, far=1000, dtype=np.float32
         )
-        for shader in self.shaders.values():
-            shader.use()
-            loc = glGetUniformLocation(shader.program, "projection")
+        self.projection = projection
+        self.clusters.resize(projection)
+        for shader in (*self.shaders.values(), self.skybox_shader):
+            loc = shader.fetch_single_location(UNIFORM_TYPE["PROJECTION"])
             if loc != -1:  # Only update if the shader uses this uniform
+                shader.use()
                 glUniformMatrix4fv(loc, 1, GL_FALSE, projection)
 
 
 
-    def _recreate_shadow_map(self, width: int, height: int) -> None:
-        # Delete old framebuffer and texture
-        glDeleteFramebuffers(1, [self.shadow_fbo])
-        glDeleteTextures(1, [self.shadow_depth_texture])
+    def _create_shadow_targets(self) -> None:
+
+        self.shadow_depth_texture, self.shadow_fbos = self._create_depth_array(
+            self.shadow_width, self.shadow_height, CASCADE_COUNT)
+        self.shadow_static_texture, (self.shadow_static_fbo,) = self._create_depth_array(
+            self.shadow_width, self.shadow_height, 1)
 
-        self.shadow_width = width
-        self.shadow_height = height
+        # What the cached cascades were rendered from, None when out of date:
+        # every caster for the view cascades, then the static and dynamic
+        # casters of the last one
+        self.shadow_keys = [None] * (CASCADE_COUNT - 1)
+        self.shadow_static_key = None
+        self.shadow_dynamic_key = None
+        # Static caster types already reported as moving
+        self.shadow_moved_types = set()
 
-        # Generate framebuffer
-        self.shadow_fbo = glGenFramebuffers(1)
-        glBindFramebuffer(GL_FRAMEBUFFER, self.shadow_fbo)
+    def _recreate_shadow_map(self, resolution: int) -> None:
+        # Delete old framebuffers and textures
+        fbos = self.shadow_fbos + [self.shadow_static_fbo]
+        glDeleteFramebuffers(len(fbos), fbos)
+        glDeleteTextures(2, [self.shadow_depth_texture, self.shadow_static_texture])
 
-        # Generate depth texture
-        self.shadow_depth_texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.shadow_depth_texture)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT,
-                    self.shadow_width, self.shadow_height, 0,
-                    GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        self.shadow_width = self.shadow_height = resolution
+        self._create_shadow_targets()
 
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+    def _stream_meshes(self) -> None:
+        """
+            Upload the next part of the models and textures
+            still loading, within the per-frame budgets.
+        """
 
-        border_color = [1.0, 1.0, 1.0, 1.0]
-        glTexParameterfv(GL_TEXTURE_2D, GL_TEXTURE_BORDER_COLOR, border_color)
+        texture_manager.upload_pending(TEXTURE_UPLOAD_BUDGET)
 
-        # Attach depth texture to framebuffer
-        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
-                            GL_TEXTURE_2D, self.shadow_depth_texture, 0)
+        budget = STREAM_UPLOAD_BUDGET
+        for mesh in self.meshes.values():
+            if budget <= 0:
+                break
+            if isinstance(mesh, MultiMaterialMesh) and mesh.is_loading():
+                budget -= mesh.stream_upload(budget)
 
-        glDrawBuffer(GL_NONE)
-        glReadBuffer(GL_NONE)
+    def is_loading(self) -> bool:
+        """
+            Whether some models or textures are still being streamed in.
+        """
 
-        # Unbind framebuffer
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return texture_manager.is_loading() or any(
+            isinstance(mesh, MultiMaterialMesh) and mesh.is_loading()
+            for mesh in self.meshes.values())
 
     def resize(self, width: int, height: int) -> None:
         self.window_width = width
         self.window_height = height
         self._update_projection_matrices()
-        self._recreate_shadow_map(width, height)
+        self.gbuffer.resize(width, height)
+        self.target.resize(width, height)
+
+    def adapt_quality(self, frametime: float) -> None:
+        """
+            Let the quality controller react to the last frame times.
+
+            Parameters:
+
+                frametime: average milliseconds per frame, over the last second.
+        """
+
+        # Streaming in the models costs frame time which is not the settings'
+        if self.is_loading():
+            return
+
+        # The resolution scale reacts first: quality only drops once the
+        # scale is at its minimum, and only rises once it is back to full
+        governed = self.resolution.enabled
+        if self.quality.update(frametime,
+            can_lower = not governed or self.resolution.scale <= RESOLUTION_SCALE_MIN,
+            can_raise = not governed or self.resolution.scale >= 1.0):
+            self._apply_quality()
+            resolution, pcf_radius, max_lights = self.quality.settings()
+            print(f"Quality level {self.quality.level}: {resolution} shadow map, "
+                f"PCF radius {pcf_radius}, {max_lights} lights")
+
+    def _apply_quality(self) -> None:
+        """
+            Use the settings of the current quality level.
+        """
+
+        resolution, self.pcf_radius, max_lights = self.quality.settings()
+        self.max_lights = min(max_lights, MAX_LIGHTS)
+        if resolution != self.shadow_width:
+            self._recreate_shadow_map(resolution)
     
     def render(self, camera: Camera, renderables: dict[int, list[Entity]], lights: list[PointLight]) -> None:
         """
@@ -283,83 +393,374 @@ class GraphicsEngine:
                 renderables: dictionary mapping entity types to lists of entities
                 lights: all the lights in the scene
         """
+        self._stream_meshes()
+        self.occlusion.collect()
+
+        # Size of the target's region drawn into this frame
+        scale = self.resolution.update(time.perf_counter(), paused = self.is_loading())
+        self.render_width = max(1, int(self.window_width * scale))
+        self.render_height = max(1, int(self.window_height * scale))
+
         # Get all renderables including UI elements
         all_renderables = renderables.get_all_renderables() if hasattr(renderables, 'get_all_renderables') else renderables
 
-        # Sort lights by distance to camera and take only the closest MAX_LIGHTS
+        view = camera.get_view_transform()
+
+        # Rooms seen from the camera's room, their lights only are used
+        visible_rooms = None
+        if self.rooms is not None:
+            visible_rooms = self.rooms.visible_rooms(
+                camera.position, view @ self.projection,
+                all_renderables.get(ENTITY_TYPE["DOOR"], []))
+        if visible_rooms is not None and lights:
+            light_rooms = self.rooms.rooms_at([light.position for light in lights])
+            lights = [
+                light for light, room in zip(lights, light_rooms)
+                if room < 0 or visible_rooms[room]]
+
+        # Sort lights by distance to camera, the closest win in crowded froxels
         sorted_lights = sorted(
             lights,
             key=lambda light: np.linalg.norm(light.position - camera.position)
-        )[:MAX_LIGHTS]
-        
-        # Fill remaining slots with dummy lights (strength = 0)
-        while len(sorted_lights) < MAX_LIGHTS:
-            sorted_lights.append(PointLight(
-                position=[0, 0, 0],
-                color=[0, 0, 0],
-                strength=0
-            ))
+        )[:self.max_lights]
+
+        model_transforms = self._update_transforms(all_renderables, lights)
 
-        light_space_matrix = np.identity(4, dtype=np.float32)
+        shadow_slots = None
 
         if self.shadows_enabled and len(lights) > 0:
             # STEP 1: Render shadow map
-            glViewport(0, 0, self.shadow_width, self.shadow_height)
-            glBindFramebuffer(GL_FRAMEBUFFER, self.shadow_fbo)
-            glClear(GL_DEPTH_BUFFER_BIT)
-
-            shadow_shader = self.shaders[PIPELINE_TYPE["SHADOW"]]
-            shadow_shader.use()
-
             light_pos = sorted_lights[0].position  # Use the closest light for shadows
-            light_space_matrix = self._get_light_space_matrix(light_pos)
+            casters = self._shadow_casters(all_renderables)
+            self.cascades = fit_cascades(
+                light_pos, view, self.projection,
+                self._caster_bounds(
+                    [t for t in casters if t not in SHADOW_DYNAMIC_TYPES], model_transforms),
+                min(self.shadow_width, self.shadow_height))
+            self._render_shadow_map(all_renderables, model_transforms, self.cascades[0])
+
+            # Cube shadows of the most relevant lights, a few faces per frame
+            self.omni_shadows.assign(sorted_lights, camera.position)
+            self.omni_shadows.update(
+                lambda face_matrix, face_culler: self._draw_depth(
+                    casters, model_transforms, face_matrix, face_culler))
+            glViewport(0, 0, self.window_width, self.window_height)
+            shadow_slots = self.omni_shadows.shading_slots()
+
+        self.clusters.update(sorted_lights, view, shadow_slots)
 
+        # STEP 2: Main geometry render, offscreen
+        self.target.bind(self.render_width, self.render_height)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        self.culler.begin_frame(
+            view, self.projection,
+            None if visible_rooms is None else self.rooms.hidden_bounds(visible_rooms))
+        
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.shadow_depth_texture)
+        self.clusters.bind()
+        self.omni_shadows.bind()
+
+        # Forward when the G-buffer could not be created on this driver
+        deferred = self.deferred and self.gbuffer.complete
+        lit_pipelines = [PIPELINE_TYPE["STANDARD"]]
+        if deferred:
+            lit_pipelines.append(PIPELINE_TYPE["DEFERRED_LIGHTING"])
+        for pipeline in lit_pipelines:
+            self._set_lighting_uniforms(
+                self.shaders[pipeline], camera, view, sorted_lights)
+
+        # Per-frame uniforms of the unlit shaders
+        for pipeline in (PIPELINE_TYPE["EMISSIVE"], PIPELINE_TYPE["GEOMETRY"]):
+            shader = self.shaders[pipeline]
+            shader.use()
             glUniformMatrix4fv(
-                shadow_shader.fetch_single_location(UNIFORM_TYPE["LIGHT_MATRIX"]),
-                1, GL_FALSE, light_space_matrix
+                shader.fetch_single_location(UNIFORM_TYPE["VIEW"]),
+                1, GL_FALSE, view
             )
 
-            for entity_type, entities in all_renderables.items():
-                if entity_type == ENTITY_TYPE["PROMPT"]:  # Skip UI elements for shadow pass
+        self._fill_render_queue(camera, all_renderables, lights, model_transforms)
+
+        if deferred:
+            self._render_deferred(view)
+        else:
+            self.render_queue.submit(
+                RENDER_LAYER["OPAQUE"], self.shaders, self.culler, self.occlusion)
+            # Against the depth of the opaque geometry, read on the next frame
+            self.occlusion.issue_queries(view @ self.projection, camera.position)
+
+        # Draw skybox
+        glDepthFunc(GL_LEQUAL)
+        self.skybox_shader.use()
+
+        skybox_view = pyrr.matrix44.create_from_matrix33(
+            pyrr.matrix33.create_from_matrix44(view)
+        )
+
+        glUniformMatrix4fv(
+            self.skybox_shader.fetch_single_location(UNIFORM_TYPE["VIEW"]),
+            1, GL_FALSE, skybox_view
+        )
+
+        self.skybox.use()
+        self.skybox_mesh.arm_for_drawing()
+        self.skybox_mesh.draw()
+        glDepthFunc(GL_LESS)
+
+        # Billboards and light sprites, over the sky
+        self.render_queue.submit(RENDER_LAYER["BLENDED"], self.shaders)
+
+        # Stretch the frame over the window
+        self.target.present(self.render_width, self.render_height)
+
+        # UI elements last, at the window's resolution, without depth testing
+        glDisable(GL_DEPTH_TEST)
+        self.render_queue.submit(RENDER_LAYER["OVERLAY"], self.shaders)
+        glEnable(GL_DEPTH_TEST)
+
+        glFlush()
+
+    def _render_shadow_map(self, renderables: dict[int, list[Entity]],
+        model_transforms: dict[int, np.ndarray], cascade_matrices: np.ndarray) -> None:
+        """
+            Bring the shadow cascades up to date.
+
+            With SHADOW_CACHING, a cascade is only redrawn when its
+            transform, a caster or the map's size changed, and while models
+            are still streaming in. The view cascades follow the camera, so
+            they are redrawn as it moves, but are small and only draw the
+            octree leaves inside them. The last cascade is fitted to the
+            static casters instead: they are rendered into their own map
+            only when the light or one of them changes, and the cascade is
+            that map with the dynamic casters drawn on top, left alone on
+            frames where none of them moved.
+
+            Parameters:
+
+                renderables: dictionary mapping entity types to lists of entities
+
+                model_transforms: the model transforms of each entity type
+
+                cascade_matrices: the (cascades, 4, 4) world to light clip
+                    transform of each cascade
+        """
+
+        casters = self._shadow_casters(renderables)
+        if not SHADOW_CACHING:
+            for fbo, light_space_matrix in zip(self.shadow_fbos, cascade_matrices):
+                self._draw_shadow_casters(
+                    fbo, casters, model_transforms, light_space_matrix, True)
+            return
+
+        static = [t for t in casters if t not in SHADOW_DYNAMIC_TYPES]
+        dynamic = [t for t in casters if t in SHADOW_DYNAMIC_TYPES]
+        static_state = tuple((t, model_transforms[t].tobytes()) for t in static)
+        dynamic_state = tuple((t, model_transforms[t].tobytes()) for t in dynamic)
+        streaming = self._is_streaming(casters)
+
+        for cascade, light_space_matrix in enumerate(cascade_matrices[:-1]):
+            key = (light_space_matrix.tobytes(), static_state, dynamic_state)
+            if key == self.shadow_keys[cascade]:
+                continue
+            self._draw_shadow_casters(
+                self.shadow_fbos[cascade], casters, model_transforms,
+                light_space_matrix, True)
+            self.shadow_keys[cascade] = None if streaming else key
+
+        light_space_matrix = cascade_matrices[-1]
+        static_key = (light_space_matrix.tobytes(), static_state)
+        dynamic_key = (static_key, dynamic_state)
+
+        if static_key != self.shadow_static_key:
+            self._check_static_casters(static_key)
+            self._draw_shadow_casters(
+                self.shadow_static_fbo, static, model_transforms,
+                light_space_matrix, True)
+            self.shadow_static_key = None if self._is_streaming(static) else static_key
+        elif dynamic_key == self.shadow_dynamic_key:
+            return
+
+        # Start from the static casters and draw the dynamic ones over them
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.shadow_static_fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.shadow_fbos[-1])
+        glBlitFramebuffer(
+            0, 0, self.shadow_width, self.shadow_height,
+            0, 0, self.shadow_width, self.shadow_height,
+            GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+        self._draw_shadow_casters(
+            self.shadow_fbos[-1], dynamic, model_transforms,
+            light_space_matrix, False)
+        self.shadow_dynamic_key = None \
+            if self.shadow_static_key is None or self._is_streaming(dynamic) \
+            else dynamic_key
+
+    def _check_static_casters(self, static_key: tuple) -> None:
+        """
+            Report the static caster types which moved under an unchanged
+            light, since each move redraws the whole cached map: the
+            cache only pays off if they stay put as the camera moves.
+        """
+
+        if self.shadow_static_key is None or self.shadow_static_key[0] != static_key[0]:
+            return
+
+        previous = dict(self.shadow_static_key[1])
+        for entity_type, state in static_key[1]:
+            if previous.get(entity_type, state) != state \
+                and entity_type not in self.shadow_moved_types:
+                self.shadow_moved_types.add(entity_type)
+                print(f"Warning: static shadow caster type {entity_type} moved,"
+                    " it belongs in SHADOW_DYNAMIC_TYPES")
+
+    def _caster_bounds(self, casters: list[int],
+        model_transforms: dict[int, np.ndarray]) -> np.ndarray:
+        """
+            Returns the (2, 3) world space box around the bounding boxes
+            of every instance of some entity types, or around the origin
+            if none has a bounding box yet.
+        """
+
+        corners = []
+        for entity_type in casters:
+            mesh = self.meshes[entity_type]
+            if isinstance(mesh, MultiMaterialMesh):
+                if not len(mesh.aabbs):
                     continue
-                mesh = self.meshes[entity_type]
-                if isinstance(mesh, MultiMaterialMesh):
-                    for entity in entities:
-                        glUniformMatrix4fv(
-                            shadow_shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                            1, GL_FALSE, entity.get_model_transform()
-                        )
-                        mesh.render()
-                else:
-                    mesh.arm_for_drawing()
-                    for entity in entities:
-                        glUniformMatrix4fv(
-                            shadow_shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                            1, GL_FALSE, entity.get_model_transform()
-                        )
-                        mesh.draw()
-
-            glBindFramebuffer(GL_FRAMEBUFFER, 0)
-            glViewport(0, 0, self.window_width, self.window_height)
+                box = np.array((mesh.aabbs[:, 0].min(axis=0), mesh.aabbs[:, 1].max(axis=0)))
+            elif mesh.aabb is not None:
+                box = mesh.aabb
+            else:
+                continue
+            # The 8 corners of the box, through every instance's transform
+            box_corners = np.array(
+                [(x, y, z, 1) for x in box[:, 0] for y in box[:, 1] for z in box[:, 2]],
+                dtype=np.float32)
+            corners.append((box_corners @ model_transforms[entity_type])[..., :3].reshape(-1, 3))
+
+        if not corners:
+            return np.zeros((2, 3), dtype=np.float32)
+        corners = np.concatenate(corners)
+        return np.array((corners.min(axis=0), corners.max(axis=0)))
+
+    def _is_streaming(self, entity_types: list[int]) -> bool:
+        """
+            Whether the models of some entity types are still loading.
+        """
 
-        # STEP 2: Main geometry render
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        view = camera.get_view_transform()
-        
-        # First render standard objects
-        shader = self.shaders[PIPELINE_TYPE["STANDARD"]]
-        shader.use()
-        glUniform1i(glGetUniformLocation(shader.program, "shadowsEnabled"), int(self.shadows_enabled and len(lights) > 0))
+        return any(
+            isinstance(self.meshes[t], MultiMaterialMesh) and self.meshes[t].is_loading()
+            for t in entity_types)
 
-        # Pass light-space matrix and shadow map
+    def _shadow_casters(self, renderables: dict[int, list[Entity]]) -> list[int]:
+        """
+            Returns the entity types casting shadows.
+        """
+
+        return [
+            entity_type for entity_type, entities in renderables.items()
+            if entities and entity_type != ENTITY_TYPE["PROMPT"]]  # No shadows for UI elements
+
+    def _draw_shadow_casters(self, fbo: int, casters: list[int],
+        model_transforms: dict[int, np.ndarray], light_space_matrix: np.ndarray,
+        clear: bool) -> None:
+        """
+            Draw the depth of some entity types into a shadow framebuffer,
+            skipping what is outside of the light's frustum.
+        """
+
+        glViewport(0, 0, self.shadow_width, self.shadow_height)
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        if clear:
+            glClear(GL_DEPTH_BUFFER_BIT)
+
+        # The light transform is an orthographic projection after a view
+        self.shadow_culler.begin_frame(
+            np.identity(4, dtype=np.float32), light_space_matrix)
+        self._draw_depth(casters, model_transforms, light_space_matrix, self.shadow_culler)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(0, 0, self.window_width, self.window_height)
+
+    def _draw_depth(self, casters: list[int], model_transforms: dict[int, np.ndarray],
+        light_space_matrix: np.ndarray, culler: FrustumCuller | None = None) -> None:
+        """
+            Draw the depth of some entity types with the shadow shader,
+            one instanced draw per mesh type.
+
+            Parameters:
+
+                casters: the entity types to draw
+
+                model_transforms: the model transforms of each entity type
+
+                light_space_matrix: the world to clip transform of the pass
+
+                culler: holding the frustum of the pass, to skip the
+                    instances and octree leaves outside of it
+        """
+
+        shadow_shader = self.shaders[PIPELINE_TYPE["SHADOW"]]
+        shadow_shader.use()
         glUniformMatrix4fv(
-            glGetUniformLocation(shader.program, "lightSpaceMatrix"),
+            shadow_shader.fetch_single_location(UNIFORM_TYPE["LIGHT_MATRIX"]),
             1, GL_FALSE, light_space_matrix
         )
 
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.shadow_depth_texture)
-        glUniform1i(glGetUniformLocation(shader.program, "shadowMap"), 1)
+        for entity_type in casters:
+            mesh = self.meshes[entity_type]
+            transforms = model_transforms[entity_type]
+            if isinstance(mesh, MultiMaterialMesh):
+                visible = None
+                if culler is not None and mesh.tree is not None:
+                    visible = culler.cull(
+                        mesh.tree.leaf_bounds, mesh.tree.leaf_spheres, transforms)
+                    if not visible.any():
+                        continue
+                mesh.render_depth(pack_instances(transforms), visible)
+            else:
+                if culler is not None and mesh.aabb is not None:
+                    transforms = transforms[
+                        culler.cull(mesh.aabb[None], mesh.sphere[None], transforms)[:, 0]]
+                    if not len(transforms):
+                        continue
+                mesh.arm_for_drawing()
+                mesh.draw_instanced(pack_instances(transforms))
+
+    def _set_lighting_uniforms(self, shader: Shader, camera: Camera, view: np.ndarray,
+        sorted_lights: list[PointLight]) -> None:
+        """
+            Set the per-frame uniforms of a lit shader.
+
+            Parameters:
+
+                shader: the forward or deferred lighting shader.
+
+                camera: the scene's camera
+
+                view: the camera's view transform
+
+                sorted_lights: the lights sent to the shader, closest first
+        """
+
+        shader.use()
+        glUniform1i(
+            shader.fetch_single_location(UNIFORM_TYPE["SHADOWS_ENABLED"]),
+            int(self.shadows_enabled and len(sorted_lights) > 0))
+
+        # Shadow cascades
+        matrices, splits, depth_ranges = self.cascades
+        glUniformMatrix4fv(
+            shader.fetch_single_location(UNIFORM_TYPE["CASCADE_MATRICES"]),
+            len(matrices), GL_FALSE, matrices
+        )
+        glUniform1fv(
+            shader.fetch_single_location(UNIFORM_TYPE["CASCADE_SPLITS"]), len(splits), splits)
+        glUniform1fv(
+            shader.fetch_single_location(UNIFORM_TYPE["CASCADE_DEPTH_RANGES"]),
+            len(depth_ranges), depth_ranges)
+        glUniform1i(
+            shader.fetch_single_location(UNIFORM_TYPE["CASCADE_COUNT"]), len(matrices))
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["PCF_RADIUS"]), self.pcf_radius)
 
         glUniformMatrix4fv(
             shader.fetch_single_location(UNIFORM_TYPE["VIEW"]),
@@ -370,122 +771,188 @@ class GraphicsEngine:
             1, camera.position
         )
 
-        # Send only the closest lights to shader
-        for i, light in enumerate(sorted_lights):
-            glUniform3fv(shader.fetch_multi_location(UNIFORM_TYPE["LIGHT_POS"], i), 1, light.position)
-            glUniform3fv(shader.fetch_multi_location(UNIFORM_TYPE["LIGHT_COLOR"], i), 1, light.color)
-            glUniform1f(shader.fetch_multi_location(UNIFORM_TYPE["LIGHT_STRENGTH"], i), light.strength)
+        if sorted_lights:
+            glUniform3fv(
+                shader.fetch_single_location(UNIFORM_TYPE["SHADOW_LIGHT_POS"]),
+                1, sorted_lights[0].position)
+
+        # Clustered lights
+        glUniform3i(
+            shader.fetch_single_location(UNIFORM_TYPE["CLUSTER_DIMS"]), *self.clusters.grid)
+        glUniform2f(
+            shader.fetch_single_location(UNIFORM_TYPE["CLUSTER_DEPTH"]),
+            self.clusters.depth_scale, self.clusters.depth_bias)
+        glUniform2f(
+            shader.fetch_single_location(UNIFORM_TYPE["SCREEN_SIZE"]),
+            self.render_width, self.render_height)
+
+        glUniform1i(
+            shader.fetch_single_location(UNIFORM_TYPE["OMNI_SHADOW_SLOTS"]),
+            self.omni_shadows.count)
+        glUniform1f(
+            shader.fetch_single_location(UNIFORM_TYPE["OMNI_SHADOW_NEAR"]), OMNI_SHADOW_NEAR)
+
+    def _render_deferred(self, view: np.ndarray) -> None:
+        """
+            Draw the opaque layer through the G-buffer: the geometry pass
+            stores the closest surface of every pixel, then a fullscreen
+            pass lights each pixel once. Its depth is copied back so the
+            skybox and blended layers still test against the geometry.
+        """
+
+        self.gbuffer.bind(self.render_width, self.render_height)
+        shaders = dict(self.shaders)
+        shaders[PIPELINE_TYPE["STANDARD"]] = self.shaders[PIPELINE_TYPE["GEOMETRY"]]
+        self.render_queue.submit(
+            RENDER_LAYER["OPAQUE"], shaders, self.culler, self.occlusion)
+        self.occlusion.issue_queries(view @ self.projection, self.culler.camera_position)
+
+        self.target.bind(self.render_width, self.render_height)
+
+        glDisable(GL_DEPTH_TEST)
+        self.shaders[PIPELINE_TYPE["DEFERRED_LIGHTING"]].use()
+        self.gbuffer.bind_textures()
+        self.gbuffer.draw_fullscreen()
+        glEnable(GL_DEPTH_TEST)
+
+        self.gbuffer.blit_depth(self.target.fbo, self.render_width, self.render_height)
+
+    def _update_transforms(self, renderables: dict[int, list[Entity]],
+        lights: list[PointLight]) -> dict[int, np.ndarray]:
+        """
+            Compute the model transforms of the frame, once for both
+            passes. Only the entities which moved are recomputed.
+
+            Parameters:
+
+                renderables: dictionary mapping entity types to lists of entities
+
+                lights: all the lights in the scene
+
+            Returns:
 
-        # Render non-UI elements with standard shader
-        for entity_type, entities in all_renderables.items():
-            if entity_type == ENTITY_TYPE["PROMPT"]:  # Skip UI elements for now
+                The model transforms of each entity type, in the order
+                of its entities, lights under POINTLIGHT.
+        """
+
+        groups = dict(renderables)
+        groups[ENTITY_TYPE["POINTLIGHT"]] = lights
+
+        model_transforms = {}
+        for entity_type, entities in groups.items():
+            store = self.transforms.get(entity_type)
+            if store is None or not store.holds(entities):
+                # New, removed or reassigned entities
+                store = TransformStore(entities)
+                self.transforms[entity_type] = store
+            model_transforms[entity_type] = store.update()
+        return model_transforms
+
+    def _fill_render_queue(self, camera: Camera, renderables: dict[int, list[Entity]],
+        lights: list[PointLight], model_transforms: dict[int, np.ndarray]) -> None:
+        """
+            Queue the draws of the main pass and sort them.
+
+            Parameters:
+
+                camera: the scene's camera
+
+                renderables: dictionary mapping entity types to lists of entities
+
+                lights: the lights whose sprites are drawn
+
+                model_transforms: the model transforms of each entity type
+        """
+
+        queue = self.render_queue
+        queue.clear()
+
+        def distances(entity_type: int) -> np.ndarray:
+            # Translations sit in the last row of the model transforms
+            return np.linalg.norm(
+                model_transforms[entity_type][:, 3, :3] - camera.position, axis=1)
+
+        for entity_type, entities in renderables.items():
+            if not entities:
                 continue
-                
             mesh = self.meshes[entity_type]
-            if isinstance(mesh, MultiMaterialMesh):
-                for entity in entities:
-                    glUniformMatrix4fv(
-                        shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                        1, GL_FALSE, entity.get_model_transform()
-                    )
-                    mesh.render()
-            else:
-                if entity_type not in self.materials:
-                    continue
-                self.materials[entity_type].use()
-                mesh.arm_for_drawing()
-                for entity in entities:
-                    glUniformMatrix4fv(
-                        shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                        1, GL_FALSE, entity.get_model_transform()
-                    )
-                    mesh.draw()
-
-        # Draw emissive objects (e.g., point lights)
-        emissive_shader = self.shaders[PIPELINE_TYPE["EMISSIVE"]]
-        emissive_shader.use()
-        glUniformMatrix4fv(
-            emissive_shader.fetch_single_location(UNIFORM_TYPE["VIEW"]),
-            1, GL_FALSE, view
-        )
+            transforms = model_transforms[entity_type]
+
+            if entity_type == ENTITY_TYPE["PROMPT"]:
+                # Make UI elements glow white
+                for transform, distance in zip(transforms, distances(entity_type)):
+                    queue.add(
+                        RENDER_LAYER["OVERLAY"], PIPELINE_TYPE["EMISSIVE"],
+                        self.materials[entity_type], mesh, transform, distance, WHITE)
+            elif isinstance(mesh, MultiMaterialMesh):
+                for transform, distance in zip(transforms, distances(entity_type)):
+                    queue.add(
+                        RENDER_LAYER["OPAQUE"], PIPELINE_TYPE["STANDARD"],
+                        None, mesh, transform, distance)
+            elif entity_type in self.materials:
+                visible = self._cull(mesh, transforms)
+                for transform, distance in zip(
+                    transforms[visible], distances(entity_type)[visible]):
+                    queue.add(
+                        RENDER_LAYER["BLENDED"], PIPELINE_TYPE["STANDARD"],
+                        self.materials[entity_type], mesh, transform, distance)
 
         material = self.materials[ENTITY_TYPE["POINTLIGHT"]]
         mesh = self.meshes[ENTITY_TYPE["POINTLIGHT"]]
-        material.use()
-        mesh.arm_for_drawing()
-        for light in sorted_lights:
-            glUniform3fv(
-                emissive_shader.fetch_single_location(UNIFORM_TYPE["TINT"]), 
-                1, light.color
-            )
-            glUniformMatrix4fv(
-                emissive_shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                1, GL_FALSE, light.get_model_transform()
-            )
-            mesh.draw()
+        if lights:
+            transforms = model_transforms[ENTITY_TYPE["POINTLIGHT"]]
+            light_distances = distances(ENTITY_TYPE["POINTLIGHT"])
+            visible = self._cull(mesh, transforms)
+            # Only the lights sent to the shader get a sprite
+            for i in np.argsort(light_distances, kind="stable")[:self.max_lights]:
+                if not visible[i]:
+                    continue
+                queue.add(
+                    RENDER_LAYER["BLENDED"], PIPELINE_TYPE["EMISSIVE"], material, mesh,
+                    transforms[i], light_distances[i], lights[i].color)
 
-        # Draw skybox
-        glDepthFunc(GL_LEQUAL)
-        self.skybox_shader.use()
+        queue.sort()
 
-        skybox_view = pyrr.matrix44.create_from_matrix33(
-            pyrr.matrix33.create_from_matrix44(view)
-        )
-        aspect = self.window_width / self.window_height
-        projection = pyrr.matrix44.create_perspective_projection(
-            fovy=45, aspect=aspect, near=0.1, far=1000
-        )
+    def _cull(self, mesh: Mesh, transforms: np.ndarray) -> np.ndarray:
+        """
+            Returns which instances of a mesh may be in view.
+        """
 
-        glUniformMatrix4fv(
-            glGetUniformLocation(self.skybox_shader.program, "view"),
-            1, GL_FALSE, skybox_view
-        )
-        glUniformMatrix4fv(
-            glGetUniformLocation(self.skybox_shader.program, "projection"),
-            1, GL_FALSE, projection
-        )
+        if mesh.aabb is None:
+            return np.ones(len(transforms), dtype=bool)
+        return self.culler.cull(mesh.aabb[None], mesh.sphere[None], transforms)[:, 0]
 
-        self.skybox.use()
-        self.skybox_mesh.arm_for_drawing()
-        self.skybox_mesh.draw()
-        glDepthFunc(GL_LESS)
+    def frame_stats(self) -> tuple[int, int, int, int]:
+        """
+            Returns the draw calls and state changes (shader, material
+            and vertex array switches) of the last frame's main pass,
+            then the number of bounding volumes culled and tested.
+        """
 
-        # Now render UI elements with emissive shader (as the very last step)
-        if ENTITY_TYPE["PROMPT"] in all_renderables:
-            emissive_shader = self.shaders[PIPELINE_TYPE["EMISSIVE"]]
-            emissive_shader.use()
-            glUniformMatrix4fv(
-                emissive_shader.fetch_single_location(UNIFORM_TYPE["VIEW"]),
-                1, GL_FALSE, view
-            )
+        return (self.render_queue.draw_calls, self.render_queue.state_changes,
+            self.culler.culled, self.culler.tested)
 
-            prompt_material = self.materials[ENTITY_TYPE["PROMPT"]]
-            prompt_mesh = self.meshes[ENTITY_TYPE["PROMPT"]]
+    def toggle_culling(self):
+        self.culler.toggle()
 
-            prompt_material.use()
-            prompt_mesh.arm_for_drawing()
+    def toggle_occlusion(self):
+        self.occlusion.toggle()
 
-            # Disable depth testing for UI elements
-            glDisable(GL_DEPTH_TEST)
+    def toggle_portals(self):
+        if self.rooms is None:
+            print(f"No rooms to cull, see {ROOMS_CONFIG}")
+            return
+        self.rooms.toggle()
 
-            # Render all UI elements
-            for entity in all_renderables[ENTITY_TYPE["PROMPT"]]:
-                # Make UI elements glow white
-                glUniform3fv(
-                    emissive_shader.fetch_single_location(UNIFORM_TYPE["TINT"]), 
-                    1, np.array([1.0, 1.0, 1.0], dtype=np.float32)
-                )
-                glUniformMatrix4fv(
-                    emissive_shader.fetch_single_location(UNIFORM_TYPE["MODEL"]),
-                    1, GL_FALSE,
-                    entity.get_model_transform()
-                )
-                prompt_mesh.draw()
-
-            # Re-enable depth testing for other objects
-            glEnable(GL_DEPTH_TEST)
+    def toggle_deferred(self):
+        self.deferred = not self.deferred
+        print("Deferred shading enabled:", self.deferred)
 
-        glFlush()
+    def toggle_adaptive_quality(self):
+        self.quality.toggle()
+
+    def toggle_dynamic_resolution(self):
+        self.resolution.toggle()
 
     def toggle_shadows(self):
         self.shadows_enabled = not self.shadows_enabled
@@ -498,8 +965,8 @@ class GraphicsEngine:
         for shader in self.shaders.values():
             shader.destroy()
 
-        # Rebuild everything
-        self._create_assets()
+        # Rebuild the programs only, the meshes and materials are kept
+        self._create_shaders()
         self._get_uniform_locations()
         self._set_onetime_uniforms()
 
@@ -514,8 +981,14 @@ class GraphicsEngine:
         for shader in self.shaders.values():
             shader.destroy()
 
-        glDeleteFramebuffers(1, [self.shadow_fbo])
-        glDeleteTextures(1, [self.shadow_depth_texture])
+        fbos = self.shadow_fbos + [self.shadow_static_fbo]
+        glDeleteFramebuffers(len(fbos), fbos)
+        glDeleteTextures(2, [self.shadow_depth_texture, self.shadow_static_texture])
         self.skybox.destroy()
         self.skybox_mesh.destroy()
         self.skybox_shader.destroy()
+        self.occlusion.destroy()
+        self.clusters.destroy()
+        self.gbuffer.destroy()
+        self.omni_shadows.destroy()
+        self.target.destroy()
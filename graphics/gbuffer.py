@@ -0,0 +1,137 @@
+from OpenGL.GL import *
+
+# Texture units of the G-buffer textures read by the lighting pass
+ALBEDO_UNIT = 6
+NORMAL_UNIT = 7
+POSITION_UNIT = 8
+
+# Internal format, format and type of each color attachment
+_ATTACHMENTS = (
+    (GL_RGBA8, GL_RGBA, GL_UNSIGNED_BYTE),   # albedo, alpha 0 where nothing was drawn
+    (GL_RGBA16F, GL_RGBA, GL_FLOAT),         # world space normal
+    (GL_RGBA32F, GL_RGBA, GL_FLOAT),         # world space position
+)
+# (RGB float formats are not required to be renderable in OpenGL 3.3,
+# the four channel ones are)
+
+
+class GBuffer:
+    """
+        The framebuffer of the deferred pipeline's geometry pass: the
+        albedo, normal and position of the closest opaque surface of
+        every pixel, and its depth, which is copied to the render
+        target afterwards so the forward passes can test against it.
+    """
+    __slots__ = ("fbo", "textures", "depth", "vao", "width", "height", "complete")
+
+
+    def __init__(self, width: int, height: int):
+        """
+            Create the framebuffer at the window's size.
+        """
+
+        self.fbo = 0
+        self.textures: list[int] = []
+        self.depth = 0
+        # The fullscreen triangle is made in the vertex shader, but core
+        # profile still wants a vertex array bound to draw
+        self.vao = glGenVertexArrays(1)
+        self.resize(width, height)
+
+    def resize(self, width: int, height: int) -> None:
+        """
+            Recreate the attachments at a new size.
+        """
+
+        self._delete_targets()
+        self.width = max(1, width)
+        self.height = max(1, height)
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+
+        self.textures = []
+        for i, (internal_format, pixel_format, pixel_type) in enumerate(_ATTACHMENTS):
+            texture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format, self.width, self.height,
+                0, pixel_format, pixel_type, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + i,
+                GL_TEXTURE_2D, texture, 0)
+            self.textures.append(texture)
+        glDrawBuffers(len(self.textures),
+            [GL_COLOR_ATTACHMENT0 + i for i in range(len(self.textures))])
+
+        # Same format as the usual default framebuffer, so the depth can be blitted
+        self.depth = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT,
+            GL_RENDERBUFFER, self.depth)
+
+        # Without a complete G-buffer the renderer stays forward
+        self.complete = glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        if not self.complete:
+            print("G-buffer is incomplete, deferred shading is unavailable")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def bind(self, width: int, height: int) -> None:
+        """
+            Draw into the G-buffer, cleared, over the given region from
+            its corner (the scene may be rendered below the window's size).
+        """
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, width, height)
+        for i in range(len(self.textures)):
+            glClearBufferfv(GL_COLOR, i, (0, 0, 0, 0))
+        glClear(GL_DEPTH_BUFFER_BIT)
+
+    def bind_textures(self) -> None:
+        """
+            Bind the attachments to their units for the lighting pass.
+        """
+
+        for unit, texture in zip((ALBEDO_UNIT, NORMAL_UNIT, POSITION_UNIT), self.textures):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_2D, texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def draw_fullscreen(self) -> None:
+        """
+            Draw one triangle covering the screen, with the lighting
+            shader in use.
+        """
+
+        glBindVertexArray(self.vao)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+
+    def blit_depth(self, target: int, width: int, height: int) -> None:
+        """
+            Copy the depth of the geometry pass, over the given region
+            from the corner, into the same region of another framebuffer.
+        """
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, target)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height,
+            GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, target)
+
+    def _delete_targets(self) -> None:
+
+        if self.fbo:
+            glDeleteFramebuffers(1, [self.fbo])
+            glDeleteTextures(len(self.textures), self.textures)
+            glDeleteRenderbuffers(1, [self.depth])
+        self.fbo = 0
+        self.textures = []
+        self.depth = 0
+
+    def destroy(self) -> None:
+
+        self._delete_targets()
+        glDeleteVertexArrays(1, (self.vao,))
@@ -0,0 +1,107 @@
+import collections
+import sys
+from typing import Callable
+
+# Modules whose OpenGL calls are counted
+COUNTED_MODULES = (
+    "graphics.engine", "graphics.mesh", "graphics.material",
+    "graphics.shader", "graphics.skybox", "graphics.texture",
+    "graphics.occlusion", "graphics.clusters", "graphics.gbuffer",
+    "graphics.omni_shadows", "graphics.render_target",
+)
+
+
+class GLCallCounter:
+    """
+        Counts the OpenGL calls made by the renderer, per frame.
+
+        While enabled, every gl* function imported by the counted modules
+        is replaced with a counting wrapper, so the counter costs nothing
+        when it is off.
+    """
+    __slots__ = ("counts", "frames", "originals")
+
+
+    def __init__(self):
+        """
+            Initialize a disabled counter.
+        """
+
+        self.counts: collections.Counter[str] = collections.Counter()
+        self.frames = 0
+        # (module, name) -> original function, while enabled
+        self.originals: dict[tuple[str, str], Callable] = {}
+
+    @property
+    def enabled(self) -> bool:
+
+        return bool(self.originals)
+
+    def toggle(self) -> None:
+        """
+            Start or stop counting.
+        """
+
+        if self.enabled:
+            self._uninstall()
+        else:
+            self._install()
+        self.reset()
+        print("GL call counter enabled:", self.enabled)
+
+    def _install(self) -> None:
+
+        for module_name in COUNTED_MODULES:
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            for name, function in vars(module).items():
+                if name.startswith("gl") and not name.startswith("glfw") \
+                    and callable(function) and not isinstance(function, type):
+                    self.originals[(module_name, name)] = function
+                    setattr(module, name, self._wrap(name, function))
+
+    def _uninstall(self) -> None:
+
+        for (module_name, name), function in self.originals.items():
+            setattr(sys.modules[module_name], name, function)
+        self.originals.clear()
+
+    def _wrap(self, name: str, function: Callable) -> Callable:
+
+        counts = self.counts
+
+        def counted(*args, **kwargs):
+            counts[name] += 1
+            return function(*args, **kwargs)
+
+        return counted
+
+    def end_frame(self) -> None:
+        """
+            Mark the end of a frame.
+        """
+
+        self.frames += 1
+
+    def reset(self) -> None:
+
+        self.counts.clear()
+        self.frames = 0
+
+    def report(self) -> str:
+        """
+            Returns the average number of calls per frame since the last
+            reset, with the most frequent functions, then resets.
+        """
+
+        frames = max(1, self.frames)
+        total = sum(self.counts.values()) / frames
+        top = ", ".join(
+            f"{name} {count / frames:.0f}"
+            for name, count in self.counts.most_common(5))
+        self.reset()
+        return f"{total:.0f} GL calls/frame ({top})"
+
+
+gl_counter = GLCallCounter()
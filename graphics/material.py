@@ -1,74 +1,109 @@
 from OpenGL.GL import *
-from PIL import Image
+from core.constants import UNIFORM_TYPE
+from graphics.shader import Shader
+from graphics.texture import TextureArrays, texture_manager
 
 
 class Material:
     """
         A basic texture.
     """
-    __slots__ = ("texture",)
+    # Weakly referenced by the render queue's sort ids
+    __slots__ = ("texture", "filepath", "__weakref__")
 
     
     def __init__(self, filepath: str):
         """
-            Initialize and load the texture.
+            Initialize and load the texture. Materials using the same
+            image file share a single texture.
 
             Parameters:
 
                 filepath: path to the image file.
         """
 
-        self.texture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        print(filepath)
-
-        try:
-            with open(filepath, mode = "rb"):
-                pass
-        except FileNotFoundError:
-            print(f"Error: Texture file '{filepath}' not found.")
-            return
-        
-        with Image.open(filepath, mode = "r") as img:
-            image_width,image_height = img.size
-            img = img.convert("RGBA")
-            img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            img_data = bytes(img.tobytes())
-            glTexImage2D(GL_TEXTURE_2D,0,GL_RGBA,image_width,image_height,0,GL_RGBA,GL_UNSIGNED_BYTE,img_data)
-        glGenerateMipmap(GL_TEXTURE_2D)
-
-    def use(self) -> None:
+        self.filepath = filepath
+        self.texture = texture_manager.acquire(filepath)
+
+    def use(self, shader: Shader) -> None:
         """
             Arm the texture for drawing.
+
+            Parameters:
+
+                shader: the shader in use.
         """
 
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D,self.texture)
-        glUniform1i(glGetUniformLocation(glGetInteger(GL_CURRENT_PROGRAM), "useTexture"), GL_TRUE)
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["USE_TEXTURE"]), GL_TRUE)
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["USE_TEXTURE_ARRAY"]), GL_FALSE)
+
+
+    def destroy(self) -> None:
+        """
+            Release the texture.
+        """
+
+        texture_manager.release(self.filepath)
+
+class TextureArrayMaterial:
+    """
+        A texture stored as a layer of one of a model's texture arrays.
+    """
+    __slots__ = ("arrays", "size", "layer")
+
+
+    def __init__(self, arrays: TextureArrays, size: int, layer: int):
+        """
+            Parameters:
 
+                arrays: the texture arrays of the model.
+
+                size, layer: where the texture is, as returned by arrays.add.
+        """
+
+        self.arrays = arrays
+        self.size = size
+        self.layer = layer
+
+    def use(self, shader: Shader) -> None:
+        """
+            Arm the texture array and layer for drawing.
+
+            Parameters:
+
+                shader: the shader in use.
+        """
+
+        glActiveTexture(GL_TEXTURE2)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.arrays.arrays[self.size])
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["USE_TEXTURE"]), GL_TRUE)
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["USE_TEXTURE_ARRAY"]), GL_TRUE)
+        self.use_layer(shader)
+
+    def use_layer(self, shader: Shader) -> None:
+        """
+            Switch layer, when the right texture array is already bound.
+        """
+
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["TEXTURE_LAYER"]), self.layer)
 
     def destroy(self) -> None:
         """
-            Free the texture.
+            The texture arrays belong to the mesh.
         """
 
-        glDeleteTextures(1, (self.texture,))
+        pass
 
 class ColorMaterial:
     def __init__(self, rgb: list[float]):
         self.color = rgb
 
-    def use(self):
-        location = glGetUniformLocation(glGetInteger(GL_CURRENT_PROGRAM), "tintColor")
-        glUniform3fv(location, 1, self.color)
-
-        use_texture_location = glGetUniformLocation(glGetInteger(GL_CURRENT_PROGRAM), "useTexture")
-        glUniform1i(use_texture_location, GL_FALSE)
-        glUniform3fv(glGetUniformLocation(glGetInteger(GL_CURRENT_PROGRAM), "tint"), 1, self.color)
+    def use(self, shader: Shader):
+        glUniform1i(shader.fetch_single_location(UNIFORM_TYPE["USE_TEXTURE"]), GL_FALSE)
+        glUniform3fv(shader.fetch_single_location(UNIFORM_TYPE["TINT"]), 1, self.color)
 
     def destroy(self):
         pass
@@ -1,15 +1,81 @@
+import queue
+import threading
 from OpenGL.GL import *
 import numpy as np
 from utils.obj_loader import *
+from utils.mesh_cache import (load_cached_multi_material_mesh,
+    stream_cached_multi_material_mesh)
+from utils.spatial import SpatialTree, visible_ranges
 from graphics.material import *
+from graphics.shader import Shader
+from core.constants import LOD_HYSTERESIS, LOD_SCREEN_SIZES
+from graphics.culling import FrustumCuller
+from graphics.occlusion import OcclusionCuller
 
+############################## instancing #####################################
 
+# Per instance: model transform (16 floats), tint (3 floats), padding
+INSTANCE_FLOATS = 20
+INSTANCE_STRIDE = INSTANCE_FLOATS * 4
+
+
+def pack_instances(transforms: np.ndarray, tints: np.ndarray | None = None) -> np.ndarray:
+    """
+        Pack the per-instance data of an instanced draw.
+
+        Parameters:
+
+            transforms: (n, 4, 4) model transforms
+
+            tints: (n, 3) colors, white when omitted
+
+        Returns:
+
+            (n, INSTANCE_FLOATS) float32
+    """
+
+    transforms = np.asarray(transforms, dtype=np.float32).reshape(-1, 16)
+    instances = np.zeros((len(transforms), INSTANCE_FLOATS), dtype=np.float32)
+    instances[:, :16] = transforms
+    instances[:, 16:19] = 1.0 if tints is None else tints
+    return instances
+
+
+def set_up_instance_attributes(instance_vbo: int) -> None:
+    """
+        Point attributes 3-6 (model transform columns) and 7 (tint)
+        of the bound vertex array at an instance buffer.
+    """
+
+    glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+    for column in range(4):
+        glEnableVertexAttribArray(3 + column)
+        glVertexAttribPointer(
+            3 + column, 4, GL_FLOAT, GL_FALSE, INSTANCE_STRIDE, 
+            ctypes.c_void_p(16 * column))
+        glVertexAttribDivisor(3 + column, 1)
+    glEnableVertexAttribArray(7)
+    glVertexAttribPointer(7, 3, GL_FLOAT, GL_FALSE, INSTANCE_STRIDE, ctypes.c_void_p(64))
+    glVertexAttribDivisor(7, 1)
+
+
+def upload_instances(instance_vbo: int, instances: np.ndarray) -> None:
+    """
+        Replace the contents of an instance buffer.
+    """
+
+    glBindBuffer(GL_ARRAY_BUFFER, instance_vbo)
+    glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_STREAM_DRAW)
+
+############################## meshes #########################################
 
 class Mesh:
     """
         A basic mesh which can hold data and be drawn.
     """
-    __slots__ = ("vao", "vbo", "vertex_count")
+    # Weakly referenced by the render queue's sort ids
+    __slots__ = ("vao", "vbo", "ebo", "vertex_count", "index_count", "instance_vbo",
+        "aabb", "sphere", "__weakref__")
 
 
     def __init__(self):
@@ -17,6 +83,11 @@ class Mesh:
             Initialize the mesh.
         """
 
+        self.ebo = None
+        self.index_count = 0
+        # model space bounding volumes, see bounding_volumes
+        self.aabb = self.sphere = None
+
         # x, y, z, s, t, nx, ny, nz
         self.vao = glGenVertexArrays(1)
         glBindVertexArray(self.vao)
@@ -31,6 +102,26 @@ class Mesh:
         #normal
         glEnableVertexAttribArray(2)
         glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(20))
+        #per instance transform and tint
+        self.instance_vbo = glGenBuffers(1)
+        set_up_instance_attributes(self.instance_vbo)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+
+    def set_indices(self, indices: np.ndarray) -> None:
+        """
+            Upload an index buffer, the mesh will then be drawn
+            with glDrawElements.
+
+            Parameters:
+
+                indices: uint32 vertex indices, three per triangle
+        """
+
+        glBindVertexArray(self.vao)
+        self.ebo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        self.index_count = len(indices)
 
     def arm_for_drawing(self) -> None:
         """
@@ -43,7 +134,26 @@ class Mesh:
             Draw the triangle.
         """
 
-        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        if self.ebo is None:
+            glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        else:
+            glDrawElements(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None)
+
+    def draw_instanced(self, instances: np.ndarray) -> None:
+        """
+            Draw the armed mesh once per instance.
+
+            Parameters:
+
+                instances: per-instance data, see pack_instances
+        """
+
+        upload_instances(self.instance_vbo, instances)
+        if self.ebo is None:
+            glDrawArraysInstanced(GL_TRIANGLES, 0, self.vertex_count, len(instances))
+        else:
+            glDrawElementsInstanced(
+                GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None, len(instances))
 
     def destroy(self) -> None:
         """
@@ -51,7 +161,9 @@ class Mesh:
         """
         
         glDeleteVertexArrays(1,(self.vao,))
-        glDeleteBuffers(1,(self.vbo,))
+        glDeleteBuffers(2,(self.vbo, self.instance_vbo))
+        if self.ebo is not None:
+            glDeleteBuffers(1,(self.ebo,))
 
 class ObjMesh(Mesh):
     """
@@ -69,13 +181,14 @@ class ObjMesh(Mesh):
         print("init done")
 
         # x, y, z, s, t, nx, ny, nz
-        vertices, texture_path = load_mesh(filename)
+        vertices, indices, texture_path = load_indexed_mesh(filename)
         print("texturepath= ", texture_path)
         self.texture_path = texture_path or "gfx/wood.jpg"
         self.vertex_count = len(vertices)//8 
-        vertices = np.array(vertices, dtype=np.float32)
+        self.aabb, self.sphere = bounding_volumes(vertices)
 
         glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        self.set_indices(indices)
 
 class RectMesh(Mesh):
     """
@@ -97,69 +210,432 @@ class RectMesh(Mesh):
             0, -w/2,  h/2, 0, 0, 1, 0, 0,
             0, -w/2, -h/2, 0, 1, 1, 0, 0,
             0,  w/2, -h/2, 1, 1, 1, 0, 0,
-
-            0, -w/2,  h/2, 0, 0, 1, 0, 0,
-            0,  w/2, -h/2, 1, 1, 1, 0, 0,
             0,  w/2,  h/2, 1, 0, 1, 0, 0
         )
         vertices = np.array(vertices, dtype=np.float32)
-        self.vertex_count = 6
+        self.vertex_count = 4
+        self.aabb, self.sphere = bounding_volumes(vertices)
         
         glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        self.set_indices(np.array((0, 1, 2, 0, 2, 3), dtype=np.uint32))
 
 class MultiMaterialMesh:
-    def __init__(self, filename: str):
-        self.submeshes = []  # list of dicts with vao, vbo, vertex_count, texture
+    def __init__(self, filename: str, streaming: bool = False, texture_arrays: bool = False):
+        """
+            Load a model with one submesh per material.
 
-        
+            Parameters:
 
-        groups = load_multi_material_mesh(filename)
+                filename: path to the .obj file
 
+                streaming: load the model on a background thread, its
+                    submeshes are then uploaded over several frames by
+                    calling stream_upload.
+
+                texture_arrays: pack the textures of the model into
+                    texture arrays, one per size bucket.
+        """
+        self.submeshes = []  # list of dicts with vao, vbo, ebo, count, material
+        self.draw_order = [] # the submeshes, grouped by texture
+        # bounding volumes of the submeshes, in draw order
+        self.aabbs = np.zeros((0, 2, 3), dtype=np.float32)
+        self.spheres = np.zeros((0, 4), dtype=np.float32)
+        # octree whose leaves split the index buffers of the submeshes
+        self.tree: SpatialTree | None = None
+        # level of detail drawn for each leaf of the tree
+        self.lod_levels: np.ndarray | None = None
+        self.stream = None
+        self.texture_arrays = TextureArrays() if texture_arrays else None
+        self.instance_vbo = glGenBuffers(1) # shared by the submeshes
+
+        if streaming:
+            self.stream = MeshStream(filename)
+            return
+
+        groups, self.tree = load_cached_multi_material_mesh(filename)
         for mat_name, data in groups.items():
-            vao = glGenVertexArrays(1)
-            vbo = glGenBuffers(1)
+            submesh = self._create_submesh(data)
+            self._upload_submesh(submesh, None)
+            self.submeshes.append(submesh)
+        self._submeshes_added()
+
+    def _create_submesh(self, data: dict) -> dict:
+        """
+            Allocate the buffers and material of a submesh, 
+            its data is uploaded separately.
+        """
+
+        vao = glGenVertexArrays(1)
+        vbo = glGenBuffers(1)
+
+        glBindVertexArray(vao)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(1)
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(2)
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(20))
+        set_up_instance_attributes(self.instance_vbo)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+
+        # memory-mapped from the compiled mesh, uploaded without a copy
+        vertices = data["vertices"]
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, None, GL_STATIC_DRAW)
+
+        indices = data["indices"]
+        ebo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, None, GL_STATIC_DRAW)
+
+        texture_path = data.get("texture")
+        color = data.get("color", [1.0, 1.0, 1.0])
+        print("texture_path= ", texture_path)
+        print("color= ", color)
+
+        if texture_path and self.texture_arrays is not None:
+            size, layer = self.texture_arrays.add(texture_path)
+            material = TextureArrayMaterial(self.texture_arrays, size, layer)
+        elif texture_path:
+            material = Material(texture_path)
+        else:
+            material = ColorMaterial(color)
+
+        return {
+            "vao": vao,
+            "vbo": vbo,
+            "ebo": ebo,
+            "count": 0,
+            "material": material,
+            "aabb": data["aabb"],
+            "sphere": data["sphere"],
+            "leaf_ranges": data.get("leaf_ranges"),
+            "lod_ranges": data.get("lod_ranges"),
+            "pending": [(GL_ARRAY_BUFFER, vbo, vertices), (GL_ELEMENT_ARRAY_BUFFER, ebo, indices)],
+            "offset": 0,
+        }
+
+    def _upload_submesh(self, submesh: dict, budget: int | None) -> int:
+        """
+            Upload the next part of a submesh, vertices first, then indices.
+            Triangles become drawable as soon as their indices are uploaded.
+
+            Parameters:
+
+                submesh: the submesh to upload
+
+                budget: maximum number of bytes to upload, None for everything
+            
+            Returns:
+
+                The number of bytes uploaded
+        """
+
+        # The element buffer binding is part of the vertex array state
+        glBindVertexArray(submesh["vao"])
+
+        uploaded = 0
+        while submesh["pending"] and (budget is None or uploaded < budget):
+            target, buffer, data = submesh["pending"][0]
+            offset = submesh["offset"]
+            size = len(data) - offset
+            if budget is not None:
+                size = min(size, max(1, (budget - uploaded) // data.itemsize))
+
+            if size:
+                glBindBuffer(target, buffer)
+                glBufferSubData(
+                    target, offset * data.itemsize, size * data.itemsize, 
+                    data[offset:offset + size])
+            uploaded += size * data.itemsize
+            submesh["offset"] = offset = offset + size
+
+            if target == GL_ELEMENT_ARRAY_BUFFER:
+                submesh["count"] = offset - offset % 3
+            if offset == len(data):
+                submesh["pending"].pop(0)
+                submesh["offset"] = 0
+
+        return uploaded
+
+    def stream_upload(self, budget: int) -> int:
+        """
+            Pick up the submeshes loaded by the background thread and 
+            upload up to budget bytes of them.
+
+            Returns:
+
+                The number of bytes uploaded
+        """
+
+        if self.stream is None:
+            return 0
+
+        loaded = self.stream.take_loaded()
+        for data in loaded:
+            self.submeshes.append(self._create_submesh(data))
+        if loaded:
+            self._submeshes_added()
 
-            glBindVertexArray(vao)
-            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        uploaded = 0
+        for submesh in self.submeshes:
+            if uploaded >= budget:
+                break
+            if submesh["pending"]:
+                uploaded += self._upload_submesh(submesh, budget - uploaded)
 
-            glEnableVertexAttribArray(0)
-            glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(0))
-            glEnableVertexAttribArray(1)
-            glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(12))
-            glEnableVertexAttribArray(2)
-            glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(20))
+        if self.stream.finished and not any(sub["pending"] for sub in self.submeshes):
+            self.tree = self.stream.tree
+            self.stream = None
+
+        return uploaded
+
+    def is_loading(self) -> bool:
+        """
+            Whether some of the model has yet to reach the GPU.
+        """
+
+        return self.stream is not None
+
+    def _submeshes_added(self) -> None:
+        """
+            Allocate the texture array layers of new submeshes and 
+            sort the submeshes so that those sharing a texture 
+            (array) are drawn in a row.
+        """
 
-            vertices = np.array(data["vertices"], dtype=np.float32)
-            glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        if self.texture_arrays is not None:
+            self.texture_arrays.commit()
 
-            texture_path = data.get("texture")
-            color = data.get("color", [1.0, 1.0, 1.0])
-            print("texture_path= ", texture_path)
-            print("color= ", color)
+        def texture_order(sub: dict) -> tuple[int, int]:
+            material = sub["material"]
+            if isinstance(material, TextureArrayMaterial):
+                return (0, material.size)
+            if isinstance(material, Material):
+                return (1, material.texture)
+            return (2, 0)
 
-            if texture_path:
-                material = Material(texture_path)
+        self.draw_order = sorted(self.submeshes, key=texture_order)
+        self.aabbs = np.array([sub["aabb"] for sub in self.draw_order], dtype=np.float32)
+        self.spheres = np.array([sub["sphere"] for sub in self.draw_order], dtype=np.float32)
+
+    def render(self, shader: Shader, instances: np.ndarray,
+        culler: FrustumCuller | None = None,
+        occlusion: OcclusionCuller | None = None) -> tuple[int, int]:
+        """
+            Draw the submeshes with their materials, arming each
+            texture once for the submeshes sharing it.
+
+            Parameters:
+
+                shader: the shader in use.
+
+                instances: per-instance data, see pack_instances
+
+                culler: skips the submeshes, or the octree leaves
+                    of the submeshes, outside of its frustum for every
+                    instance, and picks the level of detail of each
+                    leaf, if given.
+
+                occlusion: skips the octree leaves hidden on its last
+                    queries and queues the leaves in the frustum for
+                    the next queries, if given.
+
+            Returns:
+
+                The number of draw calls and of state changes made.
+        """
+
+        upload_instances(self.instance_vbo, instances)
+
+        visible = visible_leaves = None
+        if culler is not None and self.draw_order:
+            transforms = instances[:, :16].reshape(-1, 4, 4)
+            if self.tree is not None:
+                in_frustum = culler.cull(
+                    self.tree.leaf_bounds, self.tree.leaf_spheres, transforms)
+                visible_leaves = in_frustum
+                if occlusion is not None:
+                    occlusion.register(self, transforms, in_frustum)
+                    unoccluded = occlusion.visibility(self, len(transforms))
+                    if unoccluded is not None:
+                        visible_leaves = in_frustum & unoccluded
+                visible_leaves = visible_leaves.any(axis=0)
+                self._select_lods(culler, transforms)
             else:
-                material = ColorMaterial(color)
+                visible = culler.cull(self.aabbs, self.spheres, transforms).any(axis=0)
+
+        draw_calls = state_changes = 0
+        previous = None
+        for i, sub in enumerate(self.draw_order):
+            if not sub["count"] or (visible is not None and not visible[i]):
+                continue
+            ranges = self._draw_ranges(sub, visible_leaves, self.lod_levels)
+            if not len(ranges):
+                continue
+            material = sub["material"]
+            if isinstance(material, TextureArrayMaterial) \
+                and isinstance(previous, TextureArrayMaterial) \
+                and material.size == previous.size:
+                material.use_layer(shader)
+            elif not (isinstance(material, Material) \
+                and isinstance(previous, Material) \
+                and material.texture == previous.texture):
+                material.use(shader)
+                state_changes += 1
+            previous = material
+            glBindVertexArray(sub["vao"])
+            for first, count in ranges:
+                glDrawElementsInstanced(
+                    GL_TRIANGLES, int(count), GL_UNSIGNED_INT,
+                    ctypes.c_void_p(int(first) * 4), len(instances))
+                draw_calls += 1
+            state_changes += 1
+
+        return draw_calls, state_changes
+
+    def render_depth(self, instances: np.ndarray,
+        visible_leaves: np.ndarray | None = None) -> None:
+        """
+            Draw the geometry only, for depth passes, in full detail: the
+            levels picked for the camera are not those which suit a light,
+            and cached shadow maps must not depend on them.
 
-            self.submeshes.append({
-                "vao": vao,
-                "vbo": vbo,
-                "count": len(vertices) // 8,
-                "material": material
-            })
+            Parameters:
+
+                instances: per-instance data, see pack_instances
+
+                visible_leaves: (instances, leaves) octree leaves to draw,
+                    every leaf when omitted.
+        """
+
+        upload_instances(self.instance_vbo, instances)
+
+        if visible_leaves is not None:
+            visible_leaves = visible_leaves.any(axis=0)
 
-    def render(self):
         for sub in self.submeshes:
-            sub["material"].use()
+            if not sub["count"]:
+                continue
+            ranges = self._draw_ranges(sub, visible_leaves, None)
+            if not len(ranges):
+                continue
             glBindVertexArray(sub["vao"])
-            glDrawArrays(GL_TRIANGLES, 0, sub["count"])
+            for first, count in ranges:
+                glDrawElementsInstanced(
+                    GL_TRIANGLES, int(count), GL_UNSIGNED_INT,
+                    ctypes.c_void_p(int(first) * 4), len(instances))
+
+    def _select_lods(self, culler: FrustumCuller, transforms: np.ndarray) -> None:
+        """
+            Pick the level of detail of every leaf from its projected
+            size, the largest over the instances. A leaf keeps its level
+            until its size is LOD_HYSTERESIS past a threshold.
+        """
+
+        sizes = culler.screen_sizes(self.tree.leaf_spheres, transforms).max(axis=0)
+        thresholds = np.array(LOD_SCREEN_SIZES, dtype=np.float32)
+        finest = (sizes[:, None] * (1 + LOD_HYSTERESIS) < thresholds).sum(axis=1)
+        coarsest = (sizes[:, None] / (1 + LOD_HYSTERESIS) < thresholds).sum(axis=1)
+
+        if self.lod_levels is None or len(self.lod_levels) != len(sizes):
+            self.lod_levels = coarsest
+        self.lod_levels = np.clip(self.lod_levels, finest, coarsest)
+
+    def _draw_ranges(self, sub: dict, visible_leaves: np.ndarray | None,
+        lod_levels: np.ndarray | None):
+        """
+            Returns the (first index, index count) ranges to draw of a
+            submesh: its visible leaves at the given level of detail of
+            each leaf, or in full detail if None.
+        """
+
+        count = sub["count"]
+        leaf_ranges = sub["leaf_ranges"]
+        if leaf_ranges is None:
+            return ((0, count),)
+        if visible_leaves is None:
+            visible_leaves = np.ones(len(leaf_ranges), dtype=bool)
+
+        lod_ranges = sub["lod_ranges"]
+        if lod_ranges is not None and lod_levels is not None \
+            and len(lod_levels) == len(leaf_ranges):
+            levels = np.minimum(lod_levels, len(lod_ranges) - 1)
+            selected = lod_ranges[levels, np.arange(len(leaf_ranges))]
+            # Levels which are not uploaded yet are drawn in full detail
+            uploaded = selected[:, 0].astype(np.int64) + selected[:, 1] <= count
+            leaf_ranges = np.where(uploaded[:, None], selected, leaf_ranges)
+
+        return visible_ranges(leaf_ranges, visible_leaves, count)
 
     def destroy(self):
         for sub in self.submeshes:
             glDeleteVertexArrays(1, (sub["vao"],))
-            glDeleteBuffers(1, (sub["vbo"],))
+            glDeleteBuffers(2, (sub["vbo"], sub["ebo"]))
             sub["material"].destroy()
+        glDeleteBuffers(1, (self.instance_vbo,))
+        if self.texture_arrays is not None:
+            self.texture_arrays.destroy()
+
+class MeshStream:
+    """
+        Loads the material groups of a model on a background thread.
+    """
+    __slots__ = ("groups", "finished", "error", "tree")
+
+
+    def __init__(self, filename: str):
+        """
+            Start loading the model.
+
+            Parameters:
+
+                filename: path to the .obj file
+        """
+
+        self.groups = queue.Queue()
+        self.finished = False
+        self.error = None
+        self.tree = None
+
+        threading.Thread(target=self._load, args=(filename,), daemon=True).start()
+
+    def _load(self, filename: str) -> None:
+
+        try:
+            # The groups one by one as they are read, then the tree
+            groups = stream_cached_multi_material_mesh(filename)
+            while True:
+                try:
+                    name, data = next(groups)
+                except StopIteration as stop:
+                    self.tree = stop.value
+                    break
+                self.groups.put(data)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.groups.put(None)
+
+    def take_loaded(self) -> list[dict]:
+        """
+            Returns the groups loaded since the last call, without waiting.
+        """
+
+        loaded = []
+        while not self.finished:
+            try:
+                data = self.groups.get_nowait()
+            except queue.Empty:
+                break
+            if data is None:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+            else:
+                loaded.append(data)
+        return loaded
 
 class SkyboxMesh(Mesh):
     def __init__(self):
@@ -186,3 +662,6 @@ class SkyboxMesh(Mesh):
         glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
         glEnableVertexAttribArray(0)
         glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 0, None)
+        # Positions only, and never instanced
+        for location in range(1, 8):
+            glDisableVertexAttribArray(location)
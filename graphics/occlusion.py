@@ -0,0 +1,271 @@
+from OpenGL.GL import *
+import numpy as np
+
+from core.constants import *
+from graphics.shader import Shader
+
+# Proxies are grown by this fraction of their size, plus a fixed margin,
+# so that they never lose the depth test against their own geometry
+PROXY_GROWTH = 0.01
+PROXY_MARGIN = 0.01
+
+# Leaves closer than this to the camera are not queried, their proxy
+# could be cut by the near plane
+CAMERA_CLEARANCE = 0.5
+
+# Unit cube drawn for every proxy, scaled to the box it stands for
+_CUBE_VERTICES = np.array([
+    0, 0, 0,  1, 0, 0,  1, 1, 0,  0, 1, 0,
+    0, 0, 1,  1, 0, 1,  1, 1, 1,  0, 1, 1,
+], dtype=np.float32)
+_CUBE_INDICES = np.array([
+    0, 2, 1,  0, 3, 2,  4, 5, 6,  4, 6, 7,
+    0, 1, 5,  0, 5, 4,  3, 7, 6,  3, 6, 2,
+    0, 4, 7,  0, 7, 3,  1, 2, 6,  1, 6, 5,
+], dtype=np.uint32)
+
+
+class OcclusionCuller:
+    """
+        Hides the octree leaves of models which were completely behind
+        other geometry on the previous frame.
+
+        After the opaque geometry is drawn, the bounding box of every leaf
+        in the frustum is drawn, without writing color or depth, inside a
+        GL_ANY_SAMPLES_PASSED query: one instanced draw and one query per
+        leaf, covering every instance of its model, with the transforms of
+        the instances computed in one batch. The results are read on the
+        next frame, only if the GPU has them, so the pipeline never waits:
+        a leaf is skipped when its last query passed no sample, and drawn
+        otherwise.
+    """
+    __slots__ = ("enabled", "shader", "vao", "vbo", "ebo", "instance_vbo", "free_queries",
+        "pending", "results", "registered", "queries", "occluded", "frames")
+
+
+    def __init__(self):
+        """
+            Create the proxy shader and cube, occlusion culling starts off.
+        """
+
+        self.enabled = False
+
+        self.shader = Shader("shaders/occlusion_vertex.txt", "shaders/occlusion_fragment.txt")
+        self.shader.cache_single_location(UNIFORM_TYPE["PROXY_TRANSFORM"], "proxyBox")
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, _CUBE_VERTICES.nbytes, _CUBE_VERTICES, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 12, ctypes.c_void_p(0))
+        self.ebo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, _CUBE_INDICES.nbytes, _CUBE_INDICES, GL_STATIC_DRAW)
+
+        # Model, view and projection transform of each instance, a mat4
+        # attribute spanning locations 1 to 4
+        self.instance_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        for column in range(4):
+            glEnableVertexAttribArray(1 + column)
+            glVertexAttribPointer(
+                1 + column, 4, GL_FLOAT, GL_FALSE, 64, ctypes.c_void_p(16 * column))
+            glVertexAttribDivisor(1 + column, 1)
+        glBindVertexArray(0)
+
+        self.free_queries: list[int] = []
+        # (mesh id, leaf, query) issued on the previous frame
+        self.pending: list[tuple[int, int, int]] = []
+        # mesh id -> (instances, leaves) visibility from the last queries
+        self.results: dict[int, np.ndarray] = {}
+        # (tree, transforms, leaves in the frustum) of the meshes drawn this frame
+        self.registered: dict[int, tuple] = {}
+
+        self.queries = 0
+        self.occluded = 0
+        self.frames = 0
+
+    def toggle(self) -> None:
+
+        self.enabled = not self.enabled
+        self._forget()
+        print("Occlusion culling enabled:", self.enabled)
+
+    def _forget(self) -> None:
+
+        for _, _, query in self.pending:
+            self.free_queries.append(query)
+        self.pending.clear()
+        self.results.clear()
+        self.registered.clear()
+        self.reset()
+
+    def collect(self) -> None:
+        """
+            Read the results of the queries issued on the previous frame,
+            call at the start of a frame. Results the GPU does not have
+            yet count as visible.
+        """
+
+        if not self.enabled:
+            return
+
+        self.results = {
+            key: np.ones(in_frustum.shape, dtype=bool)
+            for key, (_, _, in_frustum) in self.registered.items()}
+        self.registered.clear()
+
+        value = np.zeros(1, dtype=np.uint32)
+        for key, leaf, query in self.pending:
+            glGetQueryObjectuiv(query, GL_QUERY_RESULT_AVAILABLE, value)
+            if value[0]:
+                glGetQueryObjectuiv(query, GL_QUERY_RESULT, value)
+                if not value[0]:
+                    # No instance showed any of the leaf
+                    self.results[key][:, leaf] = False
+                    self.occluded += 1
+            self.free_queries.append(query)
+        self.pending.clear()
+        self.frames += 1
+
+    def visibility(self, mesh, count: int) -> np.ndarray | None:
+        """
+            Returns which octree leaves of each instance of a mesh
+            were visible on the last queries.
+
+            Parameters:
+
+                mesh: the multi material mesh.
+
+                count: its number of instances this frame.
+
+            Returns:
+
+                (count, leaves) booleans, or None if every leaf is drawn.
+        """
+
+        if not self.enabled:
+            return None
+        visible = self.results.get(id(mesh))
+        if visible is None or len(visible) != count:
+            return None
+        return visible
+
+    def register(self, mesh, transforms: np.ndarray, in_frustum: np.ndarray) -> None:
+        """
+            Remember the leaves of a mesh to query once the opaque
+            geometry is drawn.
+
+            Parameters:
+
+                mesh: the multi material mesh, with its octree.
+
+                transforms: (instances, 4, 4) model transforms.
+
+                in_frustum: (instances, leaves) leaves inside the frustum.
+        """
+
+        if self.enabled:
+            self.registered[id(mesh)] = (mesh.tree, transforms.copy(), in_frustum)
+
+    def issue_queries(self, view_projection: np.ndarray, camera_position: np.ndarray) -> None:
+        """
+            Draw the proxies of the registered leaves into queries,
+            against the depth buffer of the opaque geometry.
+
+            Parameters:
+
+                view_projection: the camera's view @ projection transform.
+
+                camera_position: the camera's position, leaves around
+                    it are always visible and not queried.
+        """
+
+        if not self.enabled or not self.registered:
+            return
+
+        self.shader.use()
+        glBindVertexArray(self.vao)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        glDepthMask(GL_FALSE)
+        glDepthFunc(GL_LEQUAL)
+        location = self.shader.fetch_single_location(UNIFORM_TYPE["PROXY_TRANSFORM"])
+        camera = np.append(camera_position, 1).astype(np.float32)
+
+        for key, (tree, transforms, in_frustum) in self.registered.items():
+            low, high = tree.leaf_bounds[:, 0], tree.leaf_bounds[:, 1]
+            margin = (high - low) * PROXY_GROWTH + PROXY_MARGIN
+            low, high = low - margin, high + margin
+
+            # A camera inside a box would see it clipped by the near plane,
+            # such leaves are visible for every instance
+            local_cameras = (camera @ np.linalg.inv(transforms))[:, None, :3]
+            around = ((low - CAMERA_CLEARANCE <= local_cameras)
+                & (local_cameras <= high + CAMERA_CLEARANCE)).all(axis=2)
+            queried = np.flatnonzero(in_frustum.any(axis=0) & ~around.any(axis=0))
+            if not len(queried):
+                continue
+
+            instances = np.ascontiguousarray(transforms @ view_projection, dtype=np.float32)
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+            glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_STREAM_DRAW)
+
+            # Unit cube to leaf box transforms
+            boxes = np.zeros((len(queried), 4, 4), dtype=np.float32)
+            boxes[:, [0, 1, 2], [0, 1, 2]] = high[queried] - low[queried]
+            boxes[:, 3, :3] = low[queried]
+            boxes[:, 3, 3] = 1
+
+            for leaf, box in zip(queried, boxes):
+                glUniformMatrix4fv(location, 1, GL_FALSE, box)
+                query = self._take_query()
+                glBeginQuery(GL_ANY_SAMPLES_PASSED, query)
+                glDrawElementsInstanced(
+                    GL_TRIANGLES, len(_CUBE_INDICES), GL_UNSIGNED_INT, None, len(instances))
+                glEndQuery(GL_ANY_SAMPLES_PASSED)
+                self.pending.append((key, int(leaf), query))
+                self.queries += 1
+
+        glBindVertexArray(0)
+        glDepthFunc(GL_LESS)
+        glDepthMask(GL_TRUE)
+        glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+
+    def _take_query(self) -> int:
+
+        if not self.free_queries:
+            self.free_queries.extend(int(query) for query in np.atleast_1d(glGenQueries(64)))
+        return self.free_queries.pop()
+
+    def reset(self) -> None:
+
+        self.queries = 0
+        self.occluded = 0
+        self.frames = 0
+
+    def report(self) -> str:
+        """
+            Returns the queries per frame since the last reset, with
+            how many found their leaf hidden (misses) or not (hits),
+            then resets.
+        """
+
+        frames = max(1, self.frames)
+        hits = (self.queries - self.occluded) / frames
+        misses = self.occluded / frames
+        share = 100 * self.occluded / max(1, self.queries)
+        self.reset()
+        return (f"Occlusion queries: {hits:.0f} hits, {misses:.0f} misses "
+                f"per frame ({share:.1f}% of the queried leaves hidden)")
+
+    def destroy(self) -> None:
+
+        self._forget()
+        queries = self.free_queries
+        if queries:
+            glDeleteQueries(len(queries), np.array(queries, dtype=np.uint32))
+        glDeleteVertexArrays(1, (self.vao,))
+        glDeleteBuffers(3, (self.vbo, self.ebo, self.instance_vbo))
+        self.shader.destroy()
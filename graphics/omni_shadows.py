@@ -0,0 +1,243 @@
+from OpenGL.GL import *
+import numpy as np
+import pyrr
+
+from core.constants import *
+from graphics.culling import FrustumCuller
+
+# Texture units of the atlas and of its face transforms
+OMNI_ATLAS_UNIT = 9
+OMNI_FACES_UNIT = 10
+
+# Near plane of the cube faces, their far plane is the light's radius
+OMNI_SHADOW_NEAR = 0.05
+
+# Direction and up vector of the six faces: +x, -x, +y, -y, +z, -z
+_FACE_DIRECTIONS = np.array(
+    ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)), dtype=np.float32)
+_FACE_UPS = np.array(
+    ((0, -1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1), (0, -1, 0), (0, -1, 0)), dtype=np.float32)
+
+
+class OmniShadowAtlas:
+    """
+        Cube shadow maps for the most relevant point lights, packed in one
+        depth texture: a row of six face tiles per slot. (Cube map arrays
+        need OpenGL 4.0.)
+
+        Lights compete for the slots by priority, their brightness over
+        their squared distance to the camera; a light holding a slot keeps
+        it unless another beats it by OMNI_SHADOW_HYSTERESIS, so shadows do
+        not pop as the camera moves. Each frame only the
+        OMNI_SHADOW_FACES_PER_FRAME faces of highest priority times
+        staleness are rendered. Every face keeps the transform it was
+        rendered with, and a slot is used for shading once all its faces
+        were rendered for its light.
+    """
+    __slots__ = ("count", "tile", "fbo", "texture", "buffer", "faces_texture",
+        "owners", "positions", "radii", "priorities", "matrices", "rendered",
+        "ready", "assigned", "frame", "culler", "faces_rendered")
+
+
+    def __init__(self, count: int = OMNI_SHADOW_LIGHTS, tile: int = OMNI_SHADOW_TILE):
+        """
+            Create the atlas and its framebuffer.
+
+            Parameters:
+
+                count: number of lights with shadows.
+
+                tile: resolution of each cube face.
+        """
+
+        self.count = count
+        self.tile = tile
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT,
+            6 * tile, count * tile,
+            0, GL_DEPTH_COMPONENT, GL_FLOAT, None
+        )
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glFramebufferTexture2D(
+            GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.texture, 0)
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            print("Error: Framebuffer is not complete!")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        # Face transforms, read by the lit shaders: 4 RGBA32F texels each
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffer)
+        glBufferData(GL_TEXTURE_BUFFER, count * 6 * 64, None, GL_DYNAMIC_DRAW)
+        self.faces_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_BUFFER, self.faces_texture)
+        glTexBuffer(GL_TEXTURE_BUFFER, GL_RGBA32F, self.buffer)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+        # The light of each slot, and the position and radius it is rendered for
+        self.owners: list[object | None] = [None] * count
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.radii = np.zeros(count, dtype=np.float32)
+        self.priorities = np.zeros(count, dtype=np.float32)
+        # (slots, faces, 4, 4) transforms the faces were rendered with
+        self.matrices = np.tile(np.identity(4, dtype=np.float32), (count, 6, 1, 1))
+        # Frame each face was last rendered on, -1 if not for its current light
+        self.rendered = np.full((count, 6), -1, dtype=np.int64)
+        self.ready = np.zeros(count, dtype=bool)
+        # Slot of each light given to the last assign, -1 for none
+        self.assigned = np.zeros(0, dtype=np.int32)
+        self.frame = 0
+
+        self.culler = FrustumCuller()
+        self.faces_rendered = 0
+
+    def assign(self, lights: list, camera_position: np.ndarray) -> None:
+        """
+            Give the slots to the lights of highest priority, call
+            once per frame before update.
+
+            Parameters:
+
+                lights: the lights to shade with.
+
+                camera_position: the camera's position.
+        """
+
+        self.frame += 1
+        self.assigned = np.full(len(lights), -1, dtype=np.int32)
+        if not lights:
+            return
+
+        positions = np.array([light.position for light in lights], dtype=np.float32)
+        brightness = np.array(
+            [light.strength * float(np.max(light.color)) for light in lights], dtype=np.float32)
+        distances = np.sum((positions - camera_position) ** 2, axis=1)
+        priorities = brightness / np.maximum(distances, 1.0)
+        radii = np.sqrt(np.maximum(brightness, 0) / LIGHT_CUTOFF)
+
+        held = {id(owner): slot for slot, owner in enumerate(self.owners) if owner is not None}
+        boosted = priorities * np.array(
+            [1 + OMNI_SHADOW_HYSTERESIS if id(light) in held else 1 for light in lights])
+        chosen = set(np.argsort(-boosted, kind="stable")[:self.count].tolist())
+        chosen = {i for i in chosen if priorities[i] > 0}
+
+        # Free the slots of the lights which lost theirs, then fill them
+        kept = {held[id(lights[i])] for i in chosen if id(lights[i]) in held}
+        for slot in range(self.count):
+            if slot not in kept:
+                self.owners[slot] = None
+        free = [slot for slot in range(self.count) if slot not in kept]
+
+        for i in sorted(chosen):
+            slot = held.get(id(lights[i]))
+            if slot is None:
+                slot = free.pop(0)
+                self.owners[slot] = lights[i]
+                self.rendered[slot] = -1
+                self.ready[slot] = False
+            if not np.array_equal(self.positions[slot], positions[i]) \
+                or self.radii[slot] != radii[i]:
+                # The light moved: every face is out of date, and the slot
+                # can't shade until they are all drawn for its new position
+                # and radius, which the shader reads from the light
+                self.positions[slot] = positions[i]
+                self.radii[slot] = radii[i]
+                self.rendered[slot] = -1
+                self.ready[slot] = False
+            self.priorities[slot] = priorities[i]
+            self.assigned[i] = slot
+
+    def shading_slots(self) -> np.ndarray:
+        """
+            Returns the slot to shade each light of the last assign
+            with, -1 for the lights without shadows or whose slot is
+            not fully rendered yet.
+        """
+
+        ready = self.ready[np.maximum(self.assigned, 0)]
+        return np.where((self.assigned >= 0) & ready, self.assigned, -1).astype(np.int32)
+
+    def update(self, draw, budget: int = OMNI_SHADOW_FACES_PER_FRAME) -> None:
+        """
+            Render the faces most in need of it.
+
+            Parameters:
+
+                draw: called as draw(face transform, culler) for each face,
+                    with the face's framebuffer region bound and cleared,
+                    to draw the casters' depth; the culler holds the
+                    face's frustum.
+
+                budget: faces rendered at most.
+        """
+
+        owned = np.array([owner is not None for owner in self.owners])
+        # Faces not rendered for their light come first, then the stalest
+        staleness = np.where(self.rendered < 0, np.inf, self.frame - self.rendered)
+        scores = np.where(owned[:, None], staleness * self.priorities[:, None], -1)
+        order = np.argsort(-scores, axis=None, kind="stable")[:budget]
+        faces = [divmod(int(i), 6) for i in order if scores.flat[i] > 0]
+        self.faces_rendered = len(faces)
+        if not faces:
+            return
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glEnable(GL_SCISSOR_TEST)
+        for slot, face in faces:
+            view, projection = self._face_transforms(slot, face)
+            glViewport(face * self.tile, slot * self.tile, self.tile, self.tile)
+            glScissor(face * self.tile, slot * self.tile, self.tile, self.tile)
+            glClear(GL_DEPTH_BUFFER_BIT)
+
+            self.culler.begin_frame(view, projection)
+            self.matrices[slot, face] = view @ projection
+            draw(self.matrices[slot, face], self.culler)
+            self.rendered[slot, face] = self.frame
+        glDisable(GL_SCISSOR_TEST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        self.ready |= (self.rendered >= 0).all(axis=1)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.buffer)
+        glBufferSubData(GL_TEXTURE_BUFFER, 0, self.matrices.nbytes, self.matrices)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def _face_transforms(self, slot: int, face: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Returns the view and projection transforms of a cube face.
+        """
+
+        position = self.positions[slot]
+        view = pyrr.matrix44.create_look_at(
+            eye=position, target=position + _FACE_DIRECTIONS[face],
+            up=_FACE_UPS[face], dtype=np.float32)
+        projection = pyrr.matrix44.create_perspective_projection(
+            fovy=90, aspect=1, near=OMNI_SHADOW_NEAR,
+            far=max(float(self.radii[slot]), 2 * OMNI_SHADOW_NEAR), dtype=np.float32)
+        return view, projection
+
+    def bind(self) -> None:
+        """
+            Bind the atlas and the face transforms to their units.
+        """
+
+        glActiveTexture(GL_TEXTURE0 + OMNI_ATLAS_UNIT)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glActiveTexture(GL_TEXTURE0 + OMNI_FACES_UNIT)
+        glBindTexture(GL_TEXTURE_BUFFER, self.faces_texture)
+        glActiveTexture(GL_TEXTURE0)
+
+    def destroy(self) -> None:
+
+        glDeleteFramebuffers(1, [self.fbo])
+        glDeleteTextures(2, [self.texture, self.faces_texture])
+        glDeleteBuffers(1, [self.buffer])
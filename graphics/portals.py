@@ -0,0 +1,179 @@
+import json
+import numpy as np
+
+from entities.door import Door
+
+# Rooms and portals of the scene, read at startup when the file exists
+ROOMS_CONFIG = "models/rooms.json"
+
+# A door turned less than this many degrees from its base angle is closed
+_CLOSED_ANGLE = 0.5
+
+
+class RoomGraph:
+    """
+        Rooms joined by portals, used to find what can be seen from
+        the room the camera is in.
+
+        Visibility floods from the camera's room through the portals in
+        view, each portal narrowing the part of the screen through which
+        the rooms behind it can be seen. A portal holding a closed door
+        stops the flood. Rooms are boxes in world space; geometry outside
+        every room (outdoors) is always visible, and when the camera is
+        outdoors every room is.
+    """
+    __slots__ = ("names", "bounds", "portals", "enabled")
+
+
+    def __init__(self, rooms: dict[str, tuple], portals: list[dict]):
+        """
+            Parameters:
+
+                rooms: room name -> (minimum corner, maximum corner).
+
+                portals: each with "rooms", the names of the two rooms
+                    it joins, "corners", the four corners of its
+                    rectangle, and optionally "door", the index of the
+                    door filling it in the scene's doors.
+        """
+
+        self.names = list(rooms)
+        self.bounds = np.array(
+            [rooms[name] for name in self.names], dtype=np.float32).reshape(-1, 2, 3)
+
+        # room index -> [(other room, corners, door index)]
+        self.portals: list[list[tuple]] = [[] for _ in self.names]
+        for portal in portals:
+            a, b = (self.names.index(name) for name in portal["rooms"])
+            corners = np.array(portal["corners"], dtype=np.float32).reshape(4, 3)
+            door = portal.get("door")
+            self.portals[a].append((b, corners, door))
+            self.portals[b].append((a, corners, door))
+
+        self.enabled = True
+
+    @classmethod
+    def load(cls, path: str = ROOMS_CONFIG) -> "RoomGraph | None":
+        """
+            Read a room graph from a json file, see models/rooms.example.json.
+
+            Returns:
+
+                The graph, or None if the file does not exist.
+        """
+
+        try:
+            with open(path, "r") as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        rooms = {name: (room["min"], room["max"]) for name, room in config["rooms"].items()}
+        graph = cls(rooms, config.get("portals", []))
+        print(f"Loaded {len(graph.names)} rooms from {path}")
+        return graph
+
+    def toggle(self) -> None:
+
+        self.enabled = not self.enabled
+        print("Portal culling enabled:", self.enabled)
+
+    def rooms_at(self, points: np.ndarray) -> np.ndarray:
+        """
+            Returns the index of the room holding each point, -1 outdoors.
+            The smallest room wins where rooms overlap.
+        """
+
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        inside = ((self.bounds[None, :, 0] <= points[:, None])
+            & (points[:, None] <= self.bounds[None, :, 1])).all(axis=2)
+        volumes = np.prod(self.bounds[:, 1] - self.bounds[:, 0], axis=1)
+        rooms = np.where(inside, volumes, np.inf).argmin(axis=1)
+        return np.where(inside.any(axis=1), rooms, -1)
+
+    def visible_rooms(self, camera_position: np.ndarray, view_projection: np.ndarray,
+        doors: list[Door]) -> np.ndarray | None:
+        """
+            Flood from the camera's room through the portals in view.
+
+            Parameters:
+
+                camera_position: the camera's position.
+
+                view_projection: the camera's view @ projection transform.
+
+                doors: the doors of the scene, indexed by the portals.
+
+            Returns:
+
+                (rooms,) booleans, or None when everything is visible.
+        """
+
+        if not self.enabled or not self.names:
+            return None
+        start = int(self.rooms_at(camera_position)[0])
+        if start < 0:
+            return None
+
+        visible = np.zeros(len(self.names), dtype=bool)
+        visible[start] = True
+        # (room, screen rectangle it is seen through), rectangles in NDC
+        stack = [(start, np.array([-1, -1, 1, 1], dtype=np.float32))]
+        seen: dict[int, list[np.ndarray]] = {start: [stack[0][1]]}
+
+        while stack:
+            room, rect = stack.pop()
+            for other, corners, door in self.portals[room]:
+                if door is not None and door < len(doors) and _is_closed(doors[door]):
+                    continue
+                through = _portal_rect(corners, view_projection, rect)
+                if through is None:
+                    continue
+
+                # Only go on if this opening shows more of the room than before
+                previous = seen.setdefault(other, [])
+                if any((r[:2] <= through[:2]).all() and (through[2:] <= r[2:]).all()
+                    for r in previous):
+                    continue
+                previous.append(through)
+                visible[other] = True
+                stack.append((other, through))
+
+        return visible
+
+    def hidden_bounds(self, visible: np.ndarray | None) -> np.ndarray:
+        """
+            Returns the (k, 2, 3) boxes of the rooms which are not visible.
+        """
+
+        if visible is None:
+            return np.zeros((0, 2, 3), dtype=np.float32)
+        return self.bounds[~visible]
+
+
+def _is_closed(door: Door) -> bool:
+
+    return not door.is_open and abs(door.eulers[1] - door.base_angle) < _CLOSED_ANGLE
+
+
+def _portal_rect(corners: np.ndarray, view_projection: np.ndarray,
+    rect: np.ndarray) -> np.ndarray | None:
+    """
+        Returns the part of a screen rectangle seen through a portal,
+        None if the portal is outside of it.
+    """
+
+    clip = np.concatenate((corners, np.ones((4, 1), dtype=np.float32)), axis=1) @ view_projection
+    w = clip[:, 3]
+    if (w <= 0).all():
+        return None
+    if (w <= 1e-3).any():
+        # The portal crosses the camera plane, the camera is in the doorway
+        return rect
+
+    ndc = clip[:, :2] / w[:, None]
+    through = np.concatenate((
+        np.maximum(ndc.min(axis=0), rect[:2]), np.minimum(ndc.max(axis=0), rect[2:])))
+    if (through[:2] >= through[2:]).any():
+        return None
+    return through
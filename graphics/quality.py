@@ -0,0 +1,158 @@
+from core.constants import *
+
+
+class QualityController:
+    """
+        Steps the rendering quality through QUALITY_LEVELS to hold
+        TARGET_FPS: down one level as soon as a frame time sample misses
+        the target, up one once QUALITY_RAISE_SAMPLES samples in a row
+        leave QUALITY_HEADROOM to spare. Samples are taken once a second,
+        so a level change has settled before the next one is decided.
+    """
+    __slots__ = ("level", "enabled", "budget", "fast_samples")
+
+
+    def __init__(self, level: int = QUALITY_LEVEL, target_fps: float = TARGET_FPS):
+        """
+            Initialize the controller.
+
+            Parameters:
+
+                level: index of the starting level in QUALITY_LEVELS.
+
+                target_fps: the framerate to hold.
+        """
+
+        self.level = level
+        self.enabled = ADAPTIVE_QUALITY
+        # Milliseconds a frame may take
+        self.budget = 1000.0 / target_fps
+        self.fast_samples = 0
+
+    def toggle(self) -> None:
+
+        self.enabled = not self.enabled
+        self.fast_samples = 0
+        print("Adaptive quality enabled:", self.enabled)
+
+    def settings(self) -> tuple[int, int, int]:
+        """
+            Returns the shadow resolution, PCF radius and light count
+            of the current level.
+        """
+
+        return QUALITY_LEVELS[self.level]
+
+    def update(self, frametime: float, can_lower: bool = True,
+        can_raise: bool = True) -> bool:
+        """
+            Take a frame time sample and pick the level.
+
+            Parameters:
+
+                frametime: average milliseconds per frame, over the last second.
+
+                can_lower, can_raise: whether the level may go down or up,
+                    for instance while another controller still can react.
+
+            Returns:
+
+                Whether the level changed.
+        """
+
+        if not self.enabled:
+            return False
+
+        if frametime > self.budget:
+            self.fast_samples = 0
+            if self.level > 0 and can_lower:
+                self.level -= 1
+                return True
+            return False
+
+        if frametime < self.budget * (1 - QUALITY_HEADROOM) and can_raise:
+            self.fast_samples += 1
+        else:
+            self.fast_samples = 0
+
+        if self.fast_samples >= QUALITY_RAISE_SAMPLES and self.level < len(QUALITY_LEVELS) - 1:
+            self.fast_samples = 0
+            self.level += 1
+            return True
+        return False
+
+
+class ResolutionGovernor:
+    """
+        Scales the resolution the scene is rendered at, between
+        RESOLUTION_SCALE_MIN and 1 of the window's, to keep frames within
+        FRAME_BUDGET milliseconds. Frame times are smoothed, and after each
+        step of RESOLUTION_SCALE_STEP the governor waits
+        RESOLUTION_SETTLE_FRAMES frames for the smoothed time to show its
+        effect. It only steps up with RESOLUTION_HEADROOM of the budget to
+        spare, so it settles rather than oscillating around the budget.
+    """
+    __slots__ = ("scale", "enabled", "budget", "average", "last_time", "settle")
+
+
+    def __init__(self, budget: float = FRAME_BUDGET):
+        """
+            Initialize the governor at full resolution.
+
+            Parameters:
+
+                budget: milliseconds a frame may take.
+        """
+
+        self.scale = 1.0
+        self.enabled = DYNAMIC_RESOLUTION
+        self.budget = budget
+        self.average = budget
+        self.last_time: float | None = None
+        self.settle = 0
+
+    def toggle(self) -> None:
+
+        self.enabled = not self.enabled
+        self.scale = 1.0
+        self.average = self.budget
+        print("Dynamic resolution enabled:", self.enabled)
+
+    def update(self, now: float, paused: bool = False) -> float:
+        """
+            Take the time since the last frame and pick the scale.
+
+            Parameters:
+
+                now: the current time, in seconds.
+
+                paused: keep the scale and ignore this frame's time, as
+                    when models are still streaming in.
+
+            Returns:
+
+                The resolution scale of the frame.
+        """
+
+        if self.last_time is None:
+            self.last_time = now
+            return self.scale
+        frametime = (now - self.last_time) * 1000.0
+        self.last_time = now
+        if not self.enabled or paused:
+            return self.scale
+
+        self.average += RESOLUTION_SMOOTHING * (frametime - self.average)
+        if self.settle > 0:
+            self.settle -= 1
+            return self.scale
+
+        scale = self.scale
+        if self.average > self.budget:
+            scale = max(RESOLUTION_SCALE_MIN, scale - RESOLUTION_SCALE_STEP)
+        elif self.average < self.budget * (1 - RESOLUTION_HEADROOM):
+            scale = min(1.0, scale + RESOLUTION_SCALE_STEP)
+        if scale != self.scale:
+            self.scale = round(scale, 3)
+            self.settle = RESOLUTION_SETTLE_FRAMES
+        return self.scale
@@ -0,0 +1,185 @@
+import weakref
+
+from OpenGL.GL import *
+import numpy as np
+
+from core.constants import *
+from graphics.mesh import Mesh, MultiMaterialMesh, pack_instances
+from graphics.shader import Shader
+from graphics.culling import FrustumCuller
+from graphics.occlusion import OcclusionCuller
+
+# Layout of the sort keys, from the most significant bits:
+#   layer (2) | state (pipeline 4, material 12, mesh 12) | depth (16)  for opaque items
+#   layer (2) | inverted depth (16) | state (pipeline 4, material 12, mesh 12)  otherwise
+_STATE_BITS = 28
+# Materials and meshes are told apart by ids of this many bits
+_ID_BITS = 12
+_MAX_ID = (1 << _ID_BITS) - 1
+_DEPTH_BITS = 16
+_MAX_DEPTH = (1 << _DEPTH_BITS) - 1
+# Items further than this all share the largest depth
+_FAR_DISTANCE = 1000.0
+
+
+class RenderQueue:
+    """
+        Collects the draw items of a frame, sorts them by a packed
+        state key and submits them, skipping redundant state changes.
+
+        Opaque items are grouped by state then drawn front to back,
+        blended items are drawn back to front. Runs of items sharing
+        their state become a single instanced draw.
+    """
+    __slots__ = ("items", "ids", "next_id", "draw_calls", "state_changes")
+
+
+    def __init__(self):
+        """
+            Initialize an empty queue.
+        """
+
+        self.items: list[tuple] = []
+        # material/mesh -> small integer used in the sort keys, forgotten
+        # once the material or mesh is freed
+        self.ids: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.next_id = 1
+        self.draw_calls = 0
+        self.state_changes = 0
+
+    def clear(self) -> None:
+        """
+            Forget the items and counters of the previous frame.
+        """
+
+        self.items.clear()
+        self.draw_calls = 0
+        self.state_changes = 0
+
+        # Give the ids of freed materials and meshes back, between frames
+        # so that the keys of a frame stay consistent
+        if len(self.ids) < self.next_id - 1:
+            for i, thing in enumerate(list(self.ids.keys())):
+                self.ids[thing] = i + 1
+            self.next_id = len(self.ids) + 1
+
+    def _id(self, thing: object) -> int:
+
+        if thing is None:
+            return 0
+        found = self.ids.get(thing)
+        if found is not None:
+            return found
+        if self.next_id > _MAX_ID:
+            raise RuntimeError(
+                f"More than {_MAX_ID} materials and meshes drawn, the sort keys can't tell them apart")
+        self.ids[thing] = self.next_id
+        self.next_id += 1
+        return self.ids[thing]
+
+    def add(self, layer: int, pipeline: int, material, mesh: Mesh | MultiMaterialMesh,
+        transform: np.ndarray, distance: float, tint: np.ndarray | None = None) -> None:
+        """
+            Queue a draw.
+
+            Parameters:
+
+                layer: one of RENDER_LAYER.
+
+                pipeline: the shader to draw with, one of PIPELINE_TYPE.
+
+                material: the material to arm, None for meshes
+                    carrying their own materials.
+
+                mesh: the mesh to draw.
+
+                transform: the model transform of the instance.
+
+                distance: distance from the camera to the instance.
+
+                tint: per-instance color, used by the emissive shader.
+        """
+
+        state = (pipeline << 2 * _ID_BITS) | (self._id(material) << _ID_BITS) | self._id(mesh)
+        depth = min(int(distance / _FAR_DISTANCE * _MAX_DEPTH), _MAX_DEPTH)
+
+        if layer == RENDER_LAYER["OPAQUE"]:
+            key = (state << _DEPTH_BITS) | depth
+        else:
+            key = ((_MAX_DEPTH - depth) << _STATE_BITS) | state
+        key |= layer << (_STATE_BITS + _DEPTH_BITS)
+
+        self.items.append((key, len(self.items), pipeline, material, mesh, transform, tint))
+
+    def sort(self) -> None:
+        """
+            Sort the queued items, call once all of them are added.
+        """
+
+        self.items.sort(key=lambda item: (item[0], item[1]))
+
+    def submit(self, layer: int, shaders: dict[int, Shader],
+        culler: FrustumCuller | None = None,
+        occlusion: OcclusionCuller | None = None) -> None:
+        """
+            Draw the items of one layer. The per-frame uniforms of
+            the shaders must already be set.
+
+            Parameters:
+
+                layer: the layer to draw.
+
+                shaders: the shaders, by pipeline type.
+
+                culler: culls the submeshes of multi material meshes,
+                    other items are culled before being queued.
+
+                occlusion: hides the occluded octree leaves of multi
+                    material meshes.
+        """
+
+        shader = material = mesh = None
+
+        # Consecutive items sharing their state are drawn as one instanced call
+        items = [item for item in self.items if item[0] >> (_STATE_BITS + _DEPTH_BITS) == layer]
+        start = 0
+        while start < len(items):
+            _, _, pipeline, item_material, item_mesh, _, _ = items[start]
+            end = start + 1
+            while end < len(items) and items[end][2] == pipeline \
+                and items[end][3] is item_material and items[end][4] is item_mesh:
+                end += 1
+            batch = items[start:end]
+            start = end
+
+            instances = pack_instances(
+                [item[5] for item in batch],
+                [WHITE if item[6] is None else item[6] for item in batch])
+
+            if shader is not shaders[pipeline]:
+                shader = shaders[pipeline]
+                shader.use()
+                # Material uniforms belong to the program, vertex arrays don't
+                material = None
+                self.state_changes += 1
+
+            if isinstance(item_mesh, MultiMaterialMesh):
+                draw_calls, state_changes = item_mesh.render(shader, instances, culler, occlusion)
+                self.draw_calls += draw_calls
+                self.state_changes += state_changes
+                # The submeshes armed their own materials and vertex arrays
+                material = mesh = None
+                continue
+
+            if item_material is not material:
+                item_material.use(shader)
+                material = item_material
+                self.state_changes += 1
+
+            if item_mesh is not mesh:
+                item_mesh.arm_for_drawing()
+                mesh = item_mesh
+                self.state_changes += 1
+
+            item_mesh.draw_instanced(instances)
+            self.draw_calls += 1
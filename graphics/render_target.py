@@ -0,0 +1,97 @@
+from OpenGL.GL import *
+
+
+class RenderTarget:
+    """
+        The offscreen framebuffer the scene is drawn into, with a half
+        float color texture, so lighting is not clamped before it reaches
+        the window, and a depth buffer. It is allocated at the window's
+        size; with a lower resolution scale only its lower left corner is
+        drawn into and then stretched over the window, so changing the
+        scale reallocates nothing.
+    """
+    __slots__ = ("fbo", "color", "depth", "width", "height")
+
+
+    def __init__(self, width: int, height: int):
+        """
+            Create the framebuffer at the window's size.
+        """
+
+        self.fbo = 0
+        self.color = 0
+        self.depth = 0
+        self.resize(width, height)
+
+    def resize(self, width: int, height: int) -> None:
+        """
+            Recreate the attachments at a new size.
+        """
+
+        self._delete_targets()
+        self.width = max(1, width)
+        self.height = max(1, height)
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+
+        self.color = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.color)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA16F, self.width, self.height,
+            0, GL_RGBA, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0,
+            GL_TEXTURE_2D, self.color, 0)
+
+        # Same format as the G-buffer's, so its depth can be blitted in
+        self.depth = glGenRenderbuffers(1)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT,
+            GL_RENDERBUFFER, self.depth)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            print("Render target is incomplete")
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def bind(self, width: int, height: int) -> None:
+        """
+            Draw into the given region of the target, from its corner.
+        """
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, width, height)
+
+    def present(self, width: int, height: int) -> None:
+        """
+            Stretch the region drawn into over the window, then draw
+            into the window.
+
+            Parameters:
+
+                width, height: size of the region drawn into.
+        """
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+        scaled = (width, height) != (self.width, self.height)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, self.width, self.height,
+            GL_COLOR_BUFFER_BIT, GL_LINEAR if scaled else GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(0, 0, self.width, self.height)
+
+    def _delete_targets(self) -> None:
+
+        if self.fbo:
+            glDeleteFramebuffers(1, [self.fbo])
+            glDeleteTextures(1, [self.color])
+            glDeleteRenderbuffers(1, [self.depth])
+        self.fbo = 0
+        self.color = 0
+        self.depth = 0
+
+    def destroy(self) -> None:
+
+        self._delete_targets()
@@ -51,6 +51,16 @@ class Shader:
             self.program, uniform_name)
         )
     
+    def cache_single_locations(self, uniforms: dict[int, str]) -> None:
+        """
+            Search and store the locations of several uniforms,
+            given as a dictionary mapping uniform types to names.
+            Uniforms missing from the program get location -1.
+        """
+
+        for uniform_type, uniform_name in uniforms.items():
+            self.cache_single_location(uniform_type, uniform_name)
+
     def fetch_single_location(self, uniform_type: int) -> int:
         """
             Returns the location of a uniform location.
@@ -1,18 +1,20 @@
 from OpenGL.GL import *
-from PIL import Image
+import numpy as np
+from graphics.texture import texture_manager
 
 class Skybox:
     def __init__(self, faces: list[str]):
         self.texture_id = glGenTextures(1)
         glBindTexture(GL_TEXTURE_CUBE_MAP, self.texture_id)
 
+        # Black faces until the images are decoded in the background
         for i, face in enumerate(faces):
-            with Image.open(face) as img:
-                img = img.convert("RGB")
-                img_data = img.tobytes()
-                width, height = img.size
-                glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGB,
-                             width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, img_data)
+            glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGB,
+                         1, 1, 0, GL_RGB, GL_UNSIGNED_BYTE,
+                         np.zeros(3, dtype=np.uint8))
+            texture_manager.request(
+                face, self._face_uploader(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i),
+                mode="RGB", flip=False)
 
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
@@ -20,8 +22,22 @@ class Skybox:
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
 
+    def _face_uploader(self, target: int):
+
+        def upload(img_data: np.ndarray) -> None:
+            if self.texture_id is None:
+                return
+            height, width, _ = img_data.shape
+            glBindTexture(GL_TEXTURE_CUBE_MAP, self.texture_id)
+            glTexImage2D(target, 0, GL_RGB,
+                         width, height, 0, GL_RGB, GL_UNSIGNED_BYTE,
+                         np.ascontiguousarray(img_data))
+
+        return upload
+
     def use(self):
         glBindTexture(GL_TEXTURE_CUBE_MAP, self.texture_id)
 
     def destroy(self):
         glDeleteTextures(1, [self.texture_id])
+        self.texture_id = None
@@ -0,0 +1,451 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import numpy as np
+from OpenGL.GL import *
+from PIL import Image
+from core.constants import TEXTURE_ARRAY_MIN_SIZE, TEXTURE_ARRAY_MAX_SIZE
+from utils.ktx import KtxImage, read_ktx
+
+# Decoded images are stored here, relative to the working directory
+TEXTURE_CACHE_DIR = os.path.join("cache", "textures")
+
+
+def decode_image(filepath: str, mode: str = "RGBA", flip: bool = True,
+    cache_dir: str = TEXTURE_CACHE_DIR) -> np.ndarray:
+    """
+        Decode an image file to raw pixels, going through a disk cache
+        keyed by the file's contents so that repeat launches skip the
+        PNG/JPEG decoding.
+
+        Parameters:
+
+            filepath: path to the image file.
+
+            mode: pixel format, as understood by PIL.
+
+            flip: whether to flip the image vertically, as OpenGL
+                expects the first row to be the bottom one.
+
+            cache_dir: directory holding the decoded images.
+
+        Returns:
+
+            (height, width, channels) uint8 pixels
+    """
+
+    with open(filepath, mode = "rb") as f:
+        encoded = f.read()
+
+    key = hashlib.sha1(encoded).hexdigest()
+    cache_path = os.path.join(
+        cache_dir, f"{key}-{mode}{'-flipped' if flip else ''}.npy")
+
+    try:
+        return np.load(cache_path, mmap_mode = "r")
+    except (FileNotFoundError, ValueError):
+        pass
+
+    with Image.open(io.BytesIO(encoded)) as img:
+        img = img.convert(mode)
+        if flip:
+            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+        pixels = np.asarray(img, dtype = np.uint8).reshape(img.height, img.width, -1)
+
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        temporary_path = cache_path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.save(f, pixels)
+        os.replace(temporary_path, cache_path)
+    except OSError as error:
+        print(f"Warning: could not cache decoded texture '{filepath}': {error}")
+
+    return pixels
+
+
+def find_compressed(filepath: str) -> str | None:
+    """
+        Returns the compressed version of an image built by
+        textures/compress_textures.py, if it is up to date.
+    """
+
+    compressed_path = os.path.splitext(filepath)[0] + ".ktx"
+    try:
+        compressed_time = os.path.getmtime(compressed_path)
+    except OSError:
+        return None
+
+    try:
+        if os.path.getmtime(filepath) > compressed_time:
+            return None
+    except OSError:
+        pass
+
+    return compressed_path
+
+
+def supports_s3tc() -> bool:
+    """
+        Whether the current context can sample S3TC (BC1/BC3) textures.
+    """
+
+    return any(
+        glGetStringi(GL_EXTENSIONS, i) == b"GL_EXT_texture_compression_s3tc"
+        for i in range(glGetIntegerv(GL_NUM_EXTENSIONS)))
+
+
+class TextureManager:
+    """
+        Shares one OpenGL texture between all the materials
+        using the same image file.
+
+        Images are decoded on a pool of worker threads (PIL releases
+        the GIL while decoding) and handed back to the GL thread, which
+        uploads them a few at a time in upload_pending. Until then,
+        textures hold a single white texel.
+
+        Images with an up to date .ktx next to them are uploaded
+        compressed, with their prebuilt mipmaps, when the driver
+        supports S3TC.
+    """
+    __slots__ = ("textures", "references", "sizes", "compression_supported",
+        "executor", "decoding", "pending")
+
+
+    def __init__(self):
+        """
+            Initialize an empty texture table.
+        """
+
+        self.textures: dict[str, int] = {}
+        self.references: dict[str, int] = {}
+        self.sizes: dict[str, int] = {}
+        self.compression_supported: bool | None = None
+        self.executor = ThreadPoolExecutor(
+            max_workers = os.cpu_count(), thread_name_prefix = "texture")
+        self.decoding: dict[tuple, Future] = {}
+        self.pending: list[tuple[str, Future, Callable]] = []
+
+    def acquire(self, filepath: str) -> int:
+        """
+            Returns the texture holding the given image, loading it
+            in the background on first use. Each call must be matched
+            by a release.
+
+            Parameters:
+
+                filepath: path to the image file.
+        """
+
+        key = os.path.normpath(filepath)
+        if key in self.textures:
+            self.references[key] += 1
+            return self.textures[key]
+
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_RGBA, 1, 1, 0,
+            GL_RGBA, GL_UNSIGNED_BYTE, np.full(4, 255, dtype = np.uint8))
+        print(filepath)
+
+        self.textures[key] = texture
+        self.references[key] = 1
+        self.sizes[key] = 4
+
+        def upload(pixels: np.ndarray) -> None:
+            # The last material may have been destroyed in the meantime
+            if self.textures.get(key) != texture:
+                return
+            image_height, image_width, _ = pixels.shape
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexImage2D(
+                GL_TEXTURE_2D, 0, GL_RGBA, image_width, image_height, 0,
+                GL_RGBA, GL_UNSIGNED_BYTE, np.ascontiguousarray(pixels))
+            glGenerateMipmap(GL_TEXTURE_2D)
+            # A full mip chain adds a third to the base level
+            self.sizes[key] = pixels.nbytes * 4 // 3
+
+        def upload_compressed(image: KtxImage) -> None:
+            if self.textures.get(key) != texture:
+                return
+            glBindTexture(GL_TEXTURE_2D, texture)
+            for level, data in enumerate(image.levels):
+                level_width, level_height = image.level_size(level)
+                glCompressedTexImage2D(
+                    GL_TEXTURE_2D, level, image.internal_format,
+                    level_width, level_height, 0, len(data), data)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(image.levels) - 1)
+            self.sizes[key] = image.nbytes()
+
+        if self.compression_supported is None:
+            self.compression_supported = supports_s3tc()
+            if not self.compression_supported:
+                print("S3TC texture compression unavailable, uploading uncompressed textures")
+
+        compressed_path = find_compressed(filepath)
+        if compressed_path is not None and self.compression_supported:
+            self.submit(filepath, ("ktx", compressed_path), upload_compressed,
+                read_ktx, compressed_path)
+        else:
+            self.request(filepath, upload)
+        return texture
+
+    def request(self, filepath: str, upload: Callable[[np.ndarray], None],
+        mode: str = "RGBA", flip: bool = True) -> None:
+        """
+            Decode an image in the background, then hand its pixels to
+            upload on the GL thread. Requests for the same image share
+            a single decoding job.
+
+            Parameters:
+
+                filepath: path to the image file.
+
+                upload: called with the decoded pixels.
+
+                mode, flip: see decode_image.
+        """
+
+        self.submit(filepath, (os.path.normpath(filepath), mode, flip), upload,
+            decode_image, filepath, mode, flip)
+
+    def submit(self, filepath: str, job: tuple, upload: Callable, load: Callable, *args) -> None:
+        """
+            Run load(*args) on a worker, unless the same job is already
+            in flight, and queue its result for upload.
+
+            Parameters:
+
+                filepath: the image being loaded, for error messages.
+
+                job: identifies the work done by load.
+
+                upload: called on the GL thread with the result of load.
+        """
+
+        future = self.decoding.get(job)
+        if future is None:
+            future = self.executor.submit(load, *args)
+            self.decoding[job] = future
+        self.pending.append((filepath, future, upload))
+
+    def upload_pending(self, budget: float) -> None:
+        """
+            Upload the images decoded so far, stopping once budget
+            seconds have been spent. Called once per frame.
+        """
+
+        start = time.perf_counter()
+        glActiveTexture(GL_TEXTURE0)
+        while self.pending and time.perf_counter() - start < budget:
+            ready = next(
+                (i for i, (_, future, _) in enumerate(self.pending) if future.done()),
+                None)
+            if ready is None:
+                break
+
+            filepath, future, upload = self.pending.pop(ready)
+            try:
+                upload(future.result())
+            except FileNotFoundError:
+                print(f"Error: Texture file '{filepath}' not found.")
+            except (OSError, ValueError) as error:
+                print(f"Error: could not load texture '{filepath}': {error}")
+
+        self.decoding = {
+            job: future for job, future in self.decoding.items()
+            if not future.done()}
+
+    def is_loading(self) -> bool:
+        """
+            Whether some images are still waiting to be uploaded.
+        """
+
+        return bool(self.pending)
+
+    def vram_usage(self) -> int:
+        """
+            Returns the bytes of video memory held by the textures,
+            mipmaps included.
+        """
+
+        return sum(self.sizes.values())
+
+    def release(self, filepath: str) -> None:
+        """
+            Drop a reference to a texture, freeing it once
+            no material uses it anymore.
+        """
+
+        key = os.path.normpath(filepath)
+        self.references[key] -= 1
+        if self.references[key] == 0:
+            glDeleteTextures(1, (self.textures.pop(key),))
+            del self.references[key]
+            del self.sizes[key]
+
+
+texture_manager = TextureManager()
+
+
+def load_layer(filepath: str, size: int) -> np.ndarray | None:
+    """
+        Decode an image and resize it to a square texture array layer.
+
+        Returns:
+
+            (size, size, 4) uint8 pixels, None if the file is missing
+            or cannot be decoded.
+    """
+
+    try:
+        pixels = decode_image(filepath)
+    except (OSError, ValueError):
+        return None
+
+    if pixels.shape[:2] == (size, size):
+        return pixels
+
+    img = Image.fromarray(np.ascontiguousarray(pixels), "RGBA")
+    return np.asarray(img.resize((size, size), Image.BILINEAR))
+
+
+def layer_size(filepath: str) -> int:
+    """
+        Returns the side of the texture array an image goes in: the
+        power of two closest to its largest side, within
+        TEXTURE_ARRAY_MIN_SIZE and TEXTURE_ARRAY_MAX_SIZE.
+    """
+
+    try:
+        with Image.open(filepath) as img:
+            side = max(img.size)
+    except OSError:
+        return TEXTURE_ARRAY_MIN_SIZE
+
+    size = 1 << round(np.log2(max(side, 1)))
+    return min(max(size, TEXTURE_ARRAY_MIN_SIZE), TEXTURE_ARRAY_MAX_SIZE)
+
+
+class TextureArrays:
+    """
+        Packs the textures of a model into one GL_TEXTURE_2D_ARRAY per
+        size bucket, so that a whole model draws with a few texture binds.
+
+        Layers are registered with add, then allocated by commit, which
+        has the images decoded, resized and uploaded in the background.
+    """
+    __slots__ = ("layers", "arrays", "depths", "remaining")
+
+
+    def __init__(self):
+        """
+            Initialize an empty set of texture arrays.
+        """
+
+        # size -> image paths, in layer order
+        self.layers: dict[int, list[str]] = {}
+        # size -> texture array
+        self.arrays: dict[int, int] = {}
+        # size -> layers allocated in the array
+        self.depths: dict[int, int] = {}
+        # size -> layers still to upload
+        self.remaining: dict[int, int] = {}
+
+    def add(self, filepath: str) -> tuple[int, int]:
+        """
+            Register an image, call commit to allocate its layer.
+
+            Returns:
+
+                The size bucket and layer of the image.
+        """
+
+        size = layer_size(filepath)
+        paths = self.layers.setdefault(size, [])
+        key = os.path.normpath(filepath)
+        for layer, path in enumerate(paths):
+            if os.path.normpath(path) == key:
+                return size, layer
+
+        paths.append(filepath)
+        return size, len(paths) - 1
+
+    def commit(self) -> None:
+        """
+            (Re)allocate the arrays which got new layers, and request
+            the upload of their images. The layers are white until then.
+        """
+
+        for size, paths in self.layers.items():
+            if self.depths.get(size) == len(paths):
+                continue
+            if size in self.arrays:
+                glDeleteTextures(1, (self.arrays[size],))
+
+            texture = glGenTextures(1)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            glTexImage3D(
+                GL_TEXTURE_2D_ARRAY, 0, GL_RGBA8, size, size, len(paths), 0,
+                GL_RGBA, GL_UNSIGNED_BYTE,
+                np.full((len(paths), size, size, 4), 255, dtype = np.uint8))
+            # Sample the base level only until the mipmaps are built
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, 0)
+
+            self.arrays[size] = texture
+            self.depths[size] = len(paths)
+            self.remaining[size] = len(paths)
+            for layer, path in enumerate(paths):
+                texture_manager.submit(
+                    path, ("layer", os.path.normpath(path), size),
+                    self._layer_uploader(size, texture, layer, path),
+                    load_layer, path, size)
+
+    def _layer_uploader(self, size: int, texture: int, layer: int, filepath: str) -> Callable:
+
+        def upload(pixels: np.ndarray | None) -> None:
+            # The array may have been reallocated in the meantime
+            if self.arrays.get(size) != texture:
+                return
+
+            glActiveTexture(GL_TEXTURE2)
+            glBindTexture(GL_TEXTURE_2D_ARRAY, texture)
+            if pixels is None:
+                print(f"Error: could not load texture '{filepath}'")
+            else:
+                glTexSubImage3D(
+                    GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, size, size, 1,
+                    GL_RGBA, GL_UNSIGNED_BYTE, np.ascontiguousarray(pixels))
+
+            # Build the mipmaps once, when every layer is in
+            self.remaining[size] -= 1
+            if self.remaining[size] == 0:
+                glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, 1000)
+                glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
+            glActiveTexture(GL_TEXTURE0)
+
+        return upload
+
+    def destroy(self) -> None:
+        """
+            Free the texture arrays.
+        """
+
+        for texture in self.arrays.values():
+            glDeleteTextures(1, (texture,))
+        self.arrays.clear()
+        self.depths.clear()
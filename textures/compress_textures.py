@@ -0,0 +1,97 @@
+"""
+    Compress the images of a directory to BC1 (opaque) or BC3 (with alpha)
+    KTX files, with their whole mip chain prebuilt. Each image gets a .ktx
+    next to it, which the game uploads instead of the image when the driver
+    supports S3TC. Reports the video memory used before and after.
+
+    Like webp_to_png_converter.py, any format Pillow reads is accepted,
+    .webp included.
+
+    Usage: python -m textures.compress_textures [directory ...] [--format auto|bc1|bc3] [--force]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from utils.ktx import KTX_FORMATS, compress_image, write_ktx
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tga")
+
+
+def compress_texture(input_path: str, output_path: str, format_name: str = "auto") -> tuple[int, int]:
+    """
+    Compress one image.
+
+    Returns:
+        The video memory used by the image with a full mip chain,
+        uncompressed RGBA and compressed, in bytes.
+    """
+
+    with Image.open(input_path) as img:
+        img = img.convert("RGBA").transpose(Image.FLIP_TOP_BOTTOM)
+        pixels = np.asarray(img, dtype=np.uint8)
+
+    if format_name == "auto":
+        format_name = "BC3" if (pixels[:, :, 3] < 255).any() else "BC1"
+
+    image = compress_image(pixels, KTX_FORMATS[format_name.upper()])
+    write_ktx(output_path, image)
+
+    # Every mip level has a quarter of the pixels of the previous one
+    uncompressed = pixels.nbytes * 4 // 3
+    print(f"{input_path:<40} {format_name.upper()}  {mib(uncompressed)} -> {mib(image.nbytes())}")
+    return uncompressed, image.nbytes()
+
+
+def mib(size: int) -> str:
+
+    return f"{size / 2**20:8.2f} MiB"
+
+
+def main() -> None:
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directories", nargs="*", default=["textures"],
+        help="directories holding the images (default: textures)")
+    parser.add_argument("--format", default="auto", choices=("auto", "bc1", "bc3"),
+        help="compressed format, auto picks BC3 for images with transparency")
+    parser.add_argument("--force", action="store_true",
+        help="recompress images whose .ktx is up to date")
+    args = parser.parse_args()
+
+    before = after = 0
+    for directory in args.directories:
+        if not os.path.isdir(directory):
+            print(f"Input directory '{directory}' does not exist.")
+            sys.exit(1)
+
+        for filename in sorted(os.listdir(directory)):
+            input_path = os.path.join(directory, filename)
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+
+            output_path = os.path.splitext(input_path)[0] + ".ktx"
+            if not args.force and os.path.exists(output_path) \
+                    and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                continue
+
+            try:
+                uncompressed, compressed = compress_texture(input_path, output_path, args.format)
+            except Exception as e:
+                print(f"Error compressing image '{input_path}': {e}")
+                continue
+            before += uncompressed
+            after += compressed
+
+    if before == 0:
+        print("All compressed textures are up to date.")
+        return
+    print(f"video memory: {mib(before)} -> {mib(after)} "
+          f"({100 * (1 - after / max(before, 1)):.1f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import struct
+import numpy as np
+
+############################## KTX textures ###################################
+
+# S3TC formats, from GL_EXT_texture_compression_s3tc
+GL_COMPRESSED_RGB_S3TC_DXT1_EXT = 0x83F0
+GL_COMPRESSED_RGBA_S3TC_DXT5_EXT = 0x83F3
+
+KTX_FORMATS = {
+    "BC1": GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+    "BC3": GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+}
+
+# Bytes per 4x4 block
+BLOCK_SIZES = {
+    GL_COMPRESSED_RGB_S3TC_DXT1_EXT: 8,
+    GL_COMPRESSED_RGBA_S3TC_DXT5_EXT: 16,
+}
+
+_GL_RGB = 0x1907
+_GL_RGBA = 0x1908
+
+_KTX_IDENTIFIER = b"\xabKTX 11\xbb\r\n\x1a\n"
+_KTX_ENDIANNESS = 0x04030201
+_KTX_HEADER = struct.Struct("<12s13I")
+
+# Blocks encoded at once, bounds the memory used on huge images
+_BLOCK_BATCH = 1 << 16
+
+
+class KtxImage:
+    """
+        A compressed texture with all of its mip levels.
+    """
+    __slots__ = ("internal_format", "width", "height", "levels")
+
+
+    def __init__(self, internal_format: int, width: int, height: int, levels: list[bytes]):
+        """
+            Parameters:
+
+                internal_format: one of the GL_COMPRESSED_* formats.
+
+                width, height: size of the base level, in pixels.
+
+                levels: compressed data of each mip level, base level first.
+        """
+
+        self.internal_format = internal_format
+        self.width = width
+        self.height = height
+        self.levels = levels
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        """
+            Returns the width and height of a mip level.
+        """
+
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+    def nbytes(self) -> int:
+
+        return sum(len(level) for level in self.levels)
+
+
+def read_ktx(path: str) -> KtxImage:
+    """
+    Read a KTX 1.1 file holding a 2D compressed texture.
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    (identifier, endianness, gl_type, _, _, internal_format, _,
+     width, height, depth, array_elements, faces, level_count,
+     key_value_bytes) = _KTX_HEADER.unpack_from(data)
+
+    if identifier != _KTX_IDENTIFIER or endianness != _KTX_ENDIANNESS:
+        raise ValueError(f"{path} is not a little endian KTX 1.1 file")
+    if gl_type != 0 or internal_format not in BLOCK_SIZES:
+        raise ValueError(f"{path} does not hold a supported compressed format")
+    if depth != 0 or array_elements != 0 or faces != 1:
+        raise ValueError(f"{path} is not a 2D texture")
+
+    offset = _KTX_HEADER.size + key_value_bytes
+    levels = []
+    for _ in range(max(1, level_count)):
+        (size,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        levels.append(data[offset:offset + size])
+        offset += (size + 3) & ~3
+
+    return KtxImage(internal_format, width, height, levels)
+
+
+def write_ktx(path: str, image: KtxImage) -> None:
+    """
+    Write a compressed texture as a KTX 1.1 file.
+    """
+
+    base_format = _GL_RGB if image.internal_format == GL_COMPRESSED_RGB_S3TC_DXT1_EXT else _GL_RGBA
+
+    with open(path, "wb") as f:
+        f.write(_KTX_HEADER.pack(
+            _KTX_IDENTIFIER, _KTX_ENDIANNESS, 0, 1, 0,
+            image.internal_format, base_format,
+            image.width, image.height, 0, 0, 1, len(image.levels), 0))
+        for level in image.levels:
+            f.write(struct.pack("<I", len(level)))
+            f.write(level)
+            f.write(b"\0" * (-len(level) % 4))
+
+
+def compress_image(pixels: np.ndarray, internal_format: int) -> KtxImage:
+    """
+    Compress an image and its full mip chain.
+
+    Parameters:
+        pixels: (height, width, 4) uint8 RGBA pixels, rows in the order
+            they should be uploaded in.
+        internal_format: GL_COMPRESSED_RGB_S3TC_DXT1_EXT (BC1) or
+            GL_COMPRESSED_RGBA_S3TC_DXT5_EXT (BC3).
+    """
+
+    height, width, _ = pixels.shape
+    levels = []
+    level = pixels
+    while True:
+        levels.append(_compress_level(level, internal_format))
+        if level.shape[0] == 1 and level.shape[1] == 1:
+            break
+        level = _downsample(level)
+
+    return KtxImage(internal_format, width, height, levels)
+
+
+def _downsample(pixels: np.ndarray) -> np.ndarray:
+    """
+    Returns the next mip level, averaging 2x2 pixels (or 2x1 once
+    a side is down to a single pixel).
+    """
+
+    height, width, _ = pixels.shape
+    new_height, new_width = max(1, height // 2), max(1, width // 2)
+    step_y, step_x = (2 if height > 1 else 1), (2 if width > 1 else 1)
+
+    cropped = pixels[:new_height * step_y, :new_width * step_x].astype(np.uint32)
+    total = cropped.reshape(new_height, step_y, new_width, step_x, -1).sum(axis=(1, 3))
+    count = step_y * step_x
+    return ((total + count // 2) // count).astype(np.uint8)
+
+
+def _compress_level(pixels: np.ndarray, internal_format: int) -> bytes:
+    """
+    Compress one mip level into 4x4 blocks, in row-major block order.
+    Partial blocks on the edges are padded by repeating the last pixels.
+    """
+
+    height, width, _ = pixels.shape
+    blocks_y, blocks_x = (height + 3) // 4, (width + 3) // 4
+    padded = np.pad(
+        pixels, ((0, blocks_y * 4 - height), (0, blocks_x * 4 - width), (0, 0)),
+        mode="edge")
+
+    # (block, texel, channel), texels in row-major order within a block
+    blocks = padded.reshape(blocks_y, 4, blocks_x, 4, 4).swapaxes(1, 2).reshape(-1, 16, 4)
+
+    encoded = []
+    for start in range(0, len(blocks), _BLOCK_BATCH):
+        batch = blocks[start:start + _BLOCK_BATCH]
+        color = _encode_color_blocks(batch[:, :, :3])
+        if internal_format == GL_COMPRESSED_RGBA_S3TC_DXT5_EXT:
+            encoded.append(np.concatenate((_encode_alpha_blocks(batch[:, :, 3]), color), axis=1))
+        else:
+            encoded.append(color)
+
+    return np.concatenate(encoded).tobytes()
+
+
+def _encode_color_blocks(colors: np.ndarray) -> np.ndarray:
+    """
+    Encode (n, 16, 3) uint8 colors as n BC1 color blocks. The endpoints
+    start at the extremes of each block along its principal axis, and
+    are then refitted to the texels.
+
+    Returns:
+        (n, 8) uint8
+    """
+
+    colors = colors.astype(np.float32)
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = np.einsum("nti,ntj->nij", centered, centered)
+    axis = np.linalg.eigh(covariance)[1][:, :, -1]
+
+    projection = np.einsum("nti,ni->nt", centered, axis)
+    low = mean[:, 0] + projection.min(axis=1)[:, None] * axis
+    high = mean[:, 0] + projection.max(axis=1)[:, None] * axis
+
+    color0, color1, indices = _fit_indices(colors, _to_rgb565(high), _to_rgb565(low))
+
+    # Refine the endpoints with a least squares fit to the chosen indices
+    weights = np.array([1, 0, 2 / 3, 1 / 3], dtype=np.float32)[indices]
+    aa = (weights * weights).sum(axis=1)
+    ab = (weights * (1 - weights)).sum(axis=1)
+    bb = ((1 - weights) ** 2).sum(axis=1)
+    ac = np.einsum("nt,nti->ni", weights, colors)
+    bc = np.einsum("nt,nti->ni", 1 - weights, colors)
+    determinant = aa * bb - ab * ab
+    solvable = np.abs(determinant) > 1e-6
+    safe = np.where(solvable, determinant, 1)[:, None]
+    end0 = np.where(solvable[:, None], (bb[:, None] * ac - ab[:, None] * bc) / safe, 0)
+    end1 = np.where(solvable[:, None], (aa[:, None] * bc - ab[:, None] * ac) / safe, 0)
+
+    color0, color1, indices = _fit_indices(
+        colors, np.where(solvable, _to_rgb565(end0), color0),
+        np.where(solvable, _to_rgb565(end1), color1))
+
+    bits = (indices.astype(np.uint32) << (2 * np.arange(16, dtype=np.uint32))).sum(
+        axis=1, dtype=np.uint32)
+
+    encoded = np.empty((len(colors), 8), dtype=np.uint8)
+    encoded[:, 0:2] = color0.astype("<u2").view(np.uint8).reshape(-1, 2)
+    encoded[:, 2:4] = color1.astype("<u2").view(np.uint8).reshape(-1, 2)
+    encoded[:, 4:8] = bits.astype("<u4").view(np.uint8).reshape(-1, 4)
+    return encoded
+
+
+def _fit_indices(colors: np.ndarray, color0: np.ndarray,
+    color1: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Order two rgb565 endpoints for the four color mode and pick the
+    closest palette entry for every texel.
+    """
+
+    # color0 > color1 selects the four color mode
+    swap = color0 < color1
+    color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+
+    end0, end1 = _from_rgb565(color0), _from_rgb565(color1)
+    palette = np.stack((
+        end0, end1, (2 * end0 + end1) / 3, (end0 + 2 * end1) / 3), axis=1)
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+    indices = distances.argmin(axis=2)
+    indices[color0 == color1] = 0
+
+    return color0, color1, indices
+
+
+def _encode_alpha_blocks(alphas: np.ndarray) -> np.ndarray:
+    """
+    Encode (n, 16) uint8 alphas as n BC3 alpha blocks, using the
+    eight value mode between the block's extremes.
+
+    Returns:
+        (n, 8) uint8
+    """
+
+    alpha0 = alphas.max(axis=1).astype(np.int32)
+    alpha1 = alphas.min(axis=1).astype(np.int32)
+
+    # Palette order: alpha0, alpha1, then six interpolated values
+    weights = np.array([7, 0, 6, 5, 4, 3, 2, 1], dtype=np.float32) / 7
+    palette = alpha0[:, None] * weights + alpha1[:, None] * (1 - weights)
+    palette = np.floor(palette)
+    palette[:, 0], palette[:, 1] = alpha0, alpha1
+
+    distances = np.abs(alphas[:, :, None].astype(np.float32) - palette[:, None, :])
+    indices = distances.argmin(axis=2).astype(np.uint64)
+    indices[alpha0 == alpha1] = 0
+
+    bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+
+    encoded = np.empty((len(alphas), 8), dtype=np.uint8)
+    encoded[:, 0] = alpha0
+    encoded[:, 1] = alpha1
+    encoded[:, 2:8] = bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return encoded
+
+
+def _to_rgb565(colors: np.ndarray) -> np.ndarray:
+
+    colors = np.clip(np.rint(colors), 0, 255)
+    r = np.rint(colors[:, 0] * 31 / 255).astype(np.uint32)
+    g = np.rint(colors[:, 1] * 63 / 255).astype(np.uint32)
+    b = np.rint(colors[:, 2] * 31 / 255).astype(np.uint32)
+    return (r << 11) | (g << 5) | b
+
+
+def _from_rgb565(colors: np.ndarray) -> np.ndarray:
+
+    r = (colors >> 11) & 31
+    g = (colors >> 5) & 63
+    b = colors & 31
+    return np.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)),
+                    axis=1).astype(np.float32)
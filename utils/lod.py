@@ -0,0 +1,91 @@
+import numpy as np
+from utils.spatial import SpatialTree
+
+############################## levels of detail ###############################
+
+# Cells along the longest side of a leaf for each simplified level,
+# level 0 being the full model
+LOD_GRID_RESOLUTIONS = (48, 16, 6)
+
+
+def build_lods(groups: dict[str, dict], tree: SpatialTree,
+    resolutions: tuple[int, ...] = LOD_GRID_RESOLUTIONS) -> None:
+    """
+    Simplify every octree leaf of indexed material groups by vertex
+    clustering, once per resolution, in place.
+
+    The simplified triangles reuse the vertices of the group, their
+    indices are appended to the group's "indices" one level after the
+    other. Each group gains "lod_ranges", a (levels, leaves, 2) uint32
+    array of the first index and index count of each leaf at each level,
+    level 0 being its "leaf_ranges".
+    """
+
+    leaf_low = tree.leaf_bounds[:, 0]
+    leaf_size = (tree.leaf_bounds[:, 1] - leaf_low).max(axis=1)
+
+    for data in groups.values():
+        leaf_ranges = data["leaf_ranges"]
+        counts = leaf_ranges[:, 1].astype(np.int64) // 3
+        triangles = data["indices"].reshape(-1, 3)
+        leaves = np.repeat(np.arange(len(counts)), counts)
+        positions = data["vertices"].reshape(-1, 8)[:, :3]
+
+        levels = [triangles.ravel()]
+        ranges = [leaf_ranges]
+        offset = len(triangles) * 3
+        for resolution in resolutions:
+            cell = np.maximum(leaf_size / resolution, 1e-6)
+            simplified, simplified_leaves = _cluster(
+                triangles, leaves, positions, leaf_low, cell, resolution)
+
+            level_counts = np.bincount(simplified_leaves, minlength=len(counts)) * 3
+            ranges.append(np.stack(
+                (offset + np.cumsum(level_counts) - level_counts, level_counts), axis=1))
+            levels.append(simplified.ravel())
+            offset += len(simplified) * 3
+
+        data["indices"] = np.concatenate(levels).astype(np.uint32)
+        data["lod_ranges"] = np.stack(ranges).astype(np.uint32)
+
+
+def _cluster(triangles: np.ndarray, leaves: np.ndarray, positions: np.ndarray,
+    leaf_low: np.ndarray, cell: np.ndarray,
+    resolution: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge the corners falling in the same grid cell of their leaf into
+    one of their vertices, then drop the triangles which collapsed or
+    became duplicates.
+
+    Returns:
+        The (triangles, 3) simplified triangles, still sorted by leaf,
+        and the leaf of each.
+    """
+
+    if len(triangles) == 0:
+        return triangles, leaves
+
+    corner_leaves = np.repeat(leaves, 3)
+    corners = triangles.ravel()
+    cells = np.floor(
+        (positions[corners] - leaf_low[corner_leaves]) / cell[corner_leaves, None])
+    cells = np.clip(cells, 0, resolution).astype(np.int64)
+    keys = (((corner_leaves * (resolution + 1) + cells[:, 0]) * (resolution + 1)
+        + cells[:, 1]) * (resolution + 1) + cells[:, 2])
+
+    # Each cluster is represented by the lowest vertex index it holds
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    representative = np.full(inverse.max() + 1, np.iinfo(np.int64).max)
+    np.minimum.at(representative, inverse, corners.astype(np.int64))
+    simplified = representative[inverse].reshape(-1, 3)
+
+    kept = (simplified[:, 0] != simplified[:, 1]) \
+        & (simplified[:, 1] != simplified[:, 2]) \
+        & (simplified[:, 0] != simplified[:, 2])
+    simplified, leaves = simplified[kept], leaves[kept]
+
+    # Keep the first of the triangles joining the same three vertices
+    _, first = np.unique(np.sort(simplified, axis=1), axis=0, return_index=True)
+    first.sort()
+    return simplified[first].astype(np.uint32), leaves[first]
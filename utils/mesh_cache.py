@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import re
+from typing import Generator
+import numpy as np
+from utils.obj_loader import load_multi_material_mesh
+from utils.spatial import SpatialTree, build_spatial_tree
+from utils.lod import build_lods
+
+############################## compiled mesh cache ############################
+
+# Compiled meshes are stored here, relative to the working directory
+MESH_CACHE_DIR = os.path.join("cache", "meshes")
+
+# Bump whenever the layout of the cached groups changes
+MESH_CACHE_VERSION = 5
+
+_HASH_BLOCK_SIZE = 1 << 23
+
+# An mtllib statement, wherever it is in the file
+_MTLLIB_PATTERN = re.compile(rb"^[ \t]*mtllib[ \t]+([^\s#]+)", re.MULTILINE)
+
+
+def load_cached_multi_material_mesh(obj_file_path: str,
+    cache_dir: str = MESH_CACHE_DIR) -> tuple[dict[str, dict], SpatialTree]:
+    """
+    Load a multi material mesh from its compiled binary form, compiling
+    it first if the obj or mtl file changed since the last run.
+
+    Parameters:
+        obj_file_path: path to the .obj file
+        cache_dir: directory holding the compiled meshes
+
+    Returns:
+        The same groups as load_multi_material_mesh(indexed=True), with
+        the vertex and index arrays memory-mapped from the cache. The
+        triangles of each group are sorted by spatial tree leaf, see
+        build_spatial_tree, and followed by their simplified levels of
+        detail, see build_lods. Then the spatial tree, read from the
+        same manifest, or the one just built if the cache could not
+        be written.
+    """
+
+    entry_dir = _entry_dir(obj_file_path, cache_dir)
+
+    manifest = read_manifest(entry_dir)
+    if manifest is None:
+        groups, tree, manifest = _compile(obj_file_path, entry_dir)
+        if manifest is None:
+            return groups, tree
+
+    groups = {
+        group["name"]: _read_group(entry_dir, group)
+        for group in manifest["groups"]
+    }
+    return groups, _read_tree(entry_dir, manifest)
+
+
+def stream_cached_multi_material_mesh(obj_file_path: str,
+    cache_dir: str = MESH_CACHE_DIR) -> Generator[tuple[str, dict], None, SpatialTree | None]:
+    """
+    Yield the material groups of a mesh one at a time, as
+    (material name, group) pairs, then return its spatial tree.
+
+    The manifest is read and checked once, then each group is
+    memory-mapped from the cache just before it is yielded, so the first
+    one is available before the rest of the model is read. A model which
+    has to be compiled is parsed in full before the first yield.
+    """
+
+    entry_dir = _entry_dir(obj_file_path, cache_dir)
+
+    manifest = read_manifest(entry_dir)
+    if manifest is None:
+        groups, tree, manifest = _compile(obj_file_path, entry_dir)
+        if manifest is None:
+            yield from groups.items()
+            return tree
+
+    tree = _read_tree(entry_dir, manifest)
+    for group in manifest["groups"]:
+        yield group["name"], _read_group(entry_dir, group)
+    return tree
+
+
+def _compile(obj_file_path: str,
+    entry_dir: str) -> tuple[dict[str, dict], SpatialTree, dict | None]:
+    """
+    Parse a mesh, build its spatial tree and levels of detail, and
+    write them to the cache.
+
+    Returns:
+        The groups and the tree as built, then the manifest of the
+        written cache, None if it could not be written.
+    """
+
+    print(f"Compiling {obj_file_path}...")
+    groups = load_multi_material_mesh(obj_file_path, indexed=True)
+    tree = build_spatial_tree(groups)
+    build_lods(groups, tree)
+
+    try:
+        write_mesh_cache(obj_file_path, groups, entry_dir, tree)
+    except OSError as error:
+        print(f"Warning: could not write mesh cache for {obj_file_path}: {error}")
+
+    return groups, tree, read_manifest(entry_dir)
+
+
+def read_manifest(entry_dir: str) -> dict | None:
+    """
+    Read the manifest of a compiled mesh, if the mesh is still valid.
+
+    Returns:
+        The manifest, or None if the cache is missing or stale.
+    """
+
+    manifest_path = os.path.join(entry_dir, "manifest.json")
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if manifest.get("version") != MESH_CACHE_VERSION:
+        return None
+
+    rehashed = False
+    for source in manifest["sources"]:
+        match _check_source(source):
+            case None:
+                return None
+            case True:
+                rehashed = True
+
+    # The sources were touched but not modified, remember the new mtimes
+    # so that the next launch can skip hashing.
+    if rehashed:
+        _write_manifest(manifest_path, manifest)
+
+    return manifest
+
+
+def _read_group(entry_dir: str, group: dict) -> dict:
+    """
+    Returns a material group described by a manifest, its arrays
+    memory-mapped.
+    """
+
+    data = dict(group["attributes"])
+    for key, (filename, shape) in group["arrays"].items():
+        path = os.path.join(entry_dir, filename)
+        if 0 in shape:
+            data[key] = np.load(path)
+        else:
+            data[key] = np.load(path, mmap_mode="r")
+    return data
+
+
+def _read_tree(entry_dir: str, manifest: dict) -> SpatialTree:
+    """
+    Returns the spatial tree described by a manifest.
+    """
+
+    return SpatialTree.from_arrays({
+        key: np.load(os.path.join(entry_dir, filename))
+        for key, (filename, shape) in manifest["tree"].items()
+    })
+
+
+def write_mesh_cache(obj_file_path: str, groups: dict[str, dict], entry_dir: str,
+    tree: SpatialTree) -> None:
+    """
+    Store the material groups of a mesh and its spatial tree in compiled form.
+
+    Every array of a group is written as its own .npy file, the other
+    values (texture, color) go in the manifest.
+    """
+
+    os.makedirs(entry_dir, exist_ok=True)
+
+    manifest_path = os.path.join(entry_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    sources = [obj_file_path]
+    mtl_file = _find_mtllib(obj_file_path)
+    if mtl_file:
+        sources.append(os.path.join(os.path.dirname(obj_file_path), mtl_file))
+
+    manifest = {
+        "version": MESH_CACHE_VERSION,
+        "sources": [_describe_source(path) for path in sources],
+        "groups": [],
+        "tree": {},
+    }
+
+    for key, value in tree.arrays().items():
+        filename = f"tree.{key}.npy"
+        np.save(os.path.join(entry_dir, filename), value)
+        manifest["tree"][key] = (filename, list(value.shape))
+
+    for i, (name, data) in enumerate(groups.items()):
+        arrays = {}
+        attributes = {}
+        for key, value in data.items():
+            if isinstance(value, np.ndarray):
+                filename = f"{i}.{key}.npy"
+                np.save(os.path.join(entry_dir, filename), value)
+                arrays[key] = (filename, list(value.shape))
+            else:
+                attributes[key] = value
+        manifest["groups"].append(
+            {"name": name, "attributes": attributes, "arrays": arrays})
+
+    _write_manifest(manifest_path, manifest)
+
+
+def _entry_dir(obj_file_path: str, cache_dir: str) -> str:
+    """
+    Returns the directory holding the compiled form of a model,
+    named after the model and its location.
+    """
+
+    stem = os.path.splitext(os.path.basename(obj_file_path))[0]
+    location = hashlib.sha1(
+        os.path.abspath(obj_file_path).encode()).hexdigest()[:8]
+
+    return os.path.join(cache_dir, f"{stem}-{location}")
+
+
+def _describe_source(path: str) -> dict:
+    """
+    Returns the size, mtime and content hash of a source file.
+    """
+
+    if not os.path.exists(path):
+        return {"path": path, "size": None, "mtime_ns": None, "sha256": None}
+
+    stat = os.stat(path)
+    return {
+        "path": path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": _hash_file(path),
+    }
+
+
+def _check_source(source: dict) -> bool | None:
+    """
+    Compare a source file against its description in the manifest.
+
+    Returns:
+        False if it is unchanged, True if only its mtime changed (the
+        description is updated), None if its contents changed.
+    """
+
+    path = source["path"]
+    if not os.path.exists(path):
+        return False if source["size"] is None else None
+    if source["size"] is None:
+        return None
+
+    stat = os.stat(path)
+    if stat.st_size != source["size"]:
+        return None
+    if stat.st_mtime_ns == source["mtime_ns"]:
+        return False
+    if _hash_file(path) != source["sha256"]:
+        return None
+
+    source["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def _hash_file(path: str) -> str:
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _find_mtllib(obj_file_path: str) -> str | None:
+    """
+    Returns the material library named in an obj file, the last one
+    when there are several, as the parser does.
+    """
+
+    mtl_file = None
+    with open(obj_file_path, "rb") as f:
+        tail = b""
+        while block := f.read(_HASH_BLOCK_SIZE):
+            block = tail + block
+            cut = block.rfind(b"\n") + 1
+            tail = block[cut:]
+            for match in _MTLLIB_PATTERN.finditer(block, 0, cut):
+                mtl_file = match.group(1).decode()
+        for match in _MTLLIB_PATTERN.finditer(tail + b"\n"):
+            mtl_file = match.group(1).decode()
+    return mtl_file
+
+
+def _write_manifest(manifest_path: str, manifest: dict) -> None:
+    """
+    Write the manifest last and atomically, so that an interrupted
+    compilation never leaves a valid looking cache behind.
+    """
+
+    temporary_path = manifest_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary_path, manifest_path)
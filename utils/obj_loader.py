@@ -1,4 +1,7 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
 from OpenGL.GL import *
 from OpenGL.GL.shaders import compileProgram, compileShader
 
@@ -33,49 +36,47 @@ def create_shader(vertex_filepath: str, fragment_filepath: str) -> int:
     return shader
 
 
-def load_mesh(filename: str) -> tuple[list[float], str | None]:
+def load_mesh(filename: str) -> tuple[np.ndarray, str | None]:
     """
     Load a mesh from an obj file and try to read the texture path from its .mtl file.
 
     Returns:
-        vertices: list of vertex data
+        vertices: flattened vertex data (x, y, z, s, t, nx, ny, nz)
         texture_path: path to texture image (or None if not found)
     """
-    v = []
-    vt = []
-    vn = []
-    vertices = []
 
-    mtl_file = None
-    material_name = None
+    obj = parse_obj(filename)
 
-    with open(filename, "r") as file:
-        for line in file:
-            words = line.strip().split()
-            if not words:
-                continue
-            match words[0]:
-                case "mtllib":
-                    mtl_file = words[1]
-                case "usemtl":
-                    material_name = words[1]
-                case "v":
-                    v.append(read_vertex_data(words))
-                case "vt":
-                    vt.append(read_texcoord_data(words))
-                case "vn":
-                    vn.append(read_normal_data(words))
-                case "f":
-                    read_face_data(words, v, vt, vn, vertices)
+    return build_vertex_stream(obj, obj.triangles), _find_texture(filename, obj)
+
+def load_indexed_mesh(filename: str) -> tuple[np.ndarray, np.ndarray, str | None]:
+    """
+    Load a mesh from an obj file, with each distinct corner stored once.
+
+    Returns:
+        vertices: flattened vertex data (x, y, z, s, t, nx, ny, nz)
+        indices: uint32 vertex indices, three per triangle
+        texture_path: path to texture image (or None if not found)
+    """
+
+    obj = parse_obj(filename)
+    vertices, indices = build_indexed_vertex_stream(obj, obj.triangles)
+
+    return vertices, indices, _find_texture(filename, obj)
+
+def _find_texture(filename: str, obj: "ObjData") -> str | None:
+    """
+    Returns the texture of the last material used by the obj file.
+    """
 
     texture_path = None
-    if mtl_file and material_name:
-        texture_path = parse_mtl_for_texture(filename, mtl_file, material_name)
+    if obj.mtl_file and obj.final_material:
+        texture_path = parse_mtl_for_texture(filename, obj.mtl_file, obj.final_material)
 
-    print("MTL file:", mtl_file)
-    print("Material used:", material_name)
+    print("MTL file:", obj.mtl_file)
+    print("Material used:", obj.final_material)
 
-    return vertices, texture_path
+    return texture_path
 
 def read_vertex_data(words: list[str]) -> list[float]:
     """
@@ -109,39 +110,6 @@ def read_normal_data(words: list[str]) -> list[float]:
         float(words[3])
     ]
 
-def read_face_data(
-    words: list[str], 
-    v: list[list[float]], vt: list[list[float]], 
-    vn: list[list[float]], vertices: list[float]) -> None:
-    """
-        Reads an edgetable and makes a face from it.
-    """
-
-    triangleCount = len(words) - 3
-
-    for i in range(triangleCount):
-
-        make_corner(words[1], v, vt, vn, vertices)
-        make_corner(words[2 + i], v, vt, vn, vertices)
-        make_corner(words[3 + i], v, vt, vn, vertices)
-
-def make_corner(corner_description: str, 
-    v: list[list[float]], vt: list[list[float]], 
-    vn: list[list[float]], vertices: list[float]) -> None:
-    """
-        Composes a flattened description of a vertex.
-    """
-
-    v_vt_vn = corner_description.split("/")
-    
-    for element in v[int(v_vt_vn[0]) - 1]:
-        vertices.append(element)
-    for element in vt[int(v_vt_vn[1]) - 1]:
-        vertices.append(element)
-    for element in vn[int(v_vt_vn[2]) - 1]:
-        vertices.append(element)
-
-
 def parse_mtl_for_texture(obj_file_path: str, mtl_file_name: str, target_material: str) -> str | None:
     """
     Try to parse the .mtl file to find the texture file used by a material.
@@ -175,53 +143,43 @@ def parse_mtl_for_texture(obj_file_path: str, mtl_file_name: str, target_materia
     return None
 
 
-def load_multi_material_mesh(obj_file_path: str) -> dict[str, dict]:
-    v, vt, vn = [], [], []
-    material_groups = {}
-    current_material = None
-    mtl_file = None
+def load_multi_material_mesh(obj_file_path: str, indexed: bool = False, 
+    workers: int | None = None) -> dict[str, dict]:
+    """
+    Load an obj file, splitting its faces into one vertex stream per material.
 
-    count = 0
+    Parameters:
+        obj_file_path: path to the .obj file
+        indexed: whether to deduplicate the corners of each material
+        workers: number of processes building the material groups,
+            read from the OBJ_LOADER_WORKERS environment variable
+            when not given. 1 builds them in this process.
 
-    with open(obj_file_path, "r") as file:
-        for line in file:
-            words = line.strip().split()
-            if not words:
-                continue
+    Returns:
+        A dictionary mapping each material name (in order of first use)
+        to its group: {"vertices": float32 array of (x, y, z, s, t, nx, ny, nz)}
+        plus the "texture" and/or "color" read from the .mtl file.
+        Indexed groups also hold "indices", a uint32 array of three
+        vertices per triangle. Every group has its "aabb" and "sphere",
+        see bounding_volumes.
+    """
 
-            match words[0]:
-                case "mtllib":
-                    mtl_file = words[1]
-                case "usemtl":
-                    try:
-                        current_material = words[1]
-                    except IndexError:
-                        current_material = "Material.002"
-                    if current_material not in material_groups:
-                        material_groups[current_material] = {"vertices": []}
-                case "v":
-                    v.append(read_vertex_data(words))
-                case "vt":
-                    vt.append(read_texcoord_data(words))
-                case "vn":
-                    vn.append(read_normal_data(words))
-                case "f":
-                    if current_material is None:
-                        continue
-                    face_vertices = []
-                    triangleCount = len(words) - 3
-                    for i in range(triangleCount):
-                        face_vertices += get_corner(words[1], v, vt, vn)
-                        face_vertices += get_corner(words[2 + i], v, vt, vn)
-                        face_vertices += get_corner(words[3 + i], v, vt, vn)
-                    material_groups[current_material]["vertices"].extend(face_vertices)
-            count += 1
-            if count % 1000 == 0:
-                print(f"Processed {count} lines...")
+    if workers is None:
+        workers = _workers_from_environment()
+
+    obj = parse_obj(obj_file_path)
+    groups = group_triangles(obj)
+
+    if workers > 1 and len(groups) > 1:
+        streams = _build_groups_in_parallel(obj, groups, indexed, workers)
+    else:
+        streams = [_build_group(obj, triangles, indexed) for triangles in groups]
+
+    material_groups = dict(zip(obj.material_names, streams))
 
     # Attach texture paths
-    if mtl_file:
-        mtl_path = os.path.join(os.path.dirname(obj_file_path), mtl_file)
+    if obj.mtl_file:
+        mtl_path = os.path.join(os.path.dirname(obj_file_path), obj.mtl_file)
         parse_mtl_for_material_textures(mtl_path, material_groups)
 
     return material_groups
@@ -265,3 +223,710 @@ def parse_mtl_for_material_textures(mtl_path: str, material_groups: dict):
         elif words[0] == "Kd" and current_material in material_groups:
             rgb = list(map(float, words[1:4]))
             material_groups[current_material]["color"] = rgb
+
+
+############################## bulk obj parsing ###############################
+
+# Number of bytes handed to the parser at once. A partial line at the end of
+# a chunk is carried over to the next one.
+OBJ_CHUNK_SIZE = 1 << 23
+
+_NEWLINE = ord("\n")
+
+
+class ObjData:
+    """
+        The raw contents of an obj file, held as numpy arrays.
+    """
+    __slots__ = (
+        "positions", "texcoords", "normals", "corners", "triangles",
+        "triangle_materials", "material_names", "final_material", "mtl_file")
+
+
+    def __init__(self):
+        """
+            Initialize an empty obj description.
+
+            positions, texcoords, normals: float32 attribute pools.
+
+            corners: (n, 3) one-based v/vt/vn indices of every face corner,
+                    0 where the face omits the texcoord or normal.
+
+            triangles: (t, 3) indices into corners, faces are fanned
+                    around their first corner.
+
+            triangle_materials: (t,) index into material_names for each
+                    triangle, -1 before the first usemtl.
+        """
+
+        self.positions = np.empty((0, 3), dtype=np.float32)
+        self.texcoords = np.empty((0, 2), dtype=np.float32)
+        self.normals = np.empty((0, 3), dtype=np.float32)
+        self.corners = np.empty((0, 3), dtype=np.int64)
+        self.triangles = np.empty((0, 3), dtype=np.int64)
+        self.triangle_materials = np.empty(0, dtype=np.int64)
+        self.material_names: list[str] = []
+        self.final_material: str | None = None
+        self.mtl_file: str | None = None
+
+
+def parse_obj(filename: str, chunk_size: int = OBJ_CHUNK_SIZE) -> ObjData:
+    """
+        Parse an obj file in large chunks, turning its v/vt/vn/f records
+        into numpy arrays without a python loop over lines.
+
+        Parameters:
+
+            filename: path to the .obj file
+
+            chunk_size: number of bytes parsed per step
+        
+        Returns:
+
+            The parsed file
+    """
+
+    parser = _ObjParser()
+
+    with open(filename, "rb") as file:
+        tail = b""
+        while block := file.read(chunk_size):
+            block = tail + block
+            cut = block.rfind(b"\n") + 1
+            tail = block[cut:]
+            if cut:
+                parser.feed(block[:cut])
+        if tail:
+            parser.feed(tail + b"\n")
+
+    return parser.finish()
+
+
+def group_triangles(obj: ObjData) -> list[np.ndarray]:
+    """
+        Split the triangles by material, keeping their order in the file.
+        Faces declared before the first usemtl have no material and are dropped.
+
+        Returns:
+
+            The rows of obj.triangles using each of obj.material_names
+    """
+
+    order = np.argsort(obj.triangle_materials, kind="stable")
+    counts = np.bincount(
+        obj.triangle_materials + 1, minlength=len(obj.material_names) + 1)
+    bounds = np.cumsum(counts)
+
+    return [
+        obj.triangles[order[bounds[i]:bounds[i + 1]]]
+        for i in range(len(obj.material_names))
+    ]
+
+
+def build_vertex_stream(obj: ObjData, triangles: np.ndarray) -> np.ndarray:
+    """
+        Gather the flattened (x, y, z, s, t, nx, ny, nz) vertices
+        of the given triangles.
+
+        Parameters:
+
+            obj: the parsed obj file
+
+            triangles: (t, 3) rows of obj.triangles
+        
+        Returns:
+
+            float32 array of t * 3 * 8 values
+    """
+
+    return _gather_vertices(obj, obj.corners[triangles.ravel()])
+
+
+def build_indexed_vertex_stream(
+    obj: ObjData, triangles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Gather the vertices of the given triangles, storing each distinct
+        (v, vt, vn) triplet once, in order of first use.
+
+        Parameters:
+
+            obj: the parsed obj file
+
+            triangles: (t, 3) rows of obj.triangles
+        
+        Returns:
+
+            float32 array of 8 values per unique vertex, 
+            and uint32 array of t * 3 vertex indices
+    """
+
+    corners = obj.corners[triangles.ravel()]
+    if not len(corners):
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.uint32)
+
+    # Pack each triplet in a single integer when the pools are small enough
+    texcoords, normals = len(obj.texcoords) + 1, len(obj.normals) + 1
+    if (len(obj.positions) + 1) * texcoords * normals < 2 ** 63:
+        keys = (corners[:, 0] * texcoords + corners[:, 1]) * normals + corners[:, 2]
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(
+            corners, axis=0, return_index=True, return_inverse=True)
+
+    # np.unique sorts the triplets, renumber them by first appearance
+    # so that neighbouring triangles keep neighbouring vertices.
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    vertices = _gather_vertices(obj, corners[first[order]])
+    indices = rank[inverse.ravel()].astype(np.uint32)
+
+    return vertices, indices
+
+
+def _gather_vertices(obj: ObjData, corners: np.ndarray) -> np.ndarray:
+    """
+        Returns the flattened vertices described by (v, vt, vn) index triplets.
+    """
+
+    vertices = np.zeros((len(corners), 8), dtype=np.float32)
+
+    vertices[:, 0:3] = obj.positions[corners[:, 0] - 1]
+
+    # Missing texcoords and normals are left at zero
+    attributes = ((1, obj.texcoords, slice(3, 5)), (2, obj.normals, slice(5, 8)))
+    for column, pool, attribute in attributes:
+        present = corners[:, column] > 0
+        if present.all():
+            vertices[:, attribute] = pool[corners[:, column] - 1]
+        elif present.any():
+            vertices[present, attribute] = pool[corners[present, column] - 1]
+
+    return vertices.ravel()
+
+
+class _ObjParser:
+    """
+        Accumulates the records of an obj file, one chunk of whole lines
+        at a time.
+    """
+    __slots__ = (
+        "pools", "pool_sizes", "corners", "corner_counts", "face_materials",
+        "material_ids", "current_material", "mtl_file")
+
+
+    def __init__(self):
+
+        self.pools: tuple[list[np.ndarray], ...] = ([], [], [])
+        self.pool_sizes = [0, 0, 0]
+        self.corners: list[np.ndarray] = []
+        self.corner_counts: list[np.ndarray] = []
+        self.face_materials: list[np.ndarray] = []
+        self.material_ids: dict[str, int] = {}
+        self.current_material = -1
+        self.mtl_file = None
+
+    def feed(self, chunk: bytes) -> None:
+        """
+            Parse a chunk of text ending with a newline.
+        """
+
+        buf = np.frombuffer(chunk, dtype=np.uint8)
+        starts, ends = _line_bounds(buf)
+
+        stripped = _strip_lines(buf, starts, ends)
+        if stripped is not None:
+            buf = stripped
+            chunk = buf.tobytes()
+            starts, ends = _line_bounds(buf)
+        lengths = ends - starts
+
+        first = _char_at(buf, starts, lengths, 0)
+        second = _char_at(buf, starts, lengths, 1)
+        third = _char_at(buf, starts, lengths, 2)
+
+        is_vertex = first == ord("v")
+        record_types = (
+            is_vertex & _is_blank(second),
+            is_vertex & (second == ord("t")) & _is_blank(third),
+            is_vertex & (second == ord("n")) & _is_blank(third),
+        )
+        is_face = (first == ord("f")) & _is_blank(second)
+
+        face_lines = np.flatnonzero(is_face)
+        face_materials = self._read_keywords(chunk, starts, ends, first, face_lines)
+
+        if face_lines.size:
+            corners, counts = _read_faces(_gather(buf, starts, lengths, is_face, 1))
+
+            if (corners < 0).any():
+                self._resolve_relative(corners, counts, face_lines, record_types)
+
+            self.corners.append(corners)
+            self.corner_counts.append(counts)
+            self.face_materials.append(face_materials)
+
+        for i, (selected, skip, width) in enumerate(
+            zip(record_types, (1, 2, 2), (3, 2, 3))):
+
+            if not selected.any():
+                continue
+            records = _read_records(_gather(buf, starts, lengths, selected, skip), width)
+            self.pools[i].append(records)
+            self.pool_sizes[i] += len(records)
+
+    def _resolve_relative(self,
+        corners: np.ndarray, counts: np.ndarray,
+        face_lines: np.ndarray, record_types: tuple[np.ndarray, ...]) -> None:
+        """
+            Turn negative (relative) indices into absolute ones, counting
+            the records declared before each face.
+        """
+
+        corner_lines = np.repeat(face_lines, counts)
+        for i, selected in enumerate(record_types):
+            relative = corners[:, i] < 0
+            declared = self.pool_sizes[i] + np.cumsum(selected)[corner_lines[relative]]
+            corners[relative, i] += declared + 1
+
+    def _read_keywords(self, 
+        chunk: bytes, starts: np.ndarray, ends: np.ndarray, 
+        first: np.ndarray, face_lines: np.ndarray) -> np.ndarray:
+        """
+            Read the usemtl and mtllib statements of the chunk.
+
+            Returns:
+
+                The material index active on each of the face lines
+        """
+
+        switch_lines = []
+        switch_ids = [self.current_material]
+
+        for line in np.flatnonzero((first == ord("u")) | (first == ord("m"))):
+            words = chunk[starts[line]:ends[line]].split()
+            if words[0] == b"usemtl":
+                name = words[1].decode() if len(words) > 1 else "Material.002"
+                switch_lines.append(line)
+                switch_ids.append(
+                    self.material_ids.setdefault(name, len(self.material_ids)))
+            elif words[0] == b"mtllib":
+                self.mtl_file = words[1].decode()
+
+        self.current_material = switch_ids[-1]
+
+        switch_ids = np.array(switch_ids, dtype=np.int64)
+        return switch_ids[np.searchsorted(
+            np.array(switch_lines, dtype=np.int64), face_lines)]
+
+    def finish(self) -> ObjData:
+        """
+            Assemble the parsed chunks and triangulate the faces.
+        """
+
+        obj = ObjData()
+        obj.mtl_file = self.mtl_file
+        obj.material_names = list(self.material_ids)
+        if self.current_material >= 0:
+            obj.final_material = obj.material_names[self.current_material]
+
+        for i, name in enumerate(("positions", "texcoords", "normals")):
+            if self.pools[i]:
+                setattr(obj, name, np.concatenate(self.pools[i]).astype(np.float32))
+
+        if not self.corners:
+            return obj
+
+        obj.corners = np.concatenate(self.corners)
+        counts = np.concatenate(self.corner_counts)
+        face_materials = np.concatenate(self.face_materials)
+
+        triangle_counts = np.maximum(counts - 2, 0)
+        first_corner = np.cumsum(counts) - counts
+        face = np.repeat(np.arange(len(counts)), triangle_counts)
+        fan = np.arange(len(face)) - np.repeat(
+            np.cumsum(triangle_counts) - triangle_counts, triangle_counts)
+
+        base = first_corner[face]
+        obj.triangles = np.stack((base, base + fan + 1, base + fan + 2), axis=1)
+        obj.triangle_materials = face_materials[face]
+
+        return obj
+
+
+def _line_bounds(buf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Returns the start of every line and the position of its newline.
+    """
+
+    ends = np.flatnonzero(buf == _NEWLINE)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    return starts, ends
+
+
+def _strip_lines(buf: np.ndarray, starts: np.ndarray, 
+    ends: np.ndarray) -> np.ndarray | None:
+    """
+        Remove the blanks leading each line and the comments trailing
+        them, so that records are told apart by their first characters.
+
+        Returns:
+
+            The stripped text, newlines kept, or None when there is
+            nothing to strip
+    """
+
+    hashes = np.flatnonzero(buf == ord("#"))
+    indented = _is_blank(buf[starts]) & (starts < ends)
+    trailing = hashes[(hashes > 0) & (buf[hashes - 1] != _NEWLINE)] if hashes.size else hashes
+    if not indented.any() and not trailing.size:
+        return None
+
+    # The first character of each line which is not a blank,
+    # its newline at the latest
+    filled = np.flatnonzero(~_is_blank(buf))
+    first = filled[np.searchsorted(filled, starts)]
+
+    # The first comment of each line, its newline when it has none
+    comment = ends.copy()
+    if hashes.size:
+        following = hashes[np.minimum(np.searchsorted(hashes, starts), hashes.size - 1)]
+        comment = np.where((following >= starts) & (following < ends), following, ends)
+
+    # Remove [start, first) and [comment, end) of every line
+    delta = np.zeros(len(buf) + 1, dtype=np.int64)
+    np.add.at(delta, starts, 1)
+    np.add.at(delta, first, -1)
+    np.add.at(delta, comment, 1)
+    np.add.at(delta, ends, -1)
+
+    return buf[np.cumsum(delta[:-1]) == 0]
+
+
+def _char_at(buf: np.ndarray, starts: np.ndarray, 
+    lengths: np.ndarray, offset: int) -> np.ndarray:
+    """
+        Returns the character at the given offset of every line,
+        or 0 for lines which are too short.
+    """
+
+    return np.where(
+        lengths > offset, buf[np.minimum(starts + offset, len(buf) - 1)], 0)
+
+
+def _is_blank(chars: np.ndarray) -> np.ndarray:
+
+    return (chars == ord(" ")) | (chars == ord("\t")) | (chars == ord("\r"))
+
+
+def _gather(buf: np.ndarray, starts: np.ndarray, lengths: np.ndarray, 
+    selected: np.ndarray, skip: int) -> np.ndarray:
+    """
+        Returns the concatenation of the selected lines, newline included,
+        without their first skip characters.
+    """
+
+    mask = np.repeat(selected, lengths + 1)
+    for offset in range(skip):
+        mask[starts[selected] + offset] = False
+
+    return buf[mask]
+
+
+def _read_records(text: np.ndarray, width: int) -> np.ndarray:
+    """
+        Read one row of floats per line, keeping the first width values.
+    """
+
+    count = int(np.count_nonzero(text == _NEWLINE))
+    values = np.fromstring(text.tobytes(), dtype=np.float64, sep=" ")
+
+    if values.size != count * width:
+        # Some records carry extra values (e.g. vertex colours)
+        values = np.array(
+            [line.split()[:width] for line in text.tobytes().splitlines()],
+            dtype=np.float64)
+
+    return values.reshape(count, width)
+
+
+def _read_faces(text: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+        Read face records, one per line, of the form "v", "v/vt", 
+        "v//vn" or "v/vt/vn".
+
+        Returns:
+
+            (n, 3) corner indices, 0 where a field is absent, 
+            and the number of corners of each face.
+    """
+
+    newline = text == _NEWLINE
+    blank = newline | _is_blank(text)
+    slash = text == ord("/")
+    numeric = ((text >= ord("0")) & (text <= ord("9"))) \
+        | (text == ord("-")) | (text == ord("+"))
+
+    token_start = ~blank
+    token_start[1:] &= blank[:-1]
+    number_start = numeric.copy()
+    number_start[1:] &= ~numeric[:-1]
+
+    newline_positions = np.flatnonzero(newline)
+    slash_positions = np.flatnonzero(slash)
+    token_positions = np.flatnonzero(token_start)
+    number_positions = np.flatnonzero(number_start)
+
+    counts = np.diff(
+        np.searchsorted(token_positions, newline_positions), prepend=0)
+
+    spaced = text.copy()
+    spaced[slash] = ord(" ")
+    values = np.fromstring(spaced.tobytes(), dtype=np.int64, sep=" ")
+    if values.size != number_positions.size:
+        raise ValueError("Malformed face record in obj file")
+
+    if _all_full_corners(token_positions, number_positions, slash_positions, len(text)):
+        return values.reshape(-1, 3), counts
+
+    # Each number belongs to the latest token, its field is given by the
+    # slashes seen since that token started.
+    token = np.searchsorted(token_positions, number_positions, side="right") - 1
+    field = np.searchsorted(slash_positions, number_positions) \
+        - np.searchsorted(slash_positions, token_positions)[token]
+
+    corners = np.zeros((token_positions.size, 3), dtype=np.int64)
+    keep = field < 3
+    corners[token[keep], field[keep]] = values[keep]
+
+    return corners, counts
+
+
+def _all_full_corners(token_positions: np.ndarray, number_positions: np.ndarray,
+    slash_positions: np.ndarray, end: int) -> bool:
+    """
+        Check whether every corner is written "v/vt/vn", in which case
+        the numbers can be read three at a time.
+    """
+
+    if number_positions.size != 3 * token_positions.size \
+        or slash_positions.size != 2 * token_positions.size:
+        return False
+
+    numbers = number_positions.reshape(-1, 3)
+    slashes = slash_positions.reshape(-1, 2)
+    next_token = np.append(token_positions[1:], end)
+
+    return bool(
+        (numbers[:, 0] == token_positions).all()
+        and (slashes[:, 0] < numbers[:, 1]).all()
+        and (numbers[:, 1] < slashes[:, 1]).all()
+        and (slashes[:, 1] < numbers[:, 2]).all()
+        and (numbers[:, 2] < next_token).all()
+        and (numbers[:, 0] < slashes[:, 0]).all())
+
+
+############################## parallel group building ########################
+
+# Environment variable giving the default number of loader processes
+OBJ_LOADER_WORKERS_ENV = "OBJ_LOADER_WORKERS"
+
+
+def _workers_from_environment() -> int:
+    """
+        Returns the number of loader processes set in the environment,
+        1 when it is unset or not a number.
+    """
+
+    value = os.environ.get(OBJ_LOADER_WORKERS_ENV, "1")
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"Warning: ignoring {OBJ_LOADER_WORKERS_ENV}={value!r}, using 1 worker")
+        return 1
+
+
+def _build_group(obj: ObjData, triangles: np.ndarray, indexed: bool) -> dict:
+    """
+        Returns the vertex data of one material group.
+    """
+
+    if indexed:
+        vertices, indices = build_indexed_vertex_stream(obj, triangles)
+        group = {"vertices": vertices, "indices": indices}
+    else:
+        group = {"vertices": build_vertex_stream(obj, triangles)}
+
+    group["aabb"], group["sphere"] = bounding_volumes(group["vertices"])
+    return group
+
+
+def bounding_volumes(vertices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the bounding box and bounding sphere of a vertex stream.
+
+    Parameters:
+        vertices: flattened vertex data (x, y, z, s, t, nx, ny, nz)
+
+    Returns:
+        aabb: (2, 3) float32, the minimum then the maximum corner
+        sphere: (4,) float32, the center (that of the box) then the radius
+    """
+
+    positions = np.asarray(vertices, dtype=np.float32).reshape(-1, 8)[:, :3]
+    if len(positions) == 0:
+        return np.zeros((2, 3), dtype=np.float32), np.zeros(4, dtype=np.float32)
+
+    aabb = np.stack((positions.min(axis=0), positions.max(axis=0)))
+    center = aabb.mean(axis=0)
+    radius = np.sqrt(((positions - center) ** 2).sum(axis=1).max())
+
+    return aabb, np.append(center, radius).astype(np.float32)
+
+
+def _build_groups_in_parallel(obj: ObjData, groups: list[np.ndarray], 
+    indexed: bool, workers: int) -> list[dict]:
+    """
+        Build the material groups in worker processes. The attribute pools
+        and triangles are placed in shared memory once, and every worker
+        hands its result back through a new shared memory block.
+    """
+
+    bounds = np.cumsum([0] + [len(triangles) for triangles in groups])
+    arrays = {
+        "positions": obj.positions,
+        "texcoords": obj.texcoords,
+        "normals": obj.normals,
+        "corners": obj.corners,
+        "triangles": np.concatenate(groups),
+    }
+
+    blocks = []
+    futures = {}
+    try:
+        shared = {}
+        for name, array in arrays.items():
+            block, shared[name] = _share(array)
+            blocks.append(block)
+
+        # Biggest groups first, so that no worker is left with a large
+        # group at the end.
+        order = np.argsort(-np.diff(bounds), kind="stable")
+        results = [None] * len(groups)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _build_shared_group, shared, 
+                    int(bounds[i]), int(bounds[i + 1]), indexed): i
+                for i in order
+            }
+            for future, i in futures.items():
+                results[i] = {
+                    key: _take_shared(descriptor)
+                    for key, descriptor in future.result().items()
+                }
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+        # The executor waited for every worker: free the outputs that were
+        # not taken, when another worker or a copy failed
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                for descriptor in future.result().values():
+                    _discard_shared(descriptor)
+
+    return results
+
+
+def _build_shared_group(shared: dict[str, tuple], 
+    start: int, stop: int, indexed: bool) -> dict[str, tuple]:
+    """
+        Worker side of _build_groups_in_parallel, builds the group made
+        of the shared triangles [start, stop).
+
+        Returns:
+
+            The shared memory descriptor of each output array
+    """
+
+    blocks = [SharedMemory(name=descriptor[0]) for descriptor in shared.values()]
+    try:
+        group = _build_group_from_blocks(blocks, shared, start, stop, indexed)
+    finally:
+        for block in blocks:
+            block.close()
+
+    output = {}
+    for key, array in group.items():
+        block, output[key] = _share(array)
+        block.close()
+    return output
+
+
+def _build_group_from_blocks(blocks: list[SharedMemory], shared: dict[str, tuple],
+    start: int, stop: int, indexed: bool) -> dict:
+    """
+        Build a group from views of the shared arrays. The views are
+        released when this returns, so the blocks can then be closed.
+    """
+
+    obj = ObjData()
+    for block, (name, (_, shape, dtype)) in zip(blocks, shared.items()):
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        if name == "triangles":
+            triangles = view[start:stop]
+        else:
+            setattr(obj, name, view)
+
+    return _build_group(obj, triangles, indexed)
+
+
+def _share(array: np.ndarray) -> tuple[SharedMemory, tuple]:
+    """
+        Copy an array into a new shared memory block.
+
+        Returns:
+
+            The block and its (name, shape, dtype) descriptor
+    """
+
+    block = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _take_shared(descriptor: tuple) -> np.ndarray:
+    """
+        Copy an array out of a shared memory block created by a worker,
+        then free the block.
+    """
+
+    name, shape, dtype = descriptor
+    block = SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
+
+    return array
+
+
+def _discard_shared(descriptor: tuple) -> None:
+    """
+        Free a shared memory block created by a worker, if it still exists.
+    """
+
+    try:
+        block = SharedMemory(name=descriptor[0])
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
@@ -0,0 +1,306 @@
+import numpy as np
+
+############################## spatial tree ###################################
+
+# A cell holding more triangles than this is split in eight
+SPATIAL_LEAF_TRIANGLES = 16384
+
+# Cells are split at most this many times
+SPATIAL_MAX_DEPTH = 6
+
+
+class SpatialTree:
+    """
+        An octree over the triangles of a model, in model space.
+
+        The triangles of every material group are sorted by leaf, so that
+        each leaf owns one contiguous range of each group's index buffer
+        (the group's "leaf_ranges"). Node bounds are tight around the
+        triangles below the node.
+    """
+    __slots__ = ("bounds", "children", "leaf", "leaf_nodes", "leaf_bounds", "leaf_spheres")
+
+
+    def __init__(self, bounds: np.ndarray, children: np.ndarray, leaf: np.ndarray):
+        """
+            Parameters:
+
+                bounds: (n, 2, 3) float32 minimum then maximum corner of each node.
+
+                children: (n, 2) int32 first child and number of children of
+                    each node, the children of a node are consecutive.
+
+                leaf: (n,) int32 leaf number of each node, -1 for inner nodes.
+        """
+
+        self.bounds = bounds
+        self.children = children
+        self.leaf = leaf
+
+        self.leaf_nodes = np.flatnonzero(leaf >= 0)
+        self.leaf_bounds = np.ascontiguousarray(bounds[self.leaf_nodes], dtype=np.float32)
+        centers = self.leaf_bounds.mean(axis=1)
+        radii = np.linalg.norm(self.leaf_bounds[:, 1] - self.leaf_bounds[:, 0], axis=1) / 2
+        self.leaf_spheres = np.concatenate((centers, radii[:, None]), axis=1).astype(np.float32)
+
+    @property
+    def leaf_count(self) -> int:
+
+        return len(self.leaf_nodes)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+            Returns the arrays to persist, see from_arrays.
+        """
+
+        return {"bounds": self.bounds, "children": self.children, "leaf": self.leaf}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "SpatialTree":
+
+        return cls(np.asarray(arrays["bounds"]), np.asarray(arrays["children"]),
+            np.asarray(arrays["leaf"]))
+
+    def _query(self, hits) -> np.ndarray:
+        """
+            Walk down the tree, one level at a time, into the nodes
+            for which hits(bounds) is true.
+
+            Returns:
+
+                The sorted leaf numbers reached.
+        """
+
+        found = []
+        frontier = np.zeros(1, dtype=np.int64)
+        while len(frontier):
+            frontier = frontier[hits(self.bounds[frontier])]
+            leaves = self.leaf[frontier]
+            found.append(leaves[leaves >= 0])
+
+            first, count = self.children[frontier].T
+            first, count = first[count > 0], count[count > 0]
+            # Expand each (first, count) into first, first + 1, ..., first + count - 1
+            offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+            frontier = np.repeat(first, count) + offsets
+
+        return np.sort(np.concatenate(found))
+
+    def query_box(self, low: np.ndarray, high: np.ndarray,
+        transform: np.ndarray | None = None) -> np.ndarray:
+        """
+            Returns the leaves overlapping a box.
+
+            Parameters:
+
+                low, high: minimum and maximum corner of the box.
+
+                transform: model transform of the tree, the box is then
+                    given in world space and should stay small, as its
+                    model space bounds are used.
+        """
+
+        low, high = np.asarray(low, dtype=np.float32), np.asarray(high, dtype=np.float32)
+        if transform is not None:
+            corners = np.array(np.meshgrid(*zip(low, high))).reshape(3, -1).T
+            corners = _to_model_space(corners, transform)
+            low, high = corners.min(axis=0), corners.max(axis=0)
+
+        return self._query(lambda bounds:
+            (bounds[:, 0] <= high).all(axis=1) & (bounds[:, 1] >= low).all(axis=1))
+
+    def query_sphere(self, center: np.ndarray, radius: float,
+        transform: np.ndarray | None = None) -> np.ndarray:
+        """
+            Returns the leaves overlapping a sphere.
+
+            Parameters:
+
+                center, radius: the sphere.
+
+                transform: model transform of the tree, the sphere is
+                    then given in world space.
+        """
+
+        center = np.asarray(center, dtype=np.float32)
+        if transform is not None:
+            center = _to_model_space(center[None], transform)[0]
+            radius = radius / np.linalg.norm(transform[:3, :3], axis=1).max()
+
+        def hits(bounds: np.ndarray) -> np.ndarray:
+            closest = np.clip(center, bounds[:, 0], bounds[:, 1])
+            return ((closest - center) ** 2).sum(axis=1) <= radius * radius
+
+        return self._query(hits)
+
+
+def build_spatial_tree(groups: dict[str, dict],
+    leaf_triangles: int = SPATIAL_LEAF_TRIANGLES,
+    max_depth: int = SPATIAL_MAX_DEPTH) -> SpatialTree:
+    """
+    Build an octree over the triangle centroids of indexed material
+    groups, then sort the triangles of every group by leaf, in place.
+
+    Each group gains "leaf_ranges", a (leaves, 2) uint32 array of the
+    first index and index count of each leaf in its "indices".
+    """
+
+    positions = [data["vertices"].reshape(-1, 8)[:, :3] for data in groups.values()]
+    triangles = [data["indices"].reshape(-1, 3) for data in groups.values()]
+    corners = np.concatenate(
+        [p[t] for p, t in zip(positions, triangles)]
+        or [np.zeros((0, 3, 3), dtype=np.float32)]).astype(np.float32)
+
+    tree, leaf_of = _build_octree(corners, leaf_triangles, max_depth)
+
+    start = 0
+    for data, group_triangles in zip(groups.values(), triangles):
+        leaves = leaf_of[start:start + len(group_triangles)]
+        start += len(group_triangles)
+
+        order = np.argsort(leaves, kind="stable")
+        data["indices"] = np.ascontiguousarray(group_triangles[order].ravel())
+
+        counts = np.bincount(leaves, minlength=tree.leaf_count)
+        data["leaf_ranges"] = np.stack(
+            ((np.cumsum(counts) - counts) * 3, counts * 3), axis=1).astype(np.uint32)
+
+    return tree
+
+
+def _build_octree(corners: np.ndarray, leaf_triangles: int,
+    max_depth: int) -> tuple[SpatialTree, np.ndarray]:
+    """
+    Split the cells of an octree over triangle centroids, one level
+    at a time, until every cell is small enough.
+
+    Parameters:
+        corners: (triangles, 3, 3) corner positions
+
+    Returns:
+        The tree and the leaf of every triangle.
+    """
+
+    if len(corners) == 0:
+        tree = SpatialTree(np.zeros((1, 2, 3), dtype=np.float32),
+            np.zeros((1, 2), dtype=np.int32), np.zeros(1, dtype=np.int32))
+        return tree, np.zeros(0, dtype=np.int64)
+
+    centroids = corners.mean(axis=1)
+    low, high = centroids.min(axis=0), centroids.max(axis=0)
+
+    # Cells split around their center, at a fixed size for each depth
+    centers = ((low + high) / 2)[None]
+    halves = ((high - low) / 2)[None]
+    parents = np.full(1, -1, dtype=np.int64)
+    depths = np.zeros(1, dtype=np.int64)
+    children = np.zeros((1, 2), dtype=np.int64)
+
+    node_of = np.zeros(len(corners), dtype=np.int64)
+    frontier = np.zeros(1, dtype=np.int64)
+    for depth in range(1, max_depth + 1):
+        counts = np.bincount(node_of, minlength=len(centers))
+        split = frontier[counts[frontier] > leaf_triangles]
+        if not len(split):
+            break
+
+        moving = np.isin(node_of, split)
+        parent = node_of[moving]
+        octant = ((centroids[moving] > centers[parent]) * (1, 2, 4)).sum(axis=1)
+        keys, inverse = np.unique(parent * 8 + octant, return_inverse=True)
+
+        # keys are sorted, so the children of a cell are consecutive
+        first_id = len(centers)
+        child_parents, child_octants = keys // 8, keys % 8
+        node_of[moving] = first_id + inverse.ravel()
+
+        signs = ((child_octants[:, None] >> np.arange(3)) & 1) * 2 - 1
+        child_halves = halves[child_parents] / 2
+        centers = np.concatenate((centers, centers[child_parents] + signs * child_halves))
+        halves = np.concatenate((halves, child_halves))
+        parents = np.concatenate((parents, child_parents))
+        depths = np.concatenate((depths, np.full(len(keys), depth)))
+        children = np.concatenate((children, np.zeros((len(keys), 2), dtype=np.int64)))
+
+        split_parents, first, count = np.unique(
+            child_parents, return_index=True, return_counts=True)
+        children[split_parents, 0] = first_id + first
+        children[split_parents, 1] = count
+
+        frontier = first_id + np.arange(len(keys))
+
+    # Tight bounds, from the triangles up to the root
+    bounds = np.empty((len(centers), 2, 3), dtype=np.float32)
+    bounds[:, 0], bounds[:, 1] = np.inf, -np.inf
+    np.minimum.at(bounds[:, 0], node_of, corners.min(axis=1))
+    np.maximum.at(bounds[:, 1], node_of, corners.max(axis=1))
+    for depth in range(depths.max(), 0, -1):
+        level = np.flatnonzero(depths == depth)
+        np.minimum.at(bounds[:, 0], parents[level], bounds[level, 0])
+        np.maximum.at(bounds[:, 1], parents[level], bounds[level, 1])
+
+    leaf = np.full(len(centers), -1, dtype=np.int32)
+    leaf_nodes = np.flatnonzero(children[:, 1] == 0)
+    leaf[leaf_nodes] = np.arange(len(leaf_nodes))
+
+    tree = SpatialTree(bounds, children.astype(np.int32), leaf)
+    return tree, leaf[node_of].astype(np.int64)
+
+
+def triangles_in_leaves(data: dict, leaves: np.ndarray) -> np.ndarray:
+    """
+    Returns the corner positions of a group's triangles in some leaves,
+    for gameplay queries such as collisions.
+
+    Parameters:
+        data: a material group with its "leaf_ranges"
+        leaves: leaf numbers, as returned by the tree queries
+
+    Returns:
+        (triangles, 3, 3) float32 model space positions
+    """
+
+    ranges = data["leaf_ranges"][leaves]
+    indices = np.concatenate(
+        [data["indices"][first:first + count] for first, count in ranges]
+        or [np.zeros(0, dtype=np.uint32)])
+    positions = data["vertices"].reshape(-1, 8)[:, :3]
+    return np.asarray(positions[indices.reshape(-1, 3)], dtype=np.float32)
+
+
+def visible_ranges(leaf_ranges: np.ndarray, visible: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Returns the index ranges to draw for the visible leaves of a group,
+    merging the ranges of leaves which follow each other.
+
+    Parameters:
+        leaf_ranges: (leaves, 2) first index and index count of each leaf
+        visible: (leaves,) bool
+        limit: number of indices available, the rest is not uploaded yet
+
+    Returns:
+        (ranges, 2) int64 first index and index count
+    """
+
+    ranges = leaf_ranges[visible & (leaf_ranges[:, 1] > 0)].astype(np.int64)
+    first = ranges[:, 0]
+    end = np.minimum(first + ranges[:, 1], limit)
+    keep = first < end
+    first, end = first[keep], end[keep]
+    if not len(first):
+        return np.zeros((0, 2), dtype=np.int64)
+
+    starts = np.concatenate(([True], first[1:] != end[:-1]))
+    run_first = first[starts]
+    run_end = end[np.concatenate((np.flatnonzero(starts)[1:] - 1, [len(end) - 1]))]
+    return np.stack((run_first, run_end - run_first), axis=1)
+
+
+def _to_model_space(points: np.ndarray, transform: np.ndarray) -> np.ndarray:
+    """
+    Returns world space points in the space of a model transform,
+    which is applied to row vectors.
+    """
+
+    homogeneous = np.concatenate((points, np.ones((len(points), 1))), axis=1)
+    return (homogeneous @ np.linalg.inv(transform))[:, :3].astype(np.float32)